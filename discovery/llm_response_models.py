@@ -59,3 +59,15 @@ class ProductInfo(BaseModel):
     distributor: Optional[str] = Field(default=None)
     barcode: Optional[str] = Field(default=None)
     metadata: Metadata = Field(...)
+
+
+class ProductInfoBatchItem(ProductInfo):
+    index: int = Field(
+        ..., description="The number of the item the product was extracted from."
+    )
+
+
+class ProductInfoBatch(BaseModel):
+    items: List[ProductInfoBatchItem] = Field(
+        ..., description="One product per item of the input, in the same order."
+    )
@@ -0,0 +1,283 @@
+import contextlib
+import glob
+import json
+import os
+import statistics
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from discovery.management.commands.benchmark_reconstruction import (
+    generate_dense_label,
+)
+from discovery.services import gen_ai, ocr
+from discovery.services.memory import (
+    current_rss_bytes,
+    peak_rss_bytes,
+    reset_peak_rss,
+)
+from discovery.services.ocr import (
+    deserialize_ocr_output,
+    process_image_with_ocr,
+    serialize_ocr_output,
+)
+from discovery.services.reconstruction import (
+    reconstruct_llm_input,
+    reconstruct_text_with_columns,
+)
+from discovery.tasks import resize_image
+
+DEFAULT_FIXTURES_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "benchmarks", "fixtures"
+)
+
+STUB_PRODUCT = {
+    "name": "Benchmark Product",
+    "description": "A product of the benchmark fixtures",
+    "category": "Groceries",
+    "manufacturer": "Benchmark Ltd",
+    "metadata": {"net_weight": "500g", "ingredients": ["water", "salt"]},
+}
+# No tokens, so that the stubbed completions add nothing to the token counters
+STUB_USAGE = SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def generate_fixture(directory, index, boxes):
+    """
+    Writes a synthetic package photo and its OCR output. The photo is a large
+    noisy image with the text boxes of a dense label drawn onto it.
+    """
+    label = generate_dense_label(boxes, seed=index)
+    rng = np.random.default_rng(index)
+    img = rng.integers(150, 230, size=(4000, 3000, 3), dtype=np.uint8)
+    for text, poly in zip(label[0]["rec_texts"], label[0]["rec_polys"]):
+        x, y = int(poly[0][0]), int(poly[0][1])
+        height = int(poly[2][1] - poly[0][1])
+        cv2.putText(
+            img,
+            text[:12],
+            (x, y + height),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            max(0.4, height / 30),
+            (20, 20, 20),
+            2,
+        )
+    name = f"synthetic_{index:03d}"
+    cv2.imwrite(os.path.join(directory, f"{name}.jpg"), img)
+    with open(os.path.join(directory, f"{name}.ocr.json"), "w") as f:
+        json.dump(serialize_ocr_output([label]), f)
+
+
+def stub_completion(delay=0.0):
+    """
+    Offline stand-in for create_completion, so that infer_product_details still
+    builds the prompt and validates the response.
+    """
+
+    def create_completion(messages, response_model, timeout=None, **kwargs):
+        if delay:
+            time.sleep(delay)
+        response = response_model.model_validate(STUB_PRODUCT)
+        # Where instructor keeps the completion with its token usage
+        response._raw_response = SimpleNamespace(usage=STUB_USAGE)
+        return response
+
+    return create_completion
+
+
+class Command(BaseCommand):
+    help = (
+        "Times resize, OCR, reconstruction and a stubbed inference on a fixture "
+        "set of package photos with recorded OCR outputs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR)
+        parser.add_argument(
+            "--generate",
+            type=int,
+            default=0,
+            help="Write this many synthetic fixtures to the fixtures directory first.",
+        )
+        parser.add_argument("--boxes", type=int, default=300)
+        parser.add_argument(
+            "--record",
+            action="store_true",
+            help="Run OCR on the photos and save the outputs as the fixtures.",
+        )
+        parser.add_argument(
+            "--live-ocr",
+            action="store_true",
+            help="Also time process_image_with_ocr, which needs the OCR models.",
+        )
+        parser.add_argument(
+            "--backend",
+            action="append",
+            help="OCR backend to time with --live-ocr, can be given several times "
+            "to compare them. Defaults to OCR_BACKEND.",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--llm-delay",
+            type=float,
+            default=0.0,
+            help="Seconds the stubbed inference takes.",
+        )
+        parser.add_argument("--save", help="Write the results to this JSON file.")
+        parser.add_argument(
+            "--baseline",
+            help="Compare against results saved with --save and fail on regressions.",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Allowed p95 slowdown over the baseline, 0.2 is 20%%.",
+        )
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options["fixtures"])
+        os.makedirs(directory, exist_ok=True)
+        for index in range(options["generate"]):
+            generate_fixture(directory, index, options["boxes"])
+
+        photos = sorted(
+            path
+            for path in glob.glob(os.path.join(directory, "*"))
+            if path.lower().endswith((".jpg", ".jpeg", ".png"))
+        )
+        if not photos:
+            raise CommandError(
+                f"No fixture photos in {directory}, use --generate to create some."
+            )
+
+        if options["record"]:
+            for photo in photos:
+                raw_ocr_output = process_image_with_ocr([photo])
+                with open(self._ocr_path(photo), "w") as f:
+                    json.dump(serialize_ocr_output(raw_ocr_output), f)
+            self.stdout.write(f"Recorded OCR outputs of {len(photos)} photos.")
+
+        recorded = {}
+        for photo in photos:
+            if os.path.exists(self._ocr_path(photo)):
+                with open(self._ocr_path(photo)) as f:
+                    recorded[photo] = deserialize_ocr_output(json.load(f))
+        self.stdout.write(
+            f"{len(photos)} photos, {len(recorded)} with recorded OCR output, "
+            f"repeat {options['repeat']}"
+        )
+
+        repeat = options["repeat"]
+        results = {}
+        results["resize_image"] = self._time(
+            photos, lambda photo: os.remove(resize_image(photo)), repeat
+        )
+        if options["live_ocr"]:
+            for backend in options["backend"] or [settings.OCR_BACKEND]:
+                # A fresh engine per backend, the first call loads the models
+                ocr.GLOBAL_OCR = None
+                with override_settings(OCR_BACKEND=backend):
+                    results[f"process_image_with_ocr[{backend}]"] = self._time(
+                        photos, lambda photo: process_image_with_ocr([photo]), 1
+                    )
+        outputs = list(recorded.values())
+        results["reconstruct_text_with_columns"] = self._time(
+            outputs, lambda output: reconstruct_text_with_columns(output[0]), repeat
+        )
+        results["reconstruct_llm_input"] = self._time(
+            outputs, reconstruct_llm_input, repeat
+        )
+        # infer_product_details prints every product, which is not timed
+        with open(os.devnull, "w") as devnull, mock.patch.object(
+            gen_ai, "create_completion", stub_completion(options["llm_delay"])
+        ), contextlib.redirect_stdout(devnull):
+            results["infer_product_details (stub)"] = self._time(
+                outputs,
+                lambda output: gen_ai.infer_product_details(
+                    reconstruct_llm_input(output)
+                ),
+                repeat,
+            )
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<32} n={result['count']:<5} "
+                f"p50={result['p50_ms']:9.2f}ms p95={result['p95_ms']:9.2f}ms "
+                f"throughput={result['throughput']:9.1f}/s "
+                f"peak_rss={result['peak_rss_mb']:7.1f}MB "
+                f"(+{result['rss_growth_mb']:.1f}MB)"
+            )
+
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Saved results to {options['save']}")
+
+        if options["baseline"]:
+            self._check_regressions(results, options["baseline"], options["threshold"])
+
+    def _ocr_path(self, photo):
+        return f"{os.path.splitext(photo)[0]}.ocr.json"
+
+    def _time(self, items, func, repeat):
+        """
+        Calls func on every item repeat times, after one untimed warm up call.
+        The peak RSS is that of the process while the stage ran and the growth
+        is how far it went over the RSS the stage started with. Without procfs
+        the peak cannot be reset and is the peak of the whole run so far.
+        """
+        reset_peak_rss()
+        start_rss = current_rss_bytes()
+        if items:
+            func(items[0])
+        timings = []
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for item in items:
+                call_start = time.perf_counter()
+                func(item)
+                timings.append((time.perf_counter() - call_start) * 1000)
+        elapsed = time.perf_counter() - start
+        peak_rss = peak_rss_bytes()
+        return {
+            "count": len(timings),
+            "p50_ms": round(statistics.median(timings), 3) if timings else 0.0,
+            "p95_ms": round(percentile(timings, 95), 3),
+            "throughput": round(len(timings) / elapsed, 2) if elapsed else 0.0,
+            "peak_rss_mb": round(peak_rss / 2**20, 1),
+            "rss_growth_mb": round(max(peak_rss - start_rss, 0) / 2**20, 1),
+        }
+
+    def _check_regressions(self, results, baseline_path, threshold):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before or not before["p95_ms"]:
+                continue
+            change = result["p95_ms"] / before["p95_ms"] - 1
+            self.stdout.write(f"{name:<32} p95 {change:+.1%} against the baseline")
+            if change > threshold:
+                regressions.append(
+                    f"{name}: p95 {before['p95_ms']}ms -> {result['p95_ms']}ms"
+                )
+
+        if regressions:
+            raise CommandError(
+                f"Slower than the baseline by more than {threshold:.0%}: "
+                + "; ".join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
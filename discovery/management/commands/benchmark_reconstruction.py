@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from discovery.services.reconstruction import (
+    create_text_block_json,
+    reconstruct_text_with_columns,
+)
+
+
+def generate_dense_label(boxes, seed=0):
+    """
+    Builds a synthetic single image OCR result that looks like a dense label:
+    lines of mixed font sizes with several words and columns per line.
+    """
+    rng = random.Random(seed)
+    texts, scores, polygons = [], [], []
+    y = 10
+    while len(texts) < boxes:
+        height = rng.choice([12, 14, 16, 20, 40, 80])
+        x = 10
+        for _ in range(rng.randint(1, 6)):
+            width = rng.randint(30, 300)
+            jitter = rng.randint(-2, 2)
+            polygons.append(
+                np.array(
+                    [
+                        [x, y + jitter],
+                        [x + width, y + jitter],
+                        [x + width, y + height + jitter],
+                        [x, y + height + jitter],
+                    ],
+                    dtype=np.int16,
+                )
+            )
+            texts.append("W" * max(1, width // 10))
+            scores.append(rng.uniform(0.5, 1.0))
+            x += width + rng.choice([5, 8, 60, 200])
+        y += height + rng.randint(2, 10)
+
+    return [
+        {
+            "rec_texts": texts[:boxes],
+            "rec_scores": scores[:boxes],
+            "rec_polys": polygons[:boxes],
+        }
+    ]
+
+
+class Command(BaseCommand):
+    help = "Times the layout reconstruction on synthetic dense labels."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--boxes",
+            type=int,
+            nargs="+",
+            default=[100, 500, 1000],
+            help="Number of text boxes per label.",
+        )
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        for boxes in options["boxes"]:
+            label = generate_dense_label(boxes)
+            for func in (reconstruct_text_with_columns, create_text_block_json):
+                timings = []
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    func(label)
+                    timings.append((time.perf_counter() - start) * 1000)
+                median = statistics.median(timings)
+                self.stdout.write(
+                    f"{func.__name__:<32} boxes={boxes:<6} "
+                    f"median={median:8.3f}ms "
+                    f"boxes/s={boxes / (median / 1000):,.0f}"
+                )
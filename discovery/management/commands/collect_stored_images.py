@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from discovery.services.chunked_upload import expire_uploads
+from discovery.services.image_store import collect_image_garbage
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes uploaded and resized images that no pending identification job "
+        "or identified product references."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--min-age",
+            type=float,
+            default=settings.IMAGE_GC_MIN_AGE,
+            help="Age in seconds of the images to delete.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only count the images that would be deleted.",
+        )
+
+    def handle(self, *args, **options):
+        if not options["dry_run"]:
+            expired = expire_uploads(options["min_age"])
+            self.stdout.write(f"Expired {expired} unfinished uploads.")
+        deleted, freed = collect_image_garbage(
+            options["min_age"], dry_run=options["dry_run"]
+        )
+        verb = "Would delete" if options["dry_run"] else "Deleted"
+        self.stdout.write(
+            self.style.SUCCESS(f"{verb} {deleted} images, {freed / 2**20:.1f}MB.")
+        )
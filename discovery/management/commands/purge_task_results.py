@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from discovery.tasks import delete_expired_task_results
+
+
+class Command(BaseCommand):
+    help = "Purges expired results of the django-db Celery result backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=float,
+            default=settings.CELERY_RESULT_EXPIRES,
+            help="Age in seconds of the results to delete.",
+        )
+        parser.add_argument("--chunk-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        deleted = delete_expired_task_results(
+            options["older_than"], chunk_size=options["chunk_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Purged {deleted} task results."))
@@ -0,0 +1,43 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = (
+        "Writes int8 quantized copies (inference_int8.onnx) of the ONNX exports of "
+        "the OCR detection and recognition models, for OCR_BACKEND=int8."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--det-model-dir", default=settings.OCR_DET_MODEL_DIR)
+        parser.add_argument("--rec-model-dir", default=settings.OCR_REC_MODEL_DIR)
+
+    def handle(self, *args, **options):
+        # Only needed to prepare the models, not by the workers
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError:
+            raise CommandError(
+                "Quantizing needs the optional onnxruntime package: "
+                "pip install onnxruntime"
+            )
+
+        for option in ("det_model_dir", "rec_model_dir"):
+            model_dir = options[option]
+            if not model_dir:
+                raise CommandError(f"--{option.replace('_', '-')} is not set.")
+
+            source = os.path.join(model_dir, "inference.onnx")
+            target = os.path.join(model_dir, "inference_int8.onnx")
+            if not os.path.exists(source):
+                raise CommandError(
+                    f"{source} does not exist, export the model with paddle2onnx first."
+                )
+
+            quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+            self.stdout.write(
+                f"{source} ({os.path.getsize(source) / 1e6:.1f}MB) -> "
+                f"{target} ({os.path.getsize(target) / 1e6:.1f}MB)"
+            )
@@ -0,0 +1,106 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.core.management.base import BaseCommand
+
+from discovery.services.fda_import import iter_fda_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves the records of an FDA Ghana JSON export like the portal's paginated "
+        "search API. Use it with import_fda_data --fetch --url http://<host>:<port>/publicsearch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("json_file", type=str)
+        parser.add_argument("--host", type=str, default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8090)
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0,
+            help="Seconds to wait before answering a page.",
+        )
+        parser.add_argument(
+            "--fail-after",
+            type=int,
+            default=0,
+            help="Answer every page request after this many with a 503, to test "
+            "retries and resuming.",
+        )
+
+    def handle(self, *args, **options):
+        with open(options["json_file"], "r") as f:
+            records = list(iter_fda_records(f))
+
+        handler = type(
+            "StubHandler",
+            (StubSearchHandler,),
+            {
+                "records": records,
+                "delay": options["delay"],
+                "fail_after": options["fail_after"],
+                "served": 0,
+            },
+        )
+        server = ThreadingHTTPServer((options["host"], options["port"]), handler)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"FDA stub serving {len(records)} records on "
+                f"http://{options['host']}:{options['port']}/publicsearch"
+            )
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class StubSearchHandler(BaseHTTPRequestHandler):
+    records = []
+    delay = 0
+    fail_after = 0
+    served = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/publicsearch":
+            self.send_error(404)
+            return
+
+        if self.fail_after and type(self).served >= self.fail_after:
+            self.send_error(503)
+            return
+        type(self).served += 1
+
+        if self.delay:
+            time.sleep(self.delay)
+
+        params = parse_qs(url.query)
+        start = int(params.get("start", ["0"])[0])
+        length = int(params.get("length", ["25"])[0])
+        page = self.records[start : start + length]
+        body = json.dumps(
+            {
+                "draw": int(params.get("draw", ["1"])[0]),
+                "recordsTotal": len(self.records),
+                "recordsFiltered": len(self.records),
+                "data": [
+                    dict(record, DT_RowIndex=start + index + 1)
+                    for index, record in enumerate(page)
+                ],
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        print(f"[fda-stub] {format % args}")
@@ -0,0 +1,199 @@
+import json
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+STUB_PRODUCT = {
+    "name": "Stub Product",
+    "description": "Product returned by the local LLM stub server.",
+    "category": "Uncategorized",
+    "manufacturer": None,
+    "production_date": None,
+    "expiry_date": None,
+    "distributor": None,
+    "barcode": None,
+    "metadata": {},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local OpenAI compatible chat completions stub. "
+        "Set LLM_BASE_URL=http://<host>:<port>/v1 to use it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", type=str, default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8089)
+        parser.add_argument(
+            "--delay",
+            type=float,
+            default=0,
+            help="Seconds to wait before answering, to simulate slow completions.",
+        )
+        parser.add_argument(
+            "--response-file",
+            type=str,
+            default=None,
+            help="JSON file with the object to return as the structured output.",
+        )
+
+    def handle(self, *args, **options):
+        product = STUB_PRODUCT
+        if options["response_file"]:
+            with open(options["response_file"], "r") as f:
+                product = json.load(f)
+
+        handler = type(
+            "StubHandler",
+            (StubChatCompletionHandler,),
+            {"delay": options["delay"], "product": product},
+        )
+        server = ThreadingHTTPServer((options["host"], options["port"]), handler)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"LLM stub listening on http://{options['host']}:{options['port']}/v1"
+            )
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class StubChatCompletionHandler(BaseHTTPRequestHandler):
+    delay = 0
+    product = STUB_PRODUCT
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if request.get("stream"):
+            self._send_stream(self.build_completion(request))
+            return
+
+        if self.delay:
+            time.sleep(self.delay)
+        self._send_json(self.build_completion(request))
+
+    def build_completion(self, request):
+        # instructor asks for a tool call named after the response model
+        tools = request.get("tools") or []
+        tool_name = tools[0]["function"]["name"] if tools else "ProductInfo"
+        if tool_name == "ProductInfoBatch":
+            # One product per "### Item <n>" section of a micro-batched request
+            content = str(request.get("messages", [{}])[-1].get("content", ""))
+            items = re.findall(r"^### Item (\d+)$", content, re.MULTILINE)
+            arguments = json.dumps(
+                {"items": [dict(self.product, index=int(i)) for i in items]}
+            )
+        else:
+            arguments = json.dumps(self.product)
+        prompt_tokens = len(json.dumps(request.get("messages", []))) // 4
+        completion_tokens = len(arguments) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "tool_calls",
+                    "message": {
+                        "role": "assistant",
+                        "content": None,
+                        "tool_calls": [
+                            {
+                                "id": f"call_{uuid.uuid4().hex}",
+                                "type": "function",
+                                "function": {
+                                    "name": tool_name,
+                                    "arguments": arguments,
+                                },
+                            }
+                        ],
+                    },
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _send_stream(self, completion, piece_size=16):
+        # The tool call arguments in small pieces, spread over the delay
+        choice = completion["choices"][0]
+        tool_call = choice["message"]["tool_calls"][0]
+        arguments = tool_call["function"]["arguments"]
+        pieces = [
+            arguments[i : i + piece_size] for i in range(0, len(arguments), piece_size)
+        ]
+        base = {key: completion[key] for key in ("id", "created", "model")}
+        base["object"] = "chat.completion.chunk"
+
+        def chunk(delta, finish_reason=None):
+            return dict(
+                base,
+                choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            )
+
+        chunks = [
+            chunk(
+                {
+                    "role": "assistant",
+                    "tool_calls": [
+                        {
+                            "index": 0,
+                            "id": tool_call["id"],
+                            "type": "function",
+                            "function": {"name": tool_call["function"]["name"]},
+                        }
+                    ],
+                }
+            )
+        ]
+        chunks += [
+            chunk({"tool_calls": [{"index": 0, "function": {"arguments": piece}}]})
+            for piece in pieces
+        ]
+        chunks.append(chunk({}, finish_reason="tool_calls"))
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        try:
+            for payload in chunks:
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+                self.wfile.flush()
+                if self.delay:
+                    time.sleep(self.delay / len(chunks))
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _send_json(self, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up, e.g. the losing request of a hedged pair
+            pass
+
+    def log_message(self, format, *args):
+        print(f"[llm-stub] {format % args}")
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductIdentificationJob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(primary_key=True, serialize=False, unique=True),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("task_id", models.CharField(max_length=64, unique=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("success", "Success"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("stage", models.CharField(default="queued", max_length=20)),
+                (
+                    "last_completed_stage",
+                    models.CharField(
+                        blank=True, default=None, max_length=20, null=True
+                    ),
+                ),
+                ("error", models.TextField(blank=True, default=None, null=True)),
+                ("resize", models.BooleanField(default=False)),
+                ("image_paths", models.JSONField(default=list)),
+                (
+                    "prepared_image_paths",
+                    models.JSONField(blank=True, default=list, null=True),
+                ),
+                ("ocr_output", models.JSONField(blank=True, default=None, null=True)),
+                ("llm_input", models.TextField(blank=True, default=None, null=True)),
+                ("product_data", models.JSONField(blank=True, default=None, null=True)),
+                (
+                    "product",
+                    models.ForeignKey(
+                        blank=True,
+                        default=None,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="identification_jobs",
+                        to="discovery.product",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "abstract": False,
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0002_product_identification_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="quality_report",
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
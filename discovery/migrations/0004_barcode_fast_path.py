@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0003_productidentificationjob_quality_report"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="barcodes",
+            field=models.JSONField(blank=True, default=list, null=True),
+        ),
+        migrations.AlterField(
+            model_name="product",
+            name="barcode",
+            field=models.CharField(
+                blank=True, db_index=True, default=None, max_length=100, null=True
+            ),
+        ),
+    ]
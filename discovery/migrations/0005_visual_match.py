@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0004_barcode_fast_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="image_hashes",
+            field=models.JSONField(blank=True, default=list, null=True),
+        ),
+        migrations.CreateModel(
+            name="ProductImageHash",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(primary_key=True, serialize=False, unique=True),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("phash", models.BigIntegerField()),
+                ("dhash", models.BigIntegerField()),
+                (
+                    "product",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="image_hashes",
+                        to="discovery.product",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["created_at"], name="discovery_p_created_d02d0e_idx"
+                    )
+                ],
+            },
+        ),
+    ]
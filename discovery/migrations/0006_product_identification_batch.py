@@ -0,0 +1,53 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0005_visual_match"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductIdentificationBatch",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(primary_key=True, serialize=False, unique=True),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("batch_id", models.CharField(max_length=64, unique=True)),
+                ("item_count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "abstract": False,
+            },
+        ),
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="batch_index",
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="batch_reference",
+            field=models.CharField(blank=True, default=None, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="batch",
+            field=models.ForeignKey(
+                blank=True,
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="jobs",
+                to="discovery.productidentificationbatch",
+            ),
+        ),
+    ]
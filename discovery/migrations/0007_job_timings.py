@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0006_product_identification_batch"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="timings",
+            field=models.JSONField(blank=True, default=list, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0007_job_timings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="stage_attempts",
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0008_stage_attempts"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="partial_product_data",
+            field=models.JSONField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0009_partial_product_data"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImageUpload",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(primary_key=True, serialize=False, unique=True),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("upload_id", models.CharField(max_length=64, unique=True)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("open", "Open"), ("completed", "Completed")],
+                        default="open",
+                        max_length=10,
+                    ),
+                ),
+                ("filename", models.CharField(blank=True, default="", max_length=255)),
+                ("size", models.PositiveBigIntegerField()),
+                ("sha256", models.CharField(max_length=64)),
+                ("received_ranges", models.JSONField(default=list)),
+                ("image_path", models.TextField(blank=True, default=None, null=True)),
+                (
+                    "task_id",
+                    models.CharField(
+                        blank=True, default=None, max_length=64, null=True
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "abstract": False,
+            },
+        ),
+    ]
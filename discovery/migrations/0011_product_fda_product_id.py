@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:46
+
+from django.db import migrations, models
+
+
+def backfill_fda_product_id(apps, schema_editor):
+    # Products imported before were matched by name, the FDA id of the last
+    # record imported for them is in their metadata
+    Product = apps.get_model("discovery", "Product")
+    ProductMetadata = apps.get_model("discovery", "ProductMetadata")
+
+    seen = set()
+    products = []
+    for product_id, additional_info in (
+        ProductMetadata.objects.filter(additional_info__has_key="fda_product_id")
+        .values_list("product_id", "additional_info")
+        .iterator()
+    ):
+        fda_product_id = str(additional_info["fda_product_id"])
+        if fda_product_id in seen:
+            continue
+        seen.add(fda_product_id)
+        products.append(Product(id=product_id, fda_product_id=fda_product_id))
+    Product.objects.bulk_update(products, ["fda_product_id"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0010_image_upload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="fda_product_id",
+            field=models.CharField(
+                blank=True, default=None, max_length=64, null=True, unique=True
+            ),
+        ),
+        migrations.RunPython(backfill_fda_product_id, migrations.RunPython.noop),
+    ]
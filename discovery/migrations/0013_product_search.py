@@ -0,0 +1,111 @@
+# Generated by Django 5.2.7 on 2026-10-19 07:55
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+# The document of a product, also computed by the triggers below so that rows
+# written with bulk_create, update() or raw SQL are indexed as well
+CREATE_SEARCH_TRIGGERS = """
+CREATE OR REPLACE FUNCTION discovery_product_document(
+    p_name text, p_manufacturer text, p_category text, p_ingredients jsonb
+) RETURNS tsvector AS $$
+    SELECT setweight(to_tsvector('simple', coalesce(p_name, '')), 'A')
+        || setweight(to_tsvector('simple', coalesce(p_manufacturer, '')), 'B')
+        || setweight(to_tsvector('simple', coalesce(p_category, '')), 'C')
+        || setweight(to_tsvector('simple', coalesce((
+            SELECT string_agg(value, ' ')
+            FROM jsonb_array_elements_text(
+                CASE WHEN jsonb_typeof(p_ingredients) = 'array'
+                    THEN p_ingredients ELSE '[]'::jsonb END
+            )
+        ), '')), 'D')
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE OR REPLACE FUNCTION discovery_product_search_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := discovery_product_document(
+        NEW.name,
+        NEW.manufacturer,
+        NEW.category,
+        (SELECT ingredients FROM discovery_productmetadata WHERE product_id = NEW.id)
+    );
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER discovery_product_search_update
+    BEFORE INSERT OR UPDATE OF name, manufacturer, category ON discovery_product
+    FOR EACH ROW EXECUTE FUNCTION discovery_product_search_update();
+
+CREATE OR REPLACE FUNCTION discovery_productmetadata_search_update() RETURNS trigger AS $$
+DECLARE
+    metadata_product_id bigint;
+    metadata_ingredients jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        metadata_product_id := OLD.product_id;
+        metadata_ingredients := NULL;
+    ELSE
+        metadata_product_id := NEW.product_id;
+        metadata_ingredients := NEW.ingredients;
+    END IF;
+    UPDATE discovery_product
+    SET search_vector = discovery_product_document(
+        name, manufacturer, category, metadata_ingredients
+    )
+    WHERE id = metadata_product_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER discovery_productmetadata_search_update
+    AFTER INSERT OR UPDATE OF ingredients OR DELETE ON discovery_productmetadata
+    FOR EACH ROW EXECUTE FUNCTION discovery_productmetadata_search_update();
+
+UPDATE discovery_product p
+SET search_vector = discovery_product_document(
+    p.name,
+    p.manufacturer,
+    p.category,
+    (SELECT ingredients FROM discovery_productmetadata m WHERE m.product_id = p.id)
+);
+"""
+
+DROP_SEARCH_TRIGGERS = """
+DROP TRIGGER IF EXISTS discovery_productmetadata_search_update ON discovery_productmetadata;
+DROP FUNCTION IF EXISTS discovery_productmetadata_search_update();
+DROP TRIGGER IF EXISTS discovery_product_search_update ON discovery_product;
+DROP FUNCTION IF EXISTS discovery_product_search_update();
+DROP FUNCTION IF EXISTS discovery_product_document(text, text, text, jsonb);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0012_fda_incremental_import"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="product_search_vector_gin"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=django.contrib.postgres.indexes.HashIndex(
+                fields=["name"], name="product_name_hash"
+            ),
+        ),
+        migrations.RunSQL(CREATE_SEARCH_TRIGGERS, DROP_SEARCH_TRIGGERS),
+    ]
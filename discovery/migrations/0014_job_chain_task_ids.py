@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0013_product_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="chain_task_ids",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0014_job_chain_task_ids"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="productidentificationjob",
+            name="llm_input_encoding",
+            field=models.CharField(blank=True, default=None, max_length=10, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 08:33
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("discovery", "0015_job_llm_input_encoding"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="productimagehash",
+            options={"ordering": ["-created_at"]},
+        ),
+    ]
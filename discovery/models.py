@@ -1,4 +1,6 @@
 import random
+from django.contrib.postgres.indexes import GinIndex, HashIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.contrib.auth.models import User
 from discovery.utils import id_generator
@@ -94,7 +96,24 @@ class Product(BaseModel):
     production_date = models.DateField(null=True, blank=True, default=None)
     expiry_date = models.DateField(null=True, blank=True, default=None)
     distributor = models.TextField(null=True, blank=True, default=None)
-    barcode = models.CharField(max_length=100, null=True, blank=True, default=None)
+    barcode = models.CharField(
+        max_length=100, null=True, blank=True, default=None, db_index=True
+    )
+    # Product id of the FDA Ghana registration the product was imported from
+    fda_product_id = models.CharField(
+        max_length=64, null=True, blank=True, default=None, unique=True
+    )
+    # Weighted document of the name, manufacturer, category and ingredients
+    # for full-text search, maintained by database triggers so that bulk
+    # imports keep it up to date too
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta(BaseModel.Meta):
+        indexes = [
+            GinIndex(fields=["search_vector"], name="product_search_vector_gin"),
+            # Exact name lookups, names can be too long for a btree index
+            HashIndex(fields=["name"], name="product_name_hash"),
+        ]
 
     def __str__(self):
         return self.name
@@ -118,3 +137,229 @@ class ProductMetadata(BaseModel):
     materials = models.JSONField(default=list, null=True, blank=True)
     warnings = models.JSONField(default=list, null=True, blank=True)
     usage_directions = models.TextField(null=True, blank=True, default=None)
+
+
+class ProductImageHash(BaseModel):
+    """
+    Perceptual hashes of an image a product was identified from. Hashes are
+    unsigned 64 bit values stored as signed integers.
+    """
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="image_hashes"
+    )
+    phash = models.BigIntegerField()
+    dhash = models.BigIntegerField()
+
+    class Meta(BaseModel.Meta):
+        indexes = [models.Index(fields=["created_at"])]
+
+
+class ProductIdentificationBatch(BaseModel):
+    """
+    Many products identified in one request, every item is a job of its own.
+    The batch status is derived from the status of its jobs.
+    """
+
+    batch_id = models.CharField(max_length=64, unique=True)
+    item_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.batch_id} ({self.item_count} items)"
+
+
+class ProductIdentificationJob(BaseModel):
+    """
+    State of one image identification run. Every pipeline stage stores its
+    output here so that a failed stage can be retried, or the job resumed,
+    without repeating the stages before it.
+    """
+
+    # Ordered pipeline stages, a job that has not started yet is "queued".
+    STAGES = [
+        "barcode",
+        "visual",
+        "prepare",
+        "quality",
+        "ocr",
+        "reconstruct",
+        "match",
+        "infer",
+        "save",
+    ]
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_SUCCESS = "success"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "Pending"),
+        (STATUS_RUNNING, "Running"),
+        (STATUS_SUCCESS, "Success"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    task_id = models.CharField(max_length=64, unique=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING
+    )
+    stage = models.CharField(max_length=20, default="queued")
+    last_completed_stage = models.CharField(
+        max_length=20, null=True, blank=True, default=None
+    )
+    error = models.TextField(null=True, blank=True, default=None)
+    resize = models.BooleanField(default=False)
+    image_paths = models.JSONField(default=list)
+    prepared_image_paths = models.JSONField(default=list, null=True, blank=True)
+    quality_report = models.JSONField(null=True, blank=True, default=None)
+    barcodes = models.JSONField(default=list, null=True, blank=True)
+    image_hashes = models.JSONField(default=list, null=True, blank=True)
+    ocr_output = models.JSONField(null=True, blank=True, default=None)
+    llm_input = models.TextField(null=True, blank=True, default=None)
+    # LLM_INPUT_ENCODING that llm_input was written with
+    llm_input_encoding = models.CharField(
+        max_length=10, null=True, blank=True, default=None
+    )
+    product_data = models.JSONField(null=True, blank=True, default=None)
+    # Fields of the product generated so far while the completion streams
+    partial_product_data = models.JSONField(null=True, blank=True, default=None)
+    # Timing span of every stage that ran, with its duration and attributes
+    timings = models.JSONField(default=list, null=True, blank=True)
+    # Starts of the current stage, including ones whose worker was killed
+    stage_attempts = models.PositiveSmallIntegerField(default=0)
+    # Task ids of the chain dispatched last, the stages of earlier chains of a
+    # resumed job are skipped
+    chain_task_ids = models.JSONField(default=list, blank=True)
+    product = models.ForeignKey(
+        Product,
+        null=True,
+        blank=True,
+        default=None,
+        on_delete=models.SET_NULL,
+        related_name="identification_jobs",
+    )
+    batch = models.ForeignKey(
+        ProductIdentificationBatch,
+        null=True,
+        blank=True,
+        default=None,
+        on_delete=models.CASCADE,
+        related_name="jobs",
+    )
+    batch_index = models.PositiveIntegerField(null=True, blank=True, default=None)
+    batch_reference = models.CharField(
+        max_length=255, null=True, blank=True, default=None
+    )
+
+    def is_finished(self):
+        return self.status in (self.STATUS_SUCCESS, self.STATUS_FAILED)
+
+    def has_completed(self, stage):
+        if self.last_completed_stage is None:
+            return False
+        return self.STAGES.index(stage) <= self.STAGES.index(self.last_completed_stage)
+
+    def remaining_stages(self):
+        return [stage for stage in self.STAGES if not self.has_completed(stage)]
+
+    def __str__(self):
+        return f"{self.task_id} ({self.status} @ {self.stage})"
+
+
+class ImageUpload(BaseModel):
+    """
+    A resumable upload of one image. The client sends byte ranges in any order
+    and retries only the ranges that failed, the image is stored and
+    identified once the upload is finalized.
+    """
+
+    STATUS_OPEN = "open"
+    STATUS_COMPLETED = "completed"
+    STATUS_CHOICES = [
+        (STATUS_OPEN, "Open"),
+        (STATUS_COMPLETED, "Completed"),
+    ]
+
+    upload_id = models.CharField(max_length=64, unique=True)
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=STATUS_OPEN
+    )
+    filename = models.CharField(max_length=255, blank=True, default="")
+    size = models.PositiveBigIntegerField()
+    # Hex SHA-256 of the whole image, checked when the upload is finalized
+    sha256 = models.CharField(max_length=64)
+    # Sorted, merged [start, end) byte ranges written so far
+    received_ranges = models.JSONField(default=list)
+    image_path = models.TextField(null=True, blank=True, default=None)
+    # Identification job started when the upload was finalized
+    task_id = models.CharField(max_length=64, null=True, blank=True, default=None)
+
+    def received_size(self):
+        return sum(end - start for start, end in self.received_ranges)
+
+    def is_complete(self):
+        return self.received_ranges == [[0, self.size]]
+
+    def __str__(self):
+        return f"{self.upload_id} ({self.status}, {self.received_size()}/{self.size})"
+
+
+class FdaImportRun(BaseModel):
+    """
+    One import of the FDA Ghana registrations. The records consumed so far
+    are checkpointed after every committed chunk, so that an interrupted run
+    resumes after them.
+    """
+
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_RUNNING, "Running"),
+        (STATUS_COMPLETED, "Completed"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    # Path of the export file or URL of the search API
+    source = models.TextField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=STATUS_RUNNING
+    )
+    checkpoint = models.PositiveIntegerField(default=0)
+    counts = models.JSONField(default=dict)
+    error = models.TextField(null=True, blank=True, default=None)
+    finished_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __str__(self):
+        return f"{self.source} ({self.status} @ {self.checkpoint})"
+
+
+class FdaRegistration(BaseModel):
+    """
+    Latest state of an FDA Ghana registration, with the hash of its source
+    record so that unchanged records are skipped by incremental imports.
+    """
+
+    fda_product_id = models.CharField(max_length=64, unique=True)
+    product = models.OneToOneField(
+        Product,
+        null=True,
+        blank=True,
+        default=None,
+        on_delete=models.SET_NULL,
+        related_name="fda_registration",
+    )
+    content_hash = models.CharField(max_length=64)
+    status = models.CharField(max_length=64, null=True, blank=True, default=None)
+    last_seen_run = models.ForeignKey(
+        FdaImportRun,
+        null=True,
+        blank=True,
+        default=None,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    # Set when a complete run no longer found the registration
+    removed_at = models.DateTimeField(null=True, blank=True, default=None)
+
+    def __str__(self):
+        return f"{self.fda_product_id} ({self.status})"
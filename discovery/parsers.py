@@ -0,0 +1,25 @@
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONStreamParser(BaseParser):
+    """
+    Newline delimited JSON. The request stream is returned unread so that
+    large bodies are consumed one line at a time by the view.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream
+
+
+class OctetStreamParser(BaseParser):
+    """
+    Raw bytes, e.g. a byte range of a resumable upload. The request stream is
+    returned unread so that the view can write it to disk in chunks.
+    """
+
+    media_type = "application/octet-stream"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream
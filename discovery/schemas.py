@@ -1,13 +1,15 @@
 import graphene
+from django.conf import settings
 from graphene_django import DjangoObjectType
 
 from discovery.models import Product, ProductMetadata
+from discovery.services.product_search import search_products
 
 
 class ProductType(DjangoObjectType):
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ["search_vector"]
 
 
 class ProductMetadataType(DjangoObjectType):
@@ -19,15 +21,26 @@ class ProductMetadataType(DjangoObjectType):
 class Query(graphene.ObjectType):
     all_products = graphene.List(ProductType)
     product_by_name = graphene.Field(ProductType, name=graphene.String(required=True))
+    search_products = graphene.List(
+        ProductType,
+        query=graphene.String(required=True),
+        limit=graphene.Int(default_value=settings.PRODUCT_SEARCH_PAGE_SIZE),
+        offset=graphene.Int(default_value=0),
+    )
 
     def resolve_all_products(root, info):
         return Product.objects.prefetch_related("metadata").all()
 
     def resolve_product_by_name(root, info, name):
-        try:
-            return Product.objects.get(name=name)
-        except Product.DoesNotExist:
-            return None
+        # Names are not unique, several registrations can share one
+        return Product.objects.filter(name=name).order_by("id").first()
+
+    def resolve_search_products(root, info, query, limit, offset):
+        limit = max(0, min(limit, settings.PRODUCT_SEARCH_MAX_PAGE_SIZE))
+        offset = max(0, offset)
+        return search_products(query).select_related("metadata")[
+            offset : offset + limit
+        ]
 
 
 schema = graphene.Schema(query=Query)
@@ -31,7 +31,7 @@ class LoginSerializer(serializers.ModelSerializer):
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ["search_vector"]
 
 
 class SyncActionSerializer(serializers.Serializer):
@@ -0,0 +1,270 @@
+"""Catalog match short-circuit.
+
+Packages of registered products usually print the catalog name in their most
+prominent lines. Those lines are scored against a character trigram index of
+product names, and a confident match returns the existing product instead of
+calling the LLM.
+
+The index lives in the memory of each OCR worker process, the match stage runs
+on the OCR queue whose containers have the memory for it. Postings are numpy
+arrays so that candidate generation is a single bincount. The catalog is
+checked for changes after CATALOG_INDEX_TTL seconds: products added since are
+appended to the index, which is only rebuilt when products were edited or
+removed."""
+
+import re
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from django.db.models import Count, Max
+
+from discovery.models import Product
+
+GLOBAL_CATALOG_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+# Trigrams found in more than this share of the names are too common to
+# generate candidates, they are still counted when scoring them
+STOP_TRIGRAM_RATIO = 0.05
+MAX_CANDIDATES = 50
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", str(text).lower()).split())
+
+
+def trigrams(text: str) -> set:
+    text = f" {normalize_text(text)} "
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def dice_similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class CatalogIndex:
+    """
+    Character trigram index over the names of all products.
+    """
+
+    def __init__(self, rows, version):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.row_count = 0
+        self.product_ids = []
+        self.known_ids = set()
+        self.names = []
+        self.manufacturers = []
+        self.sizes = np.zeros(0, dtype=np.int32)
+        self.postings = {}
+        self.add(rows, version)
+
+    def add(self, rows, version):
+        """
+        Appends the (id, name, manufacturer) rows of new products.
+        """
+        postings = defaultdict(list)
+        sizes = []
+        for product_id, name, manufacturer in rows:
+            self.row_count += 1
+            self.known_ids.add(product_id)
+            grams = trigrams(name)
+            if not grams:
+                continue
+            position = len(self.product_ids)
+            self.product_ids.append(product_id)
+            self.names.append(name)
+            self.manufacturers.append(manufacturer or "")
+            sizes.append(len(grams))
+            for gram in grams:
+                postings[gram].append(position)
+
+        self.sizes = np.concatenate([self.sizes, np.array(sizes, dtype=np.int32)])
+        for gram, positions in postings.items():
+            positions = np.array(positions, dtype=np.int32)
+            if gram in self.postings:
+                positions = np.concatenate([self.postings[gram], positions])
+            self.postings[gram] = positions
+        self.stop_size = max(1, int(len(self.product_ids) * STOP_TRIGRAM_RATIO))
+        self.version = version
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def search(self, query: str, limit: int = 5):
+        """
+        Returns the best (score, position) pairs for a query by Dice similarity.
+        """
+        query_grams = trigrams(query)
+        if not query_grams or not len(self):
+            return []
+
+        known = [gram for gram in query_grams if gram in self.postings]
+        selective = [g for g in known if len(self.postings[g]) <= self.stop_size]
+        common = [g for g in known if len(self.postings[g]) > self.stop_size]
+        if not selective:
+            return []
+
+        counts = np.bincount(
+            np.concatenate([self.postings[g] for g in selective]),
+            minlength=len(self),
+        )
+        candidates = np.argsort(counts)[::-1][:MAX_CANDIDATES]
+        candidates = candidates[counts[candidates] > 0]
+
+        # Exact shared trigram counts, including the common ones
+        shared = counts[candidates].astype(np.float64)
+        for gram in common:
+            shared += np.isin(candidates, self.postings[gram], assume_unique=True)
+
+        scores = 2 * shared / (len(query_grams) + self.sizes[candidates])
+        best = np.argsort(scores)[::-1][:limit]
+        return [(float(scores[i]), int(candidates[i])) for i in best]
+
+
+def _catalog_version():
+    stats = Product.objects.aggregate(count=Count("id"), updated=Max("updated_at"))
+    return stats["count"], stats["updated"]
+
+
+def _catalog_rows(queryset):
+    return queryset.values_list("id", "name", "manufacturer").iterator(chunk_size=5000)
+
+
+def _add_new_products(index, version) -> bool:
+    """
+    Appends the products created since the index was built, False when
+    products were edited or removed and the index has to be rebuilt.
+    """
+    count, updated = version
+    if index.version[1] is None or count < index.row_count:
+        return False
+    rows = list(_catalog_rows(Product.objects.filter(updated_at__gt=index.version[1])))
+    if any(row[0] in index.known_ids for row in rows):
+        return False
+    if index.row_count + len(rows) != count:
+        return False
+    index.add(rows, version)
+    return True
+
+
+def get_catalog_index(ttl: float) -> CatalogIndex:
+    """
+    Singleton accessor for the catalog index of this worker process.
+    After ttl seconds the catalog is checked for changes, new products are
+    added to the index and it is rebuilt when products were edited or removed.
+    """
+    global GLOBAL_CATALOG_INDEX
+
+    index = GLOBAL_CATALOG_INDEX
+    if index is not None and time.monotonic() - index.checked_at < ttl:
+        return index
+
+    with _INDEX_LOCK:
+        index = GLOBAL_CATALOG_INDEX
+        if index is not None and time.monotonic() - index.checked_at < ttl:
+            return index
+
+        version = _catalog_version()
+        if index is not None and (
+            index.version == version or _add_new_products(index, version)
+        ):
+            index.checked_at = time.monotonic()
+            return index
+
+        start = time.perf_counter()
+        GLOBAL_CATALOG_INDEX = CatalogIndex(
+            _catalog_rows(Product.objects.all()), version
+        )
+        print(
+            f"Built catalog index of {len(GLOBAL_CATALOG_INDEX)} products "
+            f"in {time.perf_counter() - start:.2f}s"
+        )
+        return GLOBAL_CATALOG_INDEX
+
+
+def prominent_lines(layouts: list, limit: int) -> list[str]:
+    """
+    Returns the texts with the largest font sizes over all images.
+    The lines are the text blocks of create_text_block_json.
+    """
+    blocks = [
+        block
+        for layout in layouts
+        for block in layout["text_blocks"]
+        if normalize_text(block["text"])
+    ]
+    blocks.sort(key=lambda b: b["font_size"], reverse=True)
+    return [block["text"] for block in blocks[:limit]]
+
+
+def build_queries(lines: list[str]) -> list[str]:
+    """
+    Product names are often split over the two or three most prominent lines,
+    so those are also tried together, in both orders.
+    """
+    queries = list(lines)
+    top = lines[:3]
+    for i in range(len(top)):
+        for j in range(len(top)):
+            if i != j:
+                queries.append(f"{top[i]} {top[j]}")
+    if len(top) == 3:
+        queries.append(" ".join(top))
+    return queries
+
+
+def match_catalog_product(
+    layouts: list, full_text: str, threshold: float, margin: float, ttl: float
+):
+    """
+    Looks for an existing product named by the prominent OCR lines.
+
+    Args:
+        layouts: create_text_block_json outputs, one per image.
+        full_text: All OCR text, used to confirm the manufacturer.
+        threshold: Minimum similarity for a match.
+        margin: Minimum lead of the best product over the next best one, so
+            that size or flavour variants of a product are not confused.
+        ttl: Seconds between catalog change checks of the index.
+
+    Returns:
+        A (product, score) tuple, product is None without a confident match.
+    """
+    index = get_catalog_index(ttl)
+    lines = prominent_lines(layouts, limit=8)
+    if not lines or not len(index):
+        return None, 0.0
+
+    best_scores = {}
+    for query in build_queries(lines):
+        for score, position in index.search(query):
+            best_scores[position] = max(score, best_scores.get(position, 0.0))
+    if not best_scores:
+        return None, 0.0
+
+    # A manufacturer printed anywhere on the package confirms the match
+    text_grams = trigrams(full_text)
+    for position in best_scores:
+        manufacturer_grams = trigrams(index.manufacturers[position])
+        if manufacturer_grams and (
+            len(manufacturer_grams & text_grams) / len(manufacturer_grams) >= 0.8
+        ):
+            best_scores[position] = min(1.0, best_scores[position] + 0.05)
+
+    ranked = sorted(best_scores.items(), key=lambda item: item[1], reverse=True)
+    position, score = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    print(
+        f"Catalog match: {index.names[position]!r} score {score:.2f}, "
+        f"runner up {runner_up:.2f}"
+    )
+    if score < threshold or score - runner_up < margin:
+        return None, score
+
+    product = Product.objects.filter(id=index.product_ids[position]).first()
+    return product, score
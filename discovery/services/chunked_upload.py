@@ -0,0 +1,310 @@
+"""Resumable chunked image uploads.
+
+A client creates an upload with the size and SHA-256 of the image, then sends
+byte ranges of it with PUT requests and a Content-Range header, in any order
+and in parallel. Ranges are written in place into a part file in the incoming
+directory of the image store, straight from the request stream, so a dropped
+connection only costs the range that was being sent. Finalizing checks that
+every byte arrived, copies the part file into the image store, checking the
+checksum of the copy, and creates the identification job of the images. The
+part file is copied rather than moved because a request that is still writing
+to it would otherwise change a stored image."""
+
+import os
+import re
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+
+from discovery.models import ImageUpload, ProductIdentificationJob
+from discovery.services.image_store import store_image_file, write_incoming_chunks
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/(\d+|\*)$")
+SHA256_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class UploadError(Exception):
+    """
+    A request that does not fit the upload, answered with a 400.
+    """
+
+
+class UploadConflict(UploadError):
+    """
+    A request that does not fit the state of the upload, answered with a 409.
+    """
+
+
+def create_upload(size, sha256, filename="") -> ImageUpload:
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError("size must be the number of bytes of the image.")
+    if not 0 < size <= settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise UploadError(
+            f"size must be between 1 and {settings.IMAGE_UPLOAD_MAX_SIZE} bytes."
+        )
+
+    sha256 = str(sha256 or "").lower()
+    if not SHA256_RE.match(sha256):
+        raise UploadError("sha256 must be the hex SHA-256 digest of the image.")
+
+    return ImageUpload.objects.create(
+        upload_id=str(uuid.uuid4()),
+        size=size,
+        sha256=sha256,
+        filename=str(filename or "")[:255],
+    )
+
+
+def part_path(upload: ImageUpload) -> str:
+    return os.path.join(
+        settings.IMAGE_STORE_ROOT, "incoming", f"{upload.upload_id}.part"
+    )
+
+
+def parse_content_range(header, size):
+    """
+    Parses a Content-Range header of an upload of size bytes.
+
+    Returns:
+        The [start, end) byte range.
+    """
+    match = CONTENT_RANGE_RE.match(header or "")
+    if not match:
+        raise UploadError("Content-Range must look like 'bytes 0-1048575/5242880'.")
+
+    start, last, total = match.groups()
+    start, end = int(start), int(last) + 1
+    if total != "*" and int(total) != size:
+        raise UploadError(f"The upload is {size} bytes, not {total}.")
+    if start >= end or end > size:
+        raise UploadError(f"Range {start}-{last} is outside of the {size} bytes.")
+    if end - start > settings.IMAGE_UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError(
+            f"A chunk holds at most {settings.IMAGE_UPLOAD_MAX_CHUNK_SIZE} bytes."
+        )
+    return start, end
+
+
+def merge_range(ranges, start, end):
+    """
+    Adds [start, end) to sorted, non overlapping ranges, merging the ranges
+    it overlaps or touches.
+    """
+    merged = []
+    for range_start, range_end in sorted(ranges + [[start, end]]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_end)
+        else:
+            merged.append([range_start, range_end])
+    return merged
+
+
+def missing_ranges(upload: ImageUpload):
+    missing = []
+    position = 0
+    for start, end in upload.received_ranges:
+        if start > position:
+            missing.append([position, start])
+        position = end
+    if position < upload.size:
+        missing.append([position, upload.size])
+    return missing
+
+
+def write_range(upload_id, start, end, stream) -> ImageUpload:
+    """
+    Writes the bytes of [start, end) from stream into the part file of the
+    upload. The bytes written are recorded even when the stream ends early, so
+    that the client can resume from there.
+    """
+    with transaction.atomic():
+        # Waits for a finalize of the upload that is in progress
+        upload = ImageUpload.objects.select_for_update().get(upload_id=upload_id)
+        _check_open(upload)
+
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    position = start
+    try:
+        while position < end:
+            chunk = stream.read(min(STREAM_CHUNK_SIZE, end - position))
+            if not chunk:
+                break
+            os.pwrite(fd, chunk, position)
+            position += len(chunk)
+    finally:
+        os.close(fd)
+
+    # Parallel ranges of the same upload are merged one at a time
+    with transaction.atomic():
+        upload = ImageUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.status != ImageUpload.STATUS_OPEN and os.path.exists(path):
+            # The upload was finalized while this range was written, which
+            # recreated its part file
+            os.remove(path)
+        _check_open(upload)
+        if position > start:
+            upload.received_ranges = merge_range(
+                upload.received_ranges, start, position
+            )
+            upload.save(update_fields=["received_ranges", "updated_at"])
+
+    if position < end:
+        raise UploadError(
+            f"The request ended after {position - start} of {end - start} bytes."
+        )
+    return upload
+
+
+def _check_open(upload):
+    if upload.status != ImageUpload.STATUS_OPEN:
+        raise UploadConflict("The upload was finalized already.")
+
+
+def finalize_uploads(upload_ids):
+    """
+    Stores the images of complete uploads and creates one identification job
+    for all of them. Finalizing the same uploads again returns the same job.
+    The part files are copied and hashed before the uploads are locked, so
+    that large images do not hold the row locks for long.
+
+    Returns:
+        The job, and whether it still has to be started: it was created by
+        this call, or by an earlier one that did not get to start it.
+    """
+    upload_ids = list(dict.fromkeys(upload_ids or []))
+    if not upload_ids or len(upload_ids) > settings.BATCH_MAX_IMAGES_PER_ITEM:
+        raise UploadError(
+            f"Between 1 and {settings.BATCH_MAX_IMAGES_PER_ITEM} uploads are "
+            "finalized together."
+        )
+
+    uploads = _load_uploads(ImageUpload.objects.all(), upload_ids)
+    job = _finalized_job(uploads)
+    if job is not None:
+        return job, _never_started(job)
+    for upload in uploads:
+        if not upload.is_complete():
+            raise UploadConflict(
+                f"Upload {upload.upload_id} is missing the byte ranges "
+                f"{missing_ranges(upload)}."
+            )
+
+    copies = [_copy_part(upload) for upload in uploads]
+    try:
+        with transaction.atomic():
+            uploads = _load_uploads(ImageUpload.objects.select_for_update(), upload_ids)
+            job = _finalized_job(uploads)
+            if job is not None:
+                # Finalized by a concurrent request while the parts were copied
+                return job, False
+
+            corrupted = [
+                upload
+                for upload, (_, digest) in zip(uploads, copies)
+                if digest != upload.sha256
+            ]
+            for upload in corrupted:
+                # Which range was corrupted is unknown, the image is sent again
+                if os.path.exists(part_path(upload)):
+                    os.remove(part_path(upload))
+                upload.received_ranges = []
+                upload.save(update_fields=["received_ranges", "updated_at"])
+            if not corrupted:
+                job = _store_uploads(uploads, [copy_path for copy_path, _ in copies])
+                return job, True
+    finally:
+        # Copies that were not moved into the store
+        for copy_path, _ in copies:
+            if copy_path is not None and os.path.exists(copy_path):
+                os.remove(copy_path)
+
+    raise UploadConflict(
+        "The checksum of the uploads "
+        f"{[upload.upload_id for upload in corrupted]} does not match, "
+        "they have to be sent again."
+    )
+
+
+def _load_uploads(queryset, upload_ids):
+    uploads = {
+        upload.upload_id: upload for upload in queryset.filter(upload_id__in=upload_ids)
+    }
+    for upload_id in upload_ids:
+        if upload_id not in uploads:
+            raise ImageUpload.DoesNotExist(f"Upload {upload_id} does not exist.")
+    return [uploads[upload_id] for upload_id in upload_ids]
+
+
+def _finalized_job(uploads):
+    # The job of uploads that were finalized together, None if none of them was
+    task_ids = {upload.task_id for upload in uploads}
+    if task_ids == {None}:
+        return None
+    if len(task_ids) > 1:
+        raise UploadConflict("Some of the uploads were finalized with other ones.")
+    return ProductIdentificationJob.objects.get(task_id=task_ids.pop())
+
+
+def _never_started(job):
+    # The process that created the job stopped before it dispatched the chain
+    return (
+        job.stage == "queued"
+        and job.last_completed_stage is None
+        and not job.chain_task_ids
+    )
+
+
+def _copy_part(upload):
+    # A copy of the part file and the digest of the copy. The part file of an
+    # upload that was left alone for long may be collected.
+    try:
+        with open(part_path(upload), "rb") as f:
+            return write_incoming_chunks(
+                iter(lambda: f.read(STREAM_CHUNK_SIZE * 16), b"")
+            )
+    except FileNotFoundError:
+        return None, None
+
+
+def _store_uploads(uploads, copy_paths):
+    extensions = []
+    for upload, copy_path in zip(uploads, copy_paths):
+        try:
+            with Image.open(copy_path) as img:
+                extensions.append(f".{img.format.lower()}")
+        except OSError:
+            raise UploadError(f"Upload {upload.upload_id} is not an image.")
+
+    for upload, copy_path, extension in zip(uploads, copy_paths, extensions):
+        upload.image_path = store_image_file(copy_path, upload.sha256, extension)
+        if os.path.exists(part_path(upload)):
+            os.remove(part_path(upload))
+
+    job = ProductIdentificationJob.objects.create(
+        task_id=str(uuid.uuid4()), image_paths=[upload.image_path for upload in uploads]
+    )
+    for upload in uploads:
+        upload.status = ImageUpload.STATUS_COMPLETED
+        upload.task_id = job.task_id
+        upload.save(update_fields=["status", "image_path", "task_id", "updated_at"])
+    return job
+
+
+def expire_uploads(min_age: float) -> int:
+    """
+    Deletes the uploads that were not written to or finalized in the last
+    min_age seconds. Their part files are left to collect_image_garbage.
+    """
+    cutoff = timezone.now() - timedelta(seconds=min_age)
+    deleted, _ = ImageUpload.objects.filter(updated_at__lt=cutoff).delete()
+    return deleted
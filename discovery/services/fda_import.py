@@ -0,0 +1,525 @@
+"""Import of the product registrations exported from the FDA Ghana portal.
+
+The export is a JSON object whose "data" array holds one record per registered
+product. It is parsed incrementally, so memory does not grow with the size of
+the file, and the records are upserted in chunks keyed on their FDA product id,
+every chunk in its own transaction.
+
+Incremental refreshes read the same records from the export or page by page
+from the public search API. They keep the hash of every record in
+FdaRegistration and only write the products whose record changed. Every chunk
+commits with a checkpoint on its FdaImportRun, so an interrupted refresh
+resumes after the last committed chunk. Registrations last seen by a refresh
+of the same source that a complete refresh did not see any more are marked as
+removed, but only by refreshes that read all records in one go: the offsets of
+the search API shift between requests, so a resumed refresh may have skipped
+records."""
+
+import hashlib
+import itertools
+import json
+import re
+import time
+from datetime import timedelta
+
+import httpx
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from discovery.models import (
+    FdaImportRun,
+    FdaRegistration,
+    Product,
+    ProductMetadata,
+)
+
+READ_SIZE = 64 * 1024
+
+PRODUCT_FIELDS = [
+    "name",
+    "description",
+    "category",
+    "manufacturer",
+    "distributor",
+]
+METADATA_FIELDS = [
+    "net_weight",
+    "volume",
+    "country_of_origin",
+    "additional_info",
+]
+
+
+class FdaRunInProgress(Exception):
+    pass
+
+
+# Fields of the search API that change between requests without the
+# registration changing
+VOLATILE_FIELDS = {"DT_RowIndex", "action"}
+
+# Query of the public search page, a DataTables server side endpoint
+SEARCH_PARAMS = {
+    "columns[0][data]": "DT_RowIndex",
+    "columns[0][searchable]": "false",
+    "columns[1][data]": "client_name",
+    "columns[1][name]": "tbl_client_details.client_name",
+    "columns[2][data]": "product_name",
+    "columns[3][data]": "product_category",
+    "columns[4][data]": "expiry_date",
+    "columns[5][data]": "status",
+    "columns[5][name]": "tbl_products_details.status",
+    "order[0][column]": "1",
+    "order[0][dir]": "desc",
+    "search[value]": "",
+}
+SEARCH_HEADERS = {
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "X-Requested-With": "XMLHttpRequest",
+}
+
+VOLUME_RE = re.compile(r"(\d+\s*(?:ml|l|fl\s*oz))", re.IGNORECASE)
+WEIGHT_RE = re.compile(r"(\d+\s*(?:g|kg|oz|lb|lbs))", re.IGNORECASE)
+WHITESPACE_RE = re.compile(r"\s*")
+
+
+class _JSONStream:
+    """
+    Buffered reader that decodes one JSON value at a time from a text file.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.position = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(READ_SIZE)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """
+        The next character after whitespace, None at the end of the file.
+        """
+        while True:
+            self.position = WHITESPACE_RE.match(self.buffer, self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return None
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise ValueError(
+                f"Expected {character!r} in the JSON export, got {self.peek()!r}."
+            )
+        self.position += 1
+
+    def value(self):
+        while True:
+            self.peek()
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # The value may continue after the buffer
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue after it as well
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.position = end
+            return value
+
+
+def iter_fda_records(f, key="data"):
+    """
+    Yields the records of the key array of a JSON export one at a time.
+    """
+    stream = _JSONStream(f)
+    stream.expect("{")
+    while stream.peek() != "}":
+        name = stream.value()
+        stream.expect(":")
+        if name != key:
+            stream.value()
+        else:
+            stream.expect("[")
+            while stream.peek() != "]":
+                yield stream.value()
+                if stream.peek() == ",":
+                    stream.expect(",")
+            stream.expect("]")
+        if stream.peek() == ",":
+            stream.expect(",")
+
+
+def extract_volume_or_weight(product_name):
+    """
+    Parses volume or weight from a product name.
+    Example: "Zuzu Juice ... -PET Bottle(500ml)" -> {'volume': '500ml'}
+    """
+    if not product_name:
+        return {}
+
+    volume_match = VOLUME_RE.search(product_name)
+    if volume_match:
+        return {"volume": volume_match.group(1)}
+
+    weight_match = WEIGHT_RE.search(product_name)
+    if weight_match:
+        return {"weight": weight_match.group(1)}
+
+    return {}
+
+
+def product_fields(item):
+    """
+    The Product and ProductMetadata fields of an FDA record.
+    """
+    name = item.get("product_name") or "Unnamed Product"
+    volume_or_weight = extract_volume_or_weight(name)
+    product = {
+        "name": name,
+        "description": f"Registered as '{item.get('registration_number', 'N/A')}' with the FDA Ghana.",
+        "category": item.get("product_category", "Uncategorized"),
+        "manufacturer": item.get("manufacturer"),
+        "distributor": item.get("representative_company_local_agent_applicant"),
+    }
+    metadata = {
+        "net_weight": volume_or_weight.get("weight"),
+        "volume": volume_or_weight.get("volume"),
+        "country_of_origin": item.get("country_origin"),
+        # Extra, unmapped fields
+        "additional_info": {
+            "fda_product_id": str(item["product_id"]),
+            "registration_number": item.get("registration_number"),
+            "status": item.get("status"),
+            "product_sub_category": item.get("product_sub_category"),
+            "client_name": item.get("client_name"),
+        },
+    }
+    return product, metadata
+
+
+def upsert_fda_chunk(records):
+    """
+    Inserts or updates the products and metadata of FDA records with one
+    INSERT ... ON CONFLICT statement each, in one transaction.
+
+    Returns:
+        The number of products that were created, and the product ids by FDA
+        product id.
+    """
+    fields = {str(item["product_id"]): product_fields(item) for item in records}
+
+    with transaction.atomic():
+        existing = set(
+            Product.objects.filter(fda_product_id__in=fields).values_list(
+                "fda_product_id", flat=True
+            )
+        )
+        Product.objects.bulk_create(
+            [
+                Product(fda_product_id=fda_product_id, **product)
+                for fda_product_id, (product, _) in fields.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["fda_product_id"],
+            update_fields=PRODUCT_FIELDS + ["updated_at"],
+        )
+        # Rows that existed keep their id, it is read back instead of trusting
+        # the ids assigned before the insert
+        product_ids = dict(
+            Product.objects.filter(fda_product_id__in=fields).values_list(
+                "fda_product_id", "id"
+            )
+        )
+        ProductMetadata.objects.bulk_create(
+            [
+                ProductMetadata(product_id=product_ids[fda_product_id], **metadata)
+                for fda_product_id, (_, metadata) in fields.items()
+            ],
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=METADATA_FIELDS + ["updated_at"],
+        )
+    return len(fields) - len(existing), product_ids
+
+
+def import_fda_records(records, chunk_size=1000, progress=None):
+    """
+    Upserts FDA records in chunks of chunk_size, committing every chunk.
+    Records without a product id, and repeated ones, are skipped.
+
+    Args:
+        progress: Called after every chunk with the counts so far.
+
+    Returns:
+        The counts of read, created, updated and skipped records.
+    """
+    counts = {"read": 0, "created": 0, "updated": 0, "skipped": 0}
+    seen = set()
+    chunk = []
+    start = time.perf_counter()
+
+    def flush():
+        created, _ = upsert_fda_chunk(chunk)
+        counts["created"] += created
+        counts["updated"] += len(chunk) - created
+        chunk.clear()
+        if progress:
+            progress(counts, time.perf_counter() - start)
+
+    for item in records:
+        counts["read"] += 1
+        product_id = item.get("product_id")
+        if not product_id or str(product_id) in seen:
+            counts["skipped"] += 1
+            continue
+        seen.add(str(product_id))
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return counts
+
+
+def content_hash(item) -> str:
+    stable = {key: value for key, value in item.items() if key not in VOLATILE_FIELDS}
+    encoded = json.dumps(stable, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def refresh_fda_chunk(records, run):
+    """
+    Upserts the records that are new or changed since they were last
+    imported, and marks all of them as seen by run.
+
+    Returns:
+        The counts of created, updated, unchanged and status_changed records.
+    """
+    hashes = {str(item["product_id"]): content_hash(item) for item in records}
+    known = {
+        registration.fda_product_id: registration
+        for registration in FdaRegistration.objects.filter(fda_product_id__in=hashes)
+    }
+
+    changed = []
+    status_changed = 0
+    for item in records:
+        fda_product_id = str(item["product_id"])
+        registration = known.get(fda_product_id)
+        if (
+            registration is not None
+            and registration.content_hash == hashes[fda_product_id]
+            and registration.removed_at is None
+            and registration.product_id is not None
+        ):
+            continue
+        if registration is not None and registration.status != item.get("status"):
+            status_changed += 1
+        changed.append(item)
+
+    created, product_ids = upsert_fda_chunk(changed) if changed else (0, {})
+    FdaRegistration.objects.bulk_create(
+        [
+            FdaRegistration(
+                fda_product_id=str(item["product_id"]),
+                product_id=product_ids[str(item["product_id"])],
+                content_hash=hashes[str(item["product_id"])],
+                status=item.get("status"),
+                last_seen_run=run,
+                removed_at=None,
+            )
+            for item in changed
+        ],
+        update_conflicts=True,
+        unique_fields=["fda_product_id"],
+        update_fields=[
+            "product",
+            "content_hash",
+            "status",
+            "last_seen_run",
+            "removed_at",
+            "updated_at",
+        ],
+    )
+    unchanged = hashes.keys() - {str(item["product_id"]) for item in changed}
+    FdaRegistration.objects.filter(fda_product_id__in=unchanged).update(
+        last_seen_run=run
+    )
+    return {
+        "created": created,
+        "updated": len(changed) - created,
+        "unchanged": len(unchanged),
+        "status_changed": status_changed,
+    }
+
+
+def start_fda_run(source: str, resume=False) -> FdaImportRun:
+    """
+    Starts an import run of source, or continues its last run when resume is
+    set and that run did not complete.
+
+    Raises:
+        FdaRunInProgress: The last run of source committed a chunk less than
+            FDA_RUN_STALL_TIMEOUT seconds ago, another process is running it.
+    """
+    stalled_before = timezone.now() - timedelta(seconds=settings.FDA_RUN_STALL_TIMEOUT)
+    with transaction.atomic():
+        # Concurrent starts of the same source wait here and then see the
+        # run the first one started or resumed
+        run = FdaImportRun.objects.select_for_update().filter(source=source).first()
+        if (
+            run is not None
+            and run.status == FdaImportRun.STATUS_RUNNING
+            and run.updated_at >= stalled_before
+        ):
+            raise FdaRunInProgress(
+                f"The import of {source} is in progress at {run.checkpoint} records."
+            )
+
+        if resume and run is not None and run.status != FdaImportRun.STATUS_COMPLETED:
+            run.status = FdaImportRun.STATUS_RUNNING
+            run.error = None
+            run.save(update_fields=["status", "error", "updated_at"])
+            return run
+        return FdaImportRun.objects.create(source=source)
+
+
+def refresh_fda_records(records, run: FdaImportRun, chunk_size=1000, progress=None):
+    """
+    Incrementally imports the records of run's source that follow its
+    checkpoint, committing the checkpoint with every chunk. Once all records
+    were read, the registrations last seen by an earlier run of the same
+    source that the run did not see are marked as removed, unless the run was
+    resumed and may have missed records. An export file does not remove the
+    registrations read from the search API, nor the other way round.
+
+    Args:
+        records: The records of the source, starting at the checkpoint.
+        progress: Called after every chunk with the counts so far.
+
+    Returns:
+        The counts of the run.
+    """
+    counts = {
+        "read": 0,
+        "created": 0,
+        "updated": 0,
+        "unchanged": 0,
+        "status_changed": 0,
+        "skipped": 0,
+        "removed": 0,
+    }
+    counts.update(run.counts or {})
+    seen = set()
+    chunk = []
+    consumed = run.checkpoint
+    resumed = run.checkpoint > 0
+    start = time.perf_counter()
+
+    def flush():
+        with transaction.atomic():
+            for key, value in refresh_fda_chunk(chunk, run).items():
+                counts[key] += value
+            run.checkpoint = consumed
+            run.counts = counts
+            run.save(update_fields=["checkpoint", "counts", "updated_at"])
+        chunk.clear()
+        if progress:
+            progress(counts, time.perf_counter() - start)
+
+    try:
+        for item in records:
+            consumed += 1
+            counts["read"] += 1
+            product_id = item.get("product_id")
+            if not product_id or str(product_id) in seen:
+                counts["skipped"] += 1
+                continue
+            seen.add(str(product_id))
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                flush()
+        flush()
+
+        with transaction.atomic():
+            if not resumed:
+                counts["removed"] = (
+                    FdaRegistration.objects.filter(
+                        removed_at__isnull=True, last_seen_run__source=run.source
+                    )
+                    .exclude(last_seen_run=run)
+                    .update(removed_at=timezone.now())
+                )
+            run.status = FdaImportRun.STATUS_COMPLETED
+            run.counts = counts
+            run.finished_at = timezone.now()
+            run.save(update_fields=["status", "counts", "finished_at", "updated_at"])
+    except BaseException as e:
+        run.status = FdaImportRun.STATUS_FAILED
+        run.error = repr(e)
+        run.save(update_fields=["status", "error", "updated_at"])
+        raise
+    return counts
+
+
+def refresh_fda_file(path: str, resume=False, chunk_size=1000, progress=None):
+    """
+    Incremental import of a JSON export.
+    """
+    run = start_fda_run(path, resume=resume)
+    with open(path, "r") as f:
+        records = itertools.islice(iter_fda_records(f), run.checkpoint, None)
+        return refresh_fda_records(records, run, chunk_size, progress)
+
+
+def refresh_fda_api(
+    url: str, resume=True, page_size=500, chunk_size=1000, progress=None
+):
+    """
+    Incremental import from the public search API.
+    """
+    run = start_fda_run(url, resume=resume)
+    records = fetch_fda_records(url, start=run.checkpoint, page_size=page_size)
+    return refresh_fda_records(records, run, chunk_size, progress)
+
+
+def fetch_fda_records(url: str, start=0, page_size=500, timeout=30, retries=3):
+    """
+    Yields the records of the FDA search API page by page, from the record
+    at start. Failed pages are retried with an exponential backoff.
+    """
+    with httpx.Client(timeout=timeout, headers=SEARCH_HEADERS) as client:
+        while True:
+            page = _fetch_page(client, url, start, page_size, retries)
+            records = page.get("data") or []
+            yield from records
+            start += len(records)
+            total = int(page.get("recordsFiltered", page.get("recordsTotal", 0)))
+            if not records or start >= total:
+                return
+
+
+def _fetch_page(client, url, start, page_size, retries):
+    params = dict(SEARCH_PARAMS, draw=1, start=start, length=page_size)
+    for attempt in range(retries + 1):
+        try:
+            response = client.get(url, params=params)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            if attempt == retries:
+                raise
+            delay = 2**attempt
+            print(f"FDA search page at {start} failed ({e}), retrying in {delay}s")
+            time.sleep(delay)
@@ -1,10 +1,16 @@
 import json
-import os
-from openai import OpenAI
-import instructor
 import re
+import threading
 
-from discovery.llm_response_models import ProductInfo
+from django.conf import settings
+
+from discovery.llm_response_models import ProductInfo, ProductInfoBatch
+from discovery.services.llm_client import create_completion, stream_completion
+from discovery.services.metrics import annotate, increment
+from discovery.services.micro_batch import MicroBatcher
+
+GLOBAL_MICRO_BATCHER = None
+_BATCHER_LOCK = threading.Lock()
 
 prompt = {
     "role": "system",
@@ -65,24 +71,194 @@ prompt = {
     """,
 }
 
+# Sections 1 and 2 of the prompt for input produced by encode_compact_llm_input,
+# the key fields and output rules are shared with the JSON prompt.
+compact_input_sections = """
+    ---
+    ### 1. Your Input Data Structure
+
+    You will be provided with one section per product image, each containing two sources of information:
+
+    *   **A table of text blocks**: One row per block in the form `fs|x|y|w|h|text`, where:
+        *   `fs`: An estimated font size in pixels, indicating its visual prominence.
+        *   `x`, `y`, `w`, `h`: The position and size of the text in percent of the page width and height.
+        *   `text`: The raw text content.
+        Rows are ordered from the most to the least prominent text. Fine print may have been left out.
+
+    *   **`reconstructed_text`**: The text below the table, grouped into lines with tabs (`\t`) separating columns. This provides the semantic reading order.
+
+    ---
+    ### 2. Your Analysis Strategy
+
+    1.  **Read for Context First**: Start by reading the `reconstructed_text` to understand the overall layout and the flow of information.
+
+    2.  **Cross-Reference for Importance**: Use `fs` as a definitive indicator of importance. Large values almost always indicate the Brand Name, Product Name, or a key feature like Quantity. Small values typically indicate ingredients, warnings or distributor information.
+
+    3.  **Use Proximity for Grouping**: Rows with close `x`/`y` values are physically close on the package and related.
+
+"""
+
+compact_prompt = {
+    "role": "system",
+    "content": prompt["content"][: prompt["content"].index("    ---\n    ### 1.")]
+    + compact_input_sections
+    + prompt["content"][prompt["content"].index("    ---\n    ### 3.") :],
+}
+
 
-def infer_product_details(_ocr_data):
-    client = instructor.patch(OpenAI(api_key=os.environ.get("LLM_API_KEY")))
+batch_prompt = {
+    "role": "system",
+    "content": prompt["content"]
+    + """
+    ---
+    ### 5. Several Products
 
+    *   The input contains several unrelated products, each one starting with a `### Item <n>` line.
+    *   Never mix information between items.
+    *   Return one `ProductInfo` per item in `items`, with `index` set to the item number.
+    """,
+}
+
+
+def _build_messages(_ocr_data, encoding="json"):
+    if encoding == "compact":
+        # Rows and columns are meaningful in the compact encoding, keep the whitespace
+        return [compact_prompt, {"role": "user", "content": str(_ocr_data).strip()}]
     cleaned = re.sub(r"\s+", " ", str(_ocr_data)).strip()
-    response = client.chat.completions.create(
-        model="gpt-5-nano",
-        messages=[prompt, {"role": "user", "content": str(cleaned)}],
-        response_model=ProductInfo,
-        # max_completion_tokens=2048
-    )
+    return [prompt, {"role": "user", "content": str(cleaned)}]
 
-    product = response
-    token_usage = response._raw_response.usage
+
+def _build_batch_messages(texts):
+    items = [
+        f"### Item {index}\n" + re.sub(r"\s+", " ", str(text)).strip()
+        for index, text in enumerate(texts)
+    ]
+    return [batch_prompt, {"role": "user", "content": "\n\n".join(items)}]
+
+
+def _record_usage(token_usage):
 
     # --- Print the results ---
     print(f"Prompt Tokens:     {token_usage.prompt_tokens}")
     print(f"Completion Tokens: {token_usage.completion_tokens}")
     print(f"Total Tokens:      {token_usage.total_tokens}")
+    details = getattr(token_usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    annotate(
+        prompt_tokens=token_usage.prompt_tokens,
+        completion_tokens=token_usage.completion_tokens,
+        cached_tokens=cached_tokens,
+    )
+    increment("llm_tokens_total", token_usage.prompt_tokens, kind="prompt")
+    increment("llm_tokens_total", token_usage.completion_tokens, kind="completion")
+    increment("llm_tokens_total", cached_tokens, kind="cached")
+
+
+def _product_to_dict(response):
+    product = response
+    _record_usage(response._raw_response.usage)
     print(product.model_dump_json(indent=2))
     return json.loads(product.model_dump_json(indent=2))
+
+
+def _stream_product(messages, timeout, on_partial):
+    partial = None
+    usage = []
+    for partial in stream_completion(
+        messages, ProductInfo, timeout=timeout, usage=usage
+    ):
+        on_partial(partial.model_dump(exclude_none=True, warnings=False))
+    if partial is None:
+        raise ValueError("The streamed completion was empty")
+    if usage:
+        _record_usage(usage[-1])
+
+    # Partial models accept anything, the complete product is validated here
+    product = ProductInfo.model_validate(partial.model_dump(warnings=False))
+    annotate(streamed=True)
+    print(product.model_dump_json(indent=2))
+    return json.loads(product.model_dump_json(indent=2))
+
+
+def infer_product_details(_ocr_data, timeout=None, encoding="json", on_partial=None):
+    """
+    Extracts the product from the OCR data. When on_partial is given the
+    completion is streamed and on_partial is called with the product fields
+    generated so far, as a dict, every time more of them arrive.
+    """
+    if on_partial is not None:
+        return _stream_product(
+            _build_messages(_ocr_data, encoding), timeout, on_partial
+        )
+
+    response = create_completion(
+        _build_messages(_ocr_data, encoding),
+        response_model=ProductInfo,
+        timeout=timeout,
+        # max_completion_tokens=2048
+    )
+    return _product_to_dict(response)
+
+
+def infer_product_details_batch(texts: list, timeout=None) -> list:
+    """
+    Extracts the products of several texts with a single completion.
+
+    Returns:
+        One product dict per text, None for the items missing from the answer.
+    """
+    response = create_completion(
+        _build_batch_messages(texts),
+        response_model=ProductInfoBatch,
+        timeout=timeout,
+    )
+    _record_usage(response._raw_response.usage)
+    annotate(batch_size=len(texts))
+
+    products = [None] * len(texts)
+    for item in response.items:
+        if 0 <= item.index < len(texts) and products[item.index] is None:
+            products[item.index] = json.loads(item.model_dump_json(exclude={"index"}))
+    print(f"Extracted {sum(p is not None for p in products)}/{len(texts)} products")
+    return products
+
+
+def _extract_batch(texts):
+    # A batch of one is cheaper with the single item prompt, and items the
+    # batched answer missed are extracted on their own by the waiting tasks
+    if len(texts) == 1:
+        return [None]
+    try:
+        return infer_product_details_batch(texts)
+    except Exception as e:
+        print(f"Batched extraction of {len(texts)} items failed: {e}")
+        return [None] * len(texts)
+
+
+def get_micro_batcher():
+    """
+    Singleton accessor for the batcher shared by the task threads of a worker.
+    """
+    global GLOBAL_MICRO_BATCHER
+
+    if GLOBAL_MICRO_BATCHER is None:
+        with _BATCHER_LOCK:
+            if GLOBAL_MICRO_BATCHER is None:
+                GLOBAL_MICRO_BATCHER = MicroBatcher(
+                    _extract_batch,
+                    window=settings.LLM_BATCH_WINDOW,
+                    max_items=settings.LLM_BATCH_MAX_ITEMS,
+                )
+    return GLOBAL_MICRO_BATCHER
+
+
+def infer_product_details_batched(_ocr_data):
+    """
+    infer_product_details that shares one completion with the texts other
+    threads of the worker submit within LLM_BATCH_WINDOW seconds.
+    """
+    product = get_micro_batcher().submit(_ocr_data)
+    if product is None:
+        return infer_product_details(_ocr_data)
+    increment("llm_batched_items_total")
+    return product
@@ -0,0 +1,226 @@
+"""Resized and re-encoded variants of the images in MEDIA_ROOT.
+
+Variants are generated with Pillow on first request, in a thread pool that
+bounds how many are encoded at once, and cached on disk in
+IMAGE_DERIVATIVE_ROOT under a key of the source image and the variant. The
+cache is kept under IMAGE_DERIVATIVE_CACHE_SIZE bytes by evicting the least
+recently used variants, whose modification time is refreshed when they are
+served."""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from discovery.services.image_store import image_digest, sharded_path
+
+FORMATS = {
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+}
+
+# Served variants are marked as used again at most this often
+TOUCH_INTERVAL = 3600
+
+GLOBAL_DERIVATIVE_POOL = None
+_POOL_LOCK = threading.Lock()
+# Futures of the variants being generated, so that concurrent requests for the
+# same variant wait for one generation
+_IN_FLIGHT = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+# Bytes written to the cache since it was last measured
+_WRITTEN_SINCE_EVICTION = 0
+
+
+class DerivativeError(Exception):
+    pass
+
+
+def get_derivative_pool():
+    """
+    Singleton accessor for the pool that encodes the variants of a process.
+    """
+    global GLOBAL_DERIVATIVE_POOL
+
+    if GLOBAL_DERIVATIVE_POOL is None:
+        with _POOL_LOCK:
+            if GLOBAL_DERIVATIVE_POOL is None:
+                GLOBAL_DERIVATIVE_POOL = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+                    thread_name_prefix="image-derivative",
+                )
+    return GLOBAL_DERIVATIVE_POOL
+
+
+def resolve_media_path(name: str):
+    """
+    The absolute path of an image in MEDIA_ROOT, from a path relative to it or
+    an absolute one inside it. None for anything outside of it, partial
+    uploads and cached variants.
+    """
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(media_root, name))
+    excluded = (
+        os.path.realpath(settings.IMAGE_DERIVATIVE_ROOT),
+        os.path.join(os.path.realpath(settings.IMAGE_STORE_ROOT), "incoming"),
+    )
+    if not path.startswith(media_root + os.sep):
+        return None
+    if any(path.startswith(root + os.sep) for root in excluded):
+        return None
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
+def derivative_key(source: str, width: int, image_format: str) -> str:
+    """
+    Key of a variant, which is also its ETag. Stored images are named after
+    their content, other files are identified by their modification time and
+    size so that they are not hashed on every request.
+    """
+    if os.path.realpath(source).startswith(
+        os.path.realpath(settings.IMAGE_STORE_ROOT) + os.sep
+    ):
+        source_key = image_digest(source)
+    else:
+        stat = os.stat(source)
+        source_key = f"{source}:{stat.st_mtime_ns}:{stat.st_size}"
+
+    variant = f"{source_key}:{width}:{image_format}:{settings.IMAGE_DERIVATIVE_QUALITY}"
+    return hashlib.sha256(variant.encode()).hexdigest()
+
+
+def open_derivative(source: str, width: int, image_format: str):
+    """
+    Opens the cached variant of source, generating it first if needed.
+
+    Returns:
+        The open variant file and its key.
+    """
+    if width not in settings.IMAGE_DERIVATIVE_WIDTHS:
+        raise DerivativeError(
+            f"width must be one of {settings.IMAGE_DERIVATIVE_WIDTHS}."
+        )
+    if image_format not in FORMATS:
+        raise DerivativeError(f"format must be one of {list(FORMATS)}.")
+
+    key = derivative_key(source, width, image_format)
+    path = sharded_path(settings.IMAGE_DERIVATIVE_ROOT, key, FORMATS[image_format][1])
+    generated = False
+    for _ in range(3):
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            # Not generated yet, or evicted by another process right after
+            generated = _generate_once(key, source, path, width, image_format)
+            continue
+
+        size = os.fstat(f.fileno()).st_size
+        if generated:
+            # Evicting the variant now does not affect the open file
+            _record_written(size)
+        elif os.fstat(f.fileno()).st_mtime < time.time() - TOUCH_INTERVAL:
+            os.utime(path)
+        return f, key
+    raise DerivativeError("The image variant was evicted while it was generated.")
+
+
+def _generate_once(key, source, path, width, image_format):
+    with _IN_FLIGHT_LOCK:
+        future = _IN_FLIGHT.get(key)
+        if future is None:
+            future = get_derivative_pool().submit(
+                _generate, source, path, width, image_format
+            )
+            _IN_FLIGHT[key] = future
+            future.add_done_callback(lambda _: _IN_FLIGHT.pop(key, None))
+            generated = True
+        else:
+            generated = False
+    future.result()
+    return generated
+
+
+def _generate(source, path, width, image_format):
+    pil_format = FORMATS[image_format][0]
+    temp_path = None
+    try:
+        with Image.open(source) as img:
+            # JPEGs are decoded at a reduced scale straight away
+            img.draft("RGB", (width, width))
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "RGBA") or pil_format == "JPEG":
+                img = img.convert("RGB")
+            if img.width > width:
+                height = max(1, round(img.height * width / img.width))
+                img = img.resize((width, height), Image.Resampling.LANCZOS)
+
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(path), delete=False
+            ) as f:
+                temp_path = f.name
+                img.save(
+                    f,
+                    format=pil_format,
+                    quality=settings.IMAGE_DERIVATIVE_QUALITY,
+                    optimize=True,
+                )
+        os.replace(temp_path, path)
+    except (OSError, Image.DecompressionBombError) as e:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise DerivativeError(f"Could not read the image: {e}")
+
+
+def _record_written(size):
+    global _WRITTEN_SINCE_EVICTION
+
+    _WRITTEN_SINCE_EVICTION += size
+    # The cache is measured again after a tenth of its size was written
+    if _WRITTEN_SINCE_EVICTION >= settings.IMAGE_DERIVATIVE_CACHE_SIZE / 10:
+        _WRITTEN_SINCE_EVICTION = 0
+        evict_derivatives(settings.IMAGE_DERIVATIVE_CACHE_SIZE)
+
+
+def evict_derivatives(max_bytes: int):
+    """
+    Deletes the least recently used variants until the cache takes at most
+    90% of max_bytes.
+
+    Returns:
+        The number of deleted variants and the bytes they took.
+    """
+    files = []
+    total = 0
+    for directory, _, filenames in os.walk(settings.IMAGE_DERIVATIVE_ROOT):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= max_bytes:
+        return 0, 0
+
+    deleted = freed = 0
+    for _, size, path in sorted(files):
+        if total - freed <= max_bytes * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        deleted += 1
+        freed += size
+    print(f"Evicted {deleted} image variants, {freed / 2**20:.1f}MB")
+    return deleted, freed
@@ -0,0 +1,207 @@
+"""Content-addressed image store.
+
+Uploads are written to IMAGE_STORE_ROOT under the SHA-256 digest of their
+content, sharded into two levels of subdirectories
+(e.g. images/3f/a2/3fa2...c9.jpg). The digest is computed while the chunks are
+written, an image that is already stored is not written twice, and the digest
+is a stable key for anything derived from the image. Resized copies are kept
+the same way in RESIZED_IMAGE_ROOT.
+
+Stored files are referenced by the identification jobs and by the image_path
+of the products in the tenant databases. Files of the store and its resized
+copies that none of them uses any more are deleted by collect_image_garbage,
+anything else in MEDIA_ROOT (e.g. uploads from before the store) is left alone."""
+
+import glob
+import hashlib
+import os
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.db.models import Q
+
+from discovery.models import ProductIdentificationJob
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def sharded_path(root: str, digest: str, extension: str) -> str:
+    return os.path.join(root, digest[:2], digest[2:4], f"{digest}{extension}")
+
+
+def _incoming_dir():
+    # Partial writes stay on the same filesystem so that they can be renamed
+    path = os.path.join(settings.IMAGE_STORE_ROOT, "incoming")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def write_incoming_chunks(chunks):
+    """
+    Writes an iterable of byte chunks to a new file of the incoming directory,
+    hashing them on the way.
+
+    Returns:
+        The path of the file and the digest of its content.
+    """
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=_incoming_dir(), delete=False) as f:
+        try:
+            for chunk in chunks:
+                digest.update(chunk)
+                f.write(chunk)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    return f.name, digest.hexdigest()
+
+
+def store_image_chunks(chunks, extension: str) -> str:
+    """
+    Writes an image from an iterable of byte chunks, hashing it on the way.
+
+    Returns:
+        The path of the stored image, which is the existing one when the same
+        content was stored before.
+    """
+    temp_path, digest = write_incoming_chunks(chunks)
+    return store_image_file(temp_path, digest, extension)
+
+
+def store_image_bytes(content: bytes, extension: str) -> str:
+    return store_image_chunks([content], extension)
+
+
+def store_image_file(path: str, digest: str, extension: str) -> str:
+    """
+    Moves a complete file of the incoming directory, whose content has the
+    given digest, into the store.
+    """
+    return _publish(
+        path, sharded_path(settings.IMAGE_STORE_ROOT, digest, extension.lower())
+    )
+
+
+def _publish(temp_path: str, path: str) -> str:
+    if os.path.exists(path):
+        # Duplicate content, keep the stored copy and protect it from the
+        # garbage collection until the new job references it
+        os.remove(temp_path)
+        os.utime(path)
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(temp_path, path)
+    return path
+
+
+def image_digest(path: str) -> str:
+    """
+    The content digest of an image, taken from the name of stored images.
+    """
+    root = os.path.abspath(settings.IMAGE_STORE_ROOT)
+    if os.path.abspath(path).startswith(root + os.sep):
+        return os.path.splitext(os.path.basename(path))[0]
+    return file_digest(path)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def referenced_image_paths() -> set:
+    """
+    Paths used by unfinished identification jobs, by the jobs that identified
+    a product, and by the products of the tenant databases.
+    """
+    jobs = ProductIdentificationJob.objects.filter(
+        Q(
+            status__in=[
+                ProductIdentificationJob.STATUS_PENDING,
+                ProductIdentificationJob.STATUS_RUNNING,
+            ]
+        )
+        | Q(product__isnull=False)
+    ).values_list("image_paths", "prepared_image_paths")
+
+    paths = set()
+    for image_paths, prepared_image_paths in jobs.iterator():
+        paths.update(image_paths or [])
+        paths.update(prepared_image_paths or [])
+    paths.update(_tenant_image_paths())
+    # Relative paths are relative to MEDIA_ROOT
+    return {os.path.abspath(os.path.join(settings.MEDIA_ROOT, path)) for path in paths}
+
+
+def _tenant_image_paths():
+    paths = set()
+    for db_path in glob.glob(os.path.join(settings.TENANT_DB_ROOT, "*.db")):
+        conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT image_path FROM products WHERE image_path IS NOT NULL"
+            ).fetchall()
+        except sqlite3.Error as e:
+            # An unreadable tenant database must not let its images be deleted
+            raise RuntimeError(f"Could not read the image paths of {db_path}: {e}")
+        finally:
+            conn.close()
+        paths.update(path for (path,) in rows if path)
+    return paths
+
+
+def _stored_files():
+    # Only the store and its resized copies, other files in MEDIA_ROOT are not
+    # managed here
+    for root in (settings.IMAGE_STORE_ROOT, settings.RESIZED_IMAGE_ROOT):
+        for directory, _, filenames in os.walk(root):
+            for filename in filenames:
+                yield os.path.join(directory, filename)
+
+
+def collect_image_garbage(min_age: float, dry_run=False):
+    """
+    Deletes stored images that are not referenced and were not written or
+    uploaded again in the last min_age seconds.
+
+    Returns:
+        The number of deleted files and the bytes they took.
+    """
+    referenced = referenced_image_paths()
+    cutoff = time.time() - min_age
+    deleted = freed = 0
+
+    for path in _stored_files():
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if stat.st_mtime > cutoff or os.path.abspath(path) in referenced:
+            continue
+        if not dry_run:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+        deleted += 1
+        freed += stat.st_size
+
+    if not dry_run:
+        _remove_empty_shards()
+    return deleted, freed
+
+
+def _remove_empty_shards():
+    for root in (settings.IMAGE_STORE_ROOT, settings.RESIZED_IMAGE_ROOT):
+        for directory, _, filenames in os.walk(root, topdown=False):
+            if directory == root or directory.endswith(os.sep + "incoming"):
+                continue
+            if not filenames and not os.listdir(directory):
+                os.rmdir(directory)
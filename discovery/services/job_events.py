@@ -0,0 +1,236 @@
+"""Job update notifications.
+
+The pipeline publishes a small message whenever a job changes stage or
+finishes, and the long-poll and SSE endpoints wait for those messages instead
+of polling the database. Messages go through a Valkey channel per job so that
+web and worker processes can be on different hosts. Without a Valkey URL an
+in-process bus is used when tasks run eagerly in the web process (e.g. in
+tests), and otherwise waiting clients re-read the job from the database every
+JOB_EVENTS_POLL_INTERVAL seconds, since no message would ever reach them.
+
+With Valkey, workers also keep the polling data of every job they update in
+Valkey for JOB_STATUS_TTL seconds, and the result endpoints read it from there,
+so that clients polling a job do not query the database."""
+
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+import redis
+import redis.asyncio as aioredis
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from discovery.models import ProductIdentificationJob
+from discovery.serializers import ProductSerializer
+
+CHANNEL_PREFIX = "jobs:"
+STATUS_PREFIX = "jobs:status:"
+
+GLOBAL_EVENTS_CLIENT = None
+_LOCAL_SUBSCRIBERS = defaultdict(set)
+_LOCAL_LOCK = threading.Lock()
+
+
+def _uses_valkey():
+    url = settings.JOB_EVENTS_URL or ""
+    return url.startswith(("redis://", "rediss://", "valkey://", "unix://"))
+
+
+def _uses_local_bus():
+    # Only eager tasks publish in the process the clients wait in
+    return not _uses_valkey() and getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False)
+
+
+@sync_to_async
+def _job_fingerprint(task_id):
+    # Changes whenever a message would have been published for the job
+    return (
+        ProductIdentificationJob.objects.filter(task_id=task_id)
+        .values_list("status", "stage", "partial_product_data")
+        .first()
+    )
+
+
+def _events_url():
+    # redis-py does not know the valkey:// scheme, the protocol is the same
+    url = settings.JOB_EVENTS_URL
+    if url.startswith("valkey://"):
+        url = "redis://" + url[len("valkey://") :]
+    return url
+
+
+def get_events_client():
+    """
+    Singleton accessor for the client publishing job updates.
+    """
+    global GLOBAL_EVENTS_CLIENT
+
+    if GLOBAL_EVENTS_CLIENT is None:
+        GLOBAL_EVENTS_CLIENT = redis.Redis.from_url(_events_url())
+    return GLOBAL_EVENTS_CLIENT
+
+
+def publish_job_update(task_id: str, message: dict):
+    """
+    Notifies everyone waiting on the job. Publishing is best effort, a lost
+    message only means that a waiting client sees the update at its timeout.
+    """
+    channel = f"{CHANNEL_PREFIX}{task_id}"
+    if _uses_valkey():
+        try:
+            get_events_client().publish(channel, json.dumps(message))
+        except redis.RedisError as e:
+            print(f"Could not publish update of job {task_id}: {e}")
+        return
+
+    if not _uses_local_bus():
+        return
+    with _LOCAL_LOCK:
+        subscribers = list(_LOCAL_SUBSCRIBERS[channel])
+    for loop, queue in subscribers:
+        loop.call_soon_threadsafe(queue.put_nowait, message)
+
+
+def job_status_data(job):
+    """
+    Builds the polling data of an image identification job.
+    """
+    data = {"stage": job.stage}
+    if job.quality_report:
+        data["quality"] = job.quality_report
+    if job.timings:
+        data["timings"] = job.timings
+
+    if job.status == ProductIdentificationJob.STATUS_SUCCESS:
+        data["status"] = "success"
+        data["result"] = ProductSerializer(job.product).data if job.product else None
+    elif job.status == ProductIdentificationJob.STATUS_FAILED:
+        data["status"] = "error"
+        data["error"] = job.error
+    else:
+        data["status"] = "pending"
+        if job.partial_product_data:
+            data["partial"] = job.partial_product_data
+    return data
+
+
+def store_job_status(job):
+    """
+    Keeps the polling data of the job in Valkey, call it after every update
+    of the job that clients should see. A snapshot that could not be replaced
+    is dropped, so that readers fall back to the database.
+    """
+    if not _uses_valkey():
+        return
+    key = f"{STATUS_PREFIX}{job.task_id}"
+    try:
+        data = json.dumps(job_status_data(job), cls=DjangoJSONEncoder)
+        get_events_client().set(key, data, ex=settings.JOB_STATUS_TTL)
+    except redis.RedisError as e:
+        print(f"Could not store the status of job {job.task_id}: {e}")
+        try:
+            get_events_client().delete(key)
+        except redis.RedisError:
+            pass
+
+
+def load_job_status(task_id):
+    """
+    The polling data of the job, from Valkey when the workers stored it and
+    otherwise from the database. None if there is no job with task_id.
+    """
+    if _uses_valkey():
+        try:
+            data = get_events_client().get(f"{STATUS_PREFIX}{task_id}")
+        except redis.RedisError as e:
+            print(f"Could not load the status of job {task_id}: {e}")
+            data = None
+        if data is not None:
+            return json.loads(data)
+
+    job = (
+        ProductIdentificationJob.objects.select_related("product")
+        .filter(task_id=task_id)
+        .first()
+    )
+    return None if job is None else job_status_data(job)
+
+
+class JobSubscription:
+    """
+    Async context manager receiving the updates of one job.
+    Subscribe before reading the job state so that no update is missed.
+    """
+
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.channel = f"{CHANNEL_PREFIX}{task_id}"
+        self.client = None
+        self.pubsub = None
+        self.local = None
+        self.fingerprint = None
+
+    async def __aenter__(self):
+        if _uses_valkey():
+            self.client = aioredis.Redis.from_url(_events_url())
+            self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            await self.pubsub.subscribe(self.channel)
+        elif _uses_local_bus():
+            self.local = (asyncio.get_running_loop(), asyncio.Queue())
+            with _LOCAL_LOCK:
+                _LOCAL_SUBSCRIBERS[self.channel].add(self.local)
+        else:
+            self.fingerprint = await _job_fingerprint(self.task_id)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.pubsub is not None:
+            await self.pubsub.unsubscribe(self.channel)
+            await self.pubsub.aclose()
+            await self.client.aclose()
+        if self.local is not None:
+            with _LOCAL_LOCK:
+                _LOCAL_SUBSCRIBERS[self.channel].discard(self.local)
+                if not _LOCAL_SUBSCRIBERS[self.channel]:
+                    del _LOCAL_SUBSCRIBERS[self.channel]
+
+    async def get(self, timeout: float):
+        """
+        Returns the next update, or None when none arrives within timeout seconds.
+        """
+        if timeout <= 0:
+            return None
+        if self.local is not None:
+            try:
+                return await asyncio.wait_for(self.local[1].get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        if self.pubsub is None:
+            return await self._poll(deadline)
+        while (remaining := deadline - loop.time()) > 0:
+            message = await self.pubsub.get_message(timeout=remaining)
+            if message is not None and message["type"] == "message":
+                return json.loads(message["data"])
+        return None
+
+    async def _poll(self, deadline):
+        loop = asyncio.get_running_loop()
+        while (remaining := deadline - loop.time()) > 0:
+            await asyncio.sleep(min(settings.JOB_EVENTS_POLL_INTERVAL, remaining))
+            fingerprint = await _job_fingerprint(self.task_id)
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                status, stage, partial = fingerprint or (None, None, None)
+                return {
+                    "task_id": self.task_id,
+                    "stage": stage,
+                    "status": status,
+                    "partial": partial is not None,
+                }
+        return None
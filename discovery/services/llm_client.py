@@ -0,0 +1,191 @@
+"""Process wide LLM clients.
+
+Building an OpenAI client creates a new HTTP connection pool, so the clients
+are created once per worker process and reused by every task. All requests
+go through create_completion (or stream_completion) which
+caps the number of concurrent requests, applies a per-call timeout and, when
+configured, sends a hedged duplicate of a request that is slower than
+LLM_HEDGE_AFTER. A sync request cannot be interrupted, so the slower of two
+hedged requests runs on until it returns. Hedges therefore have their own
+budget of LLM_MAX_HEDGED_REQUESTS, outside the cap of the regular requests,
+and a request is not hedged when that budget is used up.
+
+The SDK does not retry, failed requests are retried by the Celery tasks.
+
+Point LLM_BASE_URL at a local stub (see `manage.py run_llm_stub`) to run the
+pipeline without calling the real API."""
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+import instructor
+from django.conf import settings
+from instructor import Mode, Partial
+from instructor.processing.response import handle_response_model
+from openai import OpenAI
+
+GLOBAL_LLM_CLIENT = None
+GLOBAL_LLM_CLIENT_PID = None
+_CLIENT_LOCK = threading.Lock()
+
+# One semaphore and one hedging pool for the whole process
+_REQUEST_SLOTS = None
+_HEDGE_SLOTS = None
+_HEDGE_EXECUTOR = None
+
+
+def _http_limits():
+    return httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+    )
+
+
+def _client_options():
+    return {
+        "api_key": settings.LLM_API_KEY,
+        "base_url": settings.LLM_BASE_URL,
+        "timeout": settings.LLM_TIMEOUT,
+        "max_retries": 0,
+    }
+
+
+def get_llm_client():
+    """
+    Singleton accessor for the instructor patched OpenAI client.
+    The client is rebuilt in a forked child so that prefork workers never
+    share sockets with their parent.
+    """
+    global GLOBAL_LLM_CLIENT, GLOBAL_LLM_CLIENT_PID
+    global _REQUEST_SLOTS, _HEDGE_SLOTS, _HEDGE_EXECUTOR
+
+    if GLOBAL_LLM_CLIENT is None or GLOBAL_LLM_CLIENT_PID != os.getpid():
+        with _CLIENT_LOCK:
+            if GLOBAL_LLM_CLIENT is None or GLOBAL_LLM_CLIENT_PID != os.getpid():
+                GLOBAL_LLM_CLIENT = instructor.patch(
+                    OpenAI(
+                        http_client=httpx.Client(limits=_http_limits()),
+                        **_client_options(),
+                    )
+                )
+                GLOBAL_LLM_CLIENT_PID = os.getpid()
+                _REQUEST_SLOTS = threading.BoundedSemaphore(
+                    settings.LLM_MAX_CONCURRENT_REQUESTS
+                )
+                _HEDGE_SLOTS = threading.BoundedSemaphore(
+                    settings.LLM_MAX_HEDGED_REQUESTS
+                )
+                _HEDGE_EXECUTOR = ThreadPoolExecutor(
+                    max_workers=settings.LLM_MAX_CONCURRENT_REQUESTS
+                    + settings.LLM_MAX_HEDGED_REQUESTS,
+                    thread_name_prefix="llm-hedge",
+                )
+
+    return GLOBAL_LLM_CLIENT
+
+
+def _resolve_options(timeout, hedge_after):
+    timeout = settings.LLM_TIMEOUT if timeout is None else timeout
+    hedge_after = settings.LLM_HEDGE_AFTER if hedge_after is None else hedge_after
+    return timeout, hedge_after
+
+
+def create_completion(
+    messages, response_model, timeout=None, hedge_after=None, **kwargs
+):
+    """
+    Runs a structured chat completion on the pooled client.
+
+    Args:
+        messages: The chat messages.
+        response_model: The pydantic model instructor validates the output against.
+        timeout: Seconds before a single attempt is abandoned, LLM_TIMEOUT by default.
+        hedge_after: Seconds after which a duplicate request is sent if the first
+            one has not returned, LLM_HEDGE_AFTER by default. 0 disables hedging.
+
+    Returns:
+        The validated response_model instance of whichever request finished first.
+    """
+    client = get_llm_client()
+    timeout, hedge_after = _resolve_options(timeout, hedge_after)
+    kwargs.setdefault("model", settings.LLM_MODEL)
+
+    def attempt(slots):
+        # Runs in a slot the caller acquired
+        try:
+            return client.chat.completions.create(
+                messages=messages,
+                response_model=response_model,
+                timeout=timeout,
+                **kwargs,
+            )
+        finally:
+            slots.release()
+
+    _REQUEST_SLOTS.acquire()
+    if not hedge_after:
+        return attempt(_REQUEST_SLOTS)
+
+    first = _HEDGE_EXECUTOR.submit(attempt, _REQUEST_SLOTS)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return first.result()
+    if not _HEDGE_SLOTS.acquire(blocking=False):
+        # The hedging budget is used up
+        return first.result()
+
+    print(f"LLM request slower than {hedge_after}s, sending a hedged request")
+    pending = {first, _HEDGE_EXECUTOR.submit(attempt, _HEDGE_SLOTS)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                # The other request keeps its slot until it returns
+                return future.result()
+            error = future.exception()
+    raise error
+
+
+def _choice_chunks(stream, usage):
+    # The last chunk only carries the token usage, instructor expects choices
+    for chunk in stream:
+        if chunk.usage is not None and usage is not None:
+            usage.append(chunk.usage)
+        if chunk.choices:
+            yield chunk
+
+
+def stream_completion(messages, response_model, timeout=None, usage=None, **kwargs):
+    """
+    Streams a structured chat completion. Instructor collects the partials of a
+    stream into a list before returning them, so the request is built with its
+    tool definition and the stream is parsed here as it arrives.
+
+    Args:
+        usage: A list the token usage of the request is appended to.
+
+    Yields:
+        Partial response_model instances, with more fields filled in every time.
+        Streamed requests are never hedged.
+    """
+    client = get_llm_client()
+    timeout, _ = _resolve_options(timeout, 0)
+    kwargs.setdefault("model", settings.LLM_MODEL)
+    partial_model, request = handle_response_model(
+        Partial[response_model],
+        mode=Mode.TOOLS,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+
+    with _REQUEST_SLOTS:
+        stream = client.chat.completions.create(timeout=timeout, **request)
+        yield from partial_model.from_streaming_response(
+            _choice_chunks(stream, usage), mode=Mode.TOOLS
+        )
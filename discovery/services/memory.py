@@ -0,0 +1,113 @@
+"""Worker memory accounting.
+
+OCR workers run under a hard container memory limit. Celery recycles a
+prefork child after a task once its memory crosses
+CELERY_WORKER_MAX_MEMORY_PER_CHILD, the helpers here measure the peak memory of
+each task and keep single huge images from being decoded at full size."""
+
+import resource
+
+import cv2
+from PIL import Image
+
+_REDUCED_FLAGS = {
+    cv2.IMREAD_COLOR: (
+        (8, cv2.IMREAD_REDUCED_COLOR_8),
+        (4, cv2.IMREAD_REDUCED_COLOR_4),
+        (2, cv2.IMREAD_REDUCED_COLOR_2),
+    ),
+    cv2.IMREAD_GRAYSCALE: (
+        (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+        (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+        (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+    ),
+}
+
+
+def _status_kb(field: str):
+    # VmRSS and VmHWM of /proc/self/status, in kilobytes
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def current_rss_bytes() -> int:
+    kb = _status_kb("VmRSS")
+    if kb is None:
+        # No procfs, the peak is the best available estimate
+        return max_rss_bytes()
+    return kb * 1024
+
+
+def peak_rss_bytes() -> int:
+    """
+    Peak resident memory of the process since the last reset_peak_rss().
+    """
+    kb = _status_kb("VmHWM")
+    if kb is None:
+        return max_rss_bytes()
+    return kb * 1024
+
+
+def max_rss_bytes() -> int:
+    """
+    Peak resident memory over the whole life of the process, which is what
+    Celery compares with CELERY_WORKER_MAX_MEMORY_PER_CHILD.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def reset_peak_rss():
+    """
+    Resets the peak measured by peak_rss_bytes() to the current memory, so
+    that the peak of a single task can be measured. Linux only.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def read_image_capped(image_path: str, max_pixels: int, flags=cv2.IMREAD_COLOR):
+    """
+    cv2.imread that never decodes more than about max_pixels pixels.
+    Larger JPEGs are decoded at 1/2, 1/4 or 1/8 scale straight away and other
+    formats are scaled down after decoding.
+
+    Returns:
+        The image, or None if it cannot be read.
+    """
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        return None
+
+    pixels = width * height
+    flag = flags
+    reduced_flags = _REDUCED_FLAGS.get(flags, ())
+    if max_pixels and pixels > max_pixels and reduced_flags:
+        # The largest reduction that keeps at least max_pixels, 1/2 at least
+        flag = reduced_flags[-1][1]
+        for factor, reduced in reduced_flags:
+            if pixels / factor**2 >= max_pixels:
+                flag = reduced
+                break
+        print(f"Decoding {width}x{height} image {image_path} at a reduced size")
+
+    img = cv2.imread(image_path, flag)
+    if img is None:
+        return None
+
+    height, width = img.shape[:2]
+    if max_pixels and width * height > max_pixels:
+        scale = (max_pixels / (width * height)) ** 0.5
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return img
@@ -0,0 +1,191 @@
+"""Pipeline timing and metrics.
+
+Stages run inside a span that measures their duration. Code running within
+the span adds attributes to it (image sizes, OCR box counts, LLM tokens,
+cache hits), and the spans of an identification job are stored on the job.
+
+Durations are also aggregated into histograms, and token and cache hit
+counts into counters. Web and worker processes share them through Valkey so
+that the metrics endpoint sees all workers. Without a Valkey URL they are kept
+in process memory."""
+
+import contextvars
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+
+# Upper bounds in seconds, from fast stages up to slow OCR and LLM calls
+HISTOGRAM_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Histograms that are not durations
+METRIC_BUCKETS = {
+    "task_peak_memory_bytes": tuple(
+        mb * 2**20 for mb in (256, 512, 1024, 1536, 2048, 3072, 4096)
+    ),
+}
+
+HISTOGRAMS_KEY = "metrics:histograms"
+COUNTERS_KEY = "metrics:counters"
+
+GLOBAL_METRICS_CLIENT = None
+_LOCAL_METRICS = defaultdict(float)
+_LOCAL_LOCK = threading.Lock()
+_CURRENT_SPAN = contextvars.ContextVar("current_span", default=None)
+
+
+def _uses_valkey():
+    url = settings.METRICS_URL or ""
+    return url.startswith(("redis://", "rediss://", "valkey://", "unix://"))
+
+
+def get_metrics_client():
+    """
+    Singleton accessor for the client of the shared metrics store.
+    """
+    global GLOBAL_METRICS_CLIENT
+
+    if GLOBAL_METRICS_CLIENT is None:
+        url = settings.METRICS_URL
+        if url.startswith("valkey://"):
+            url = "redis://" + url[len("valkey://") :]
+        GLOBAL_METRICS_CLIENT = redis.Redis.from_url(url, decode_responses=True)
+    return GLOBAL_METRICS_CLIENT
+
+
+def _series(name, labels):
+    # Prometheus series name, e.g. stage_duration_seconds{stage="ocr"}
+    if not labels:
+        return name
+    label_text = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{label_text}}}"
+
+
+def _add(fields: dict, key: str):
+    if _uses_valkey():
+        try:
+            with get_metrics_client().pipeline(transaction=False) as pipe:
+                for field, amount in fields.items():
+                    pipe.hincrbyfloat(key, field, amount)
+                pipe.execute()
+        except redis.RedisError as e:
+            print(f"Could not record metrics: {e}")
+        return
+
+    with _LOCAL_LOCK:
+        for field, amount in fields.items():
+            _LOCAL_METRICS[(key, field)] += amount
+
+
+def observe(name: str, value: float, **labels):
+    """
+    Adds a value to a histogram.
+    """
+    series = _series(name, labels)
+    buckets = METRIC_BUCKETS.get(name, HISTOGRAM_BUCKETS)
+    bucket = next((b for b in buckets if value <= b), "+Inf")
+    _add(
+        {
+            f"{series}|bucket|{bucket}": 1,
+            f"{series}|sum": value,
+            f"{series}|count": 1,
+        },
+        HISTOGRAMS_KEY,
+    )
+
+
+def increment(name: str, amount: float = 1, **labels):
+    """
+    Adds to a counter.
+    """
+    if amount:
+        _add({_series(name, labels): amount}, COUNTERS_KEY)
+
+
+@contextmanager
+def span(name: str):
+    """
+    Measures a pipeline stage. The yielded record collects the attributes
+    added with annotate() and gets the duration when the stage ends.
+    """
+    record = {"stage": name}
+    token = _CURRENT_SPAN.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _CURRENT_SPAN.reset(token)
+        record["duration_ms"] = round(duration * 1000, 1)
+        observe("stage_duration_seconds", duration, stage=name)
+
+
+def annotate(**attributes):
+    """
+    Adds attributes to the span of the running stage, if there is one.
+    """
+    record = _CURRENT_SPAN.get()
+    if record is not None:
+        record.update(attributes)
+
+
+def _read_metrics():
+    if _uses_valkey():
+        client = get_metrics_client()
+        return client.hgetall(HISTOGRAMS_KEY), client.hgetall(COUNTERS_KEY)
+
+    with _LOCAL_LOCK:
+        items = list(_LOCAL_METRICS.items())
+    histograms = {f: v for (k, f), v in items if k == HISTOGRAMS_KEY}
+    counters = {f: v for (k, f), v in items if k == COUNTERS_KEY}
+    return histograms, counters
+
+
+def _number(value):
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def export_metrics() -> str:
+    """
+    Renders all histograms and counters in the Prometheus text format.
+    """
+    histograms, counters = _read_metrics()
+
+    series = defaultdict(dict)
+    for field, value in histograms.items():
+        name, kind, *bucket = field.split("|")
+        series[name][bucket[0] if bucket else kind] = float(value)
+
+    lines = []
+    typed = set()
+    for name in sorted(series):
+        values = series[name]
+        metric, _, label_text = name.partition("{")
+        label_text = label_text.rstrip("}")
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} histogram")
+            typed.add(metric)
+        prefix = f"{label_text}," if label_text else ""
+        cumulative = 0.0
+        for bucket in (*METRIC_BUCKETS.get(metric, HISTOGRAM_BUCKETS), "+Inf"):
+            cumulative += values.get(str(bucket), 0.0)
+            lines.append(
+                f'{metric}_bucket{{{prefix}le="{bucket}"}} {_number(cumulative)}'
+            )
+        suffix = f"{{{label_text}}}" if label_text else ""
+        lines.append(f"{metric}_sum{suffix} {_number(values.get('sum', 0.0))}")
+        lines.append(f"{metric}_count{suffix} {_number(values.get('count', 0.0))}")
+
+    for name in sorted(counters):
+        metric = name.partition("{")[0]
+        if metric not in typed:
+            lines.append(f"# TYPE {metric} counter")
+            typed.add(metric)
+        lines.append(f"{name} {_number(counters[name])}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,79 @@
+"""Micro-batching of concurrent calls.
+
+LLM workers run many tasks on threads of one process. A MicroBatcher holds the
+items submitted by those threads for a short window and hands them to a single
+batch function, then gives every thread back its own result. The first thread
+of a batch waits for the window (or until the batch is full) and makes the call,
+the others only wait for their result."""
+
+import threading
+from concurrent.futures import Future
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    def __init__(self, process_batch, window: float, max_items: int):
+        """
+        Args:
+            process_batch: Called with a list of items, returns a list with one
+                result per item.
+            window: Seconds the first item of a batch waits for more items.
+            max_items: A full batch is sent without waiting for the window.
+        """
+        self.process_batch = process_batch
+        self.window = window
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._open = None
+
+    def submit(self, item):
+        """
+        Adds the item to the open batch and blocks until its result is in.
+        Exceptions of the batch function are raised in every waiting thread.
+        """
+        future = Future()
+        with self._lock:
+            batch = self._open
+            leader = batch is None
+            if leader:
+                batch = self._open = _Batch()
+            batch.items.append((item, future))
+            if len(batch.items) >= self.max_items:
+                self._open = None
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._run(batch.items)
+        return future.result()
+
+    def _run(self, entries):
+        # Every future is resolved whatever happens, the other threads of the
+        # batch would otherwise wait forever
+        try:
+            results = list(self.process_batch([item for item, _ in entries]))
+        except BaseException as e:
+            for _, future in entries:
+                future.set_exception(e)
+            if not isinstance(e, Exception):
+                # e.g. the worker shutting down, which the leader must not swallow
+                raise
+            return
+        for index, (_, future) in enumerate(entries):
+            if index < len(results):
+                future.set_result(results[index])
+            else:
+                future.set_exception(
+                    RuntimeError(
+                        f"The batch returned {len(results)} results for "
+                        f"{len(entries)} items."
+                    )
+                )
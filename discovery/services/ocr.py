@@ -10,49 +10,173 @@ import os
 import cv2
 import json
 import numpy as np
+from django.conf import settings
+
+from discovery.services.memory import read_image_capped
+from discovery.services.ocr_backends import create_ocr_backend
 
 # 1. Define the variable as None initially.
 # This is safe to import anywhere (API, Beat, Worker) because it consumes no memory yet.
 GLOBAL_OCR = None
 
 
+def _check_ocr_service():
+    # Optional: Safety check to prevent accidental loading in API container
+    # If you run a script locally, 'SERVICE_TYPE' might be None, so we allow that too.
+    service_type = os.environ.get("SERVICE_TYPE", "local")
+    if service_type not in ["celery-worker", "celery-worker-ocr", "local"]:
+        raise RuntimeError(
+            f"Attempting to load OCR in unauthorized service: {service_type}"
+        )
+
+
 def get_ocr_engine():
     """
-    Singleton accessor for PaddleOCR.
-    Initializes the model ONLY if it hasn't been created yet.
+    Singleton accessor for the OCR backend selected with OCR_BACKEND.
+    Initializes the models ONLY if they haven't been created yet.
     """
     global GLOBAL_OCR
 
     # 2. Check if it's already loaded
     if GLOBAL_OCR is None:
-        print("Initializing PaddleOCR model (First Run)...")
-
-        # Optional: Safety check to prevent accidental loading in API container
-        # If you run a script locally, 'SERVICE_TYPE' might be None, so we allow that too.
-        service_type = os.environ.get("SERVICE_TYPE", "local")
-        if service_type not in ["celery-worker", "local"]:
-            raise RuntimeError(
-                f"Attempting to load OCR in unauthorized service: {service_type}"
-            )
-
-        # Limit threads to prevent memory explosion
-        from paddleocr import (
-            PaddleOCR,
-        )  # Import inside to avoid top-level dependency issues
-
-        # Initialize ONCE
-        GLOBAL_OCR = PaddleOCR(
-            use_textline_orientation=True,
-            lang="en",
-            ocr_version="PP-OCRv4",  # Explicitly use v4
-            det_model_dir=None,  # Let it download the default (Mobile)
-            rec_model_dir=None,
-            cls_model_dir=None,
-        )
+        print(f"Initializing {settings.OCR_BACKEND} OCR backend (First Run)...")
+        _check_ocr_service()
+
+        # Initialize ONCE, with an explicit thread count per worker process
+        GLOBAL_OCR = create_ocr_backend(settings.OCR_BACKEND)
 
     return GLOBAL_OCR
 
 
+def estimate_text_boxes(img: np.ndarray, probe_max_side: int) -> np.ndarray:
+    """
+    Runs text detection on a downscaled copy of the image.
+
+    Returns:
+        The detected boxes as an (N, 4, 2) array in full resolution pixels.
+    """
+    height, width = img.shape[:2]
+    probe_scale = min(1.0, probe_max_side / max(height, width))
+    probe = img
+    if probe_scale < 1.0:
+        probe = cv2.resize(
+            img, None, fx=probe_scale, fy=probe_scale, interpolation=cv2.INTER_AREA
+        )
+
+    return get_ocr_engine().detect(probe) / probe_scale
+
+
+def plan_adaptive_resize(
+    boxes: np.ndarray,
+    image_shape: tuple,
+    target_text_height: float,
+    min_side: int,
+    dense_min_boxes: int,
+):
+    """
+    Picks the smallest scale that keeps the small text of the image at least
+    target_text_height pixels tall, and the region of small text that is
+    better read at full resolution.
+
+    Args:
+        boxes: Text boxes from estimate_text_boxes, in full resolution pixels.
+        image_shape: The shape of the full resolution image.
+        target_text_height: The minimum text height in pixels after resizing.
+        min_side: The longest side is never scaled below this.
+        dense_min_boxes: Number of boxes close to the target after resizing
+            that makes their region worth a full resolution pass.
+
+    Returns:
+        A (scale, region) tuple, scale is at most 1 and region is an
+        (x0, y0, x1, y1) crop in full resolution pixels or None.
+    """
+    height, width = image_shape[:2]
+    if len(boxes) == 0:
+        # Nothing found at low resolution, leave the image as it is
+        return 1.0, None
+
+    box_heights = boxes[:, :, 1].max(axis=1) - boxes[:, :, 1].min(axis=1)
+    # A low percentile instead of the minimum, single specks are not text size
+    small_text_height = max(float(np.percentile(box_heights, 10)), 1.0)
+    scale = target_text_height / small_text_height
+    scale = min(1.0, max(scale, min_side / max(height, width)))
+
+    # Text that ends up close to the target is read again from the original
+    small = boxes[box_heights * scale < 1.5 * target_text_height]
+    if scale >= 1.0 or len(small) < dense_min_boxes:
+        return scale, None
+
+    pad = int(np.median(box_heights))
+    x0 = max(0, int(small[:, :, 0].min()) - pad)
+    y0 = max(0, int(small[:, :, 1].min()) - pad)
+    x1 = min(width, int(small[:, :, 0].max()) + pad)
+    y1 = min(height, int(small[:, :, 1].max()) + pad)
+    if (x1 - x0) * (y1 - y0) > 0.5 * width * height:
+        # Small text all over the package, a crop would not save anything
+        return 1.0, None
+    return scale, (x0, y0, x1, y1)
+
+
+def _result_lists(results):
+    if not results or not results[0]:
+        return [], [], []
+    ocr_output = results[0]
+    return (
+        list(ocr_output.get("rec_texts", [])),
+        list(ocr_output.get("rec_scores", [])),
+        [np.asarray(p) for p in ocr_output.get("rec_polys", [])],
+    )
+
+
+def predict_adaptive(ocr_engine, img: np.ndarray) -> list:
+    """
+    OCR at the smallest resolution that keeps the text readable.
+    A cheap low resolution detection pass estimates the text size, the image is
+    resized accordingly and dense small text is read from a full resolution crop.
+
+    Returns:
+        A result list shaped like PaddleOCR's, with polygons in the
+        coordinates of the resized image.
+    """
+    boxes = estimate_text_boxes(img, settings.OCR_PROBE_MAX_SIDE)
+    scale, region = plan_adaptive_resize(
+        boxes,
+        img.shape,
+        settings.OCR_TARGET_TEXT_HEIGHT,
+        settings.OCR_ADAPTIVE_MIN_SIDE,
+        settings.OCR_DENSE_REGION_MIN_BOXES,
+    )
+    print(
+        f"Adaptive OCR: {img.shape[1]}x{img.shape[0]}, {len(boxes)} boxes, "
+        f"scale {scale:.2f}, dense region {region}"
+    )
+
+    scaled = img
+    if scale < 1.0:
+        scaled = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    texts, scores, polys = _result_lists(ocr_engine.predict(scaled))
+
+    if region is not None:
+        x0, y0, x1, y1 = region
+        crop_texts, crop_scores, crop_polys = _result_lists(
+            ocr_engine.predict(img[y0:y1, x0:x1])
+        )
+        if crop_texts:
+            # The full resolution pass replaces whatever was read inside the region
+            keep = []
+            for i, poly in enumerate(polys):
+                cx, cy = poly.mean(axis=0) / scale
+                if not (x0 <= cx <= x1 and y0 <= cy <= y1):
+                    keep.append(i)
+            texts = [texts[i] for i in keep] + crop_texts
+            scores = [scores[i] for i in keep] + crop_scores
+            polys = [polys[i] for i in keep] + [
+                ((p + np.array([x0, y0])) * scale).astype(np.int32) for p in crop_polys
+            ]
+
+    return [{"rec_texts": texts, "rec_scores": scores, "rec_polys": polys}]
+
+
 class NpEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, np.integer):
@@ -64,7 +188,7 @@ class NpEncoder(json.JSONEncoder):
         return super(NpEncoder, self).default(obj)
 
 
-def process_image_with_ocr(images: list[str]):
+def process_image_with_ocr(images: list[str], adaptive=False):
     print(f"Processing images with OCR... {images}")
     # 3. Get the global instance.
     # If this is the first task, it loads the model.
@@ -77,13 +201,16 @@ def process_image_with_ocr(images: list[str]):
     raw_ocr_output = []
 
     for image_path in images:
-        img = cv2.imread(image_path)
+        img = read_image_capped(image_path, settings.IMAGE_MAX_DECODE_PIXELS)
         if img is None:
             print(f"Warning: Could not read image at {image_path}. Skipping.")
             continue
 
         # 4. Use the singleton instance
-        results = ocr_engine.predict(img)
+        if adaptive:
+            results = predict_adaptive(ocr_engine, img)
+        else:
+            results = ocr_engine.predict(img)
 
         if results and results[0]:
             raw_ocr_output.append(results)
@@ -116,3 +243,41 @@ def process_image_with_ocr(images: list[str]):
                 structured_data.append(structured_entry)
 
     return raw_ocr_output
+
+
+def serialize_ocr_output(raw_ocr_output: list) -> list:
+    """
+    Converts the PaddleOCR results into plain lists so they can be stored
+    between pipeline stages. Only the fields used by the reconstruction are kept.
+    """
+    serialized = []
+    for results in raw_ocr_output:
+        ocr_output = results[0]
+        serialized.append(
+            [
+                {
+                    "rec_texts": list(ocr_output.get("rec_texts", [])),
+                    "rec_scores": [float(s) for s in ocr_output.get("rec_scores", [])],
+                    "rec_polys": [
+                        np.asarray(p).tolist() for p in ocr_output.get("rec_polys", [])
+                    ],
+                }
+            ]
+        )
+    return serialized
+
+
+def deserialize_ocr_output(serialized: list) -> list:
+    """
+    Inverse of serialize_ocr_output, restores the polygons as numpy arrays.
+    """
+    return [
+        [
+            {
+                "rec_texts": results[0]["rec_texts"],
+                "rec_scores": results[0]["rec_scores"],
+                "rec_polys": [np.array(p) for p in results[0]["rec_polys"]],
+            }
+        ]
+        for results in serialized
+    ]
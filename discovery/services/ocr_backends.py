@@ -0,0 +1,146 @@
+"""OCR inference backends.
+
+Every backend reads text with predict(img), which returns a result list shaped
+like PaddleOCR's, and finds text boxes with detect(img), which the adaptive
+resolution pre-pass uses. OCR workers are CPU only, so the backends differ in
+the CPU runtime they run the PP-OCRv4 detection and recognition models on:
+
+- mkldnn: Paddle Inference with MKL-DNN (oneDNN) kernels, PaddleOCR's default
+- paddle: Paddle Inference with its plain CPU kernels
+- onnxruntime: ONNX Runtime on the models exported with paddle2onnx
+- int8: ONNX Runtime on int8 quantized exports (manage.py quantize_ocr_models)
+
+The backend is selected with OCR_BACKEND, and every backend uses
+OCR_CPU_THREADS threads per worker process, or its runtime's default when it
+is 0. The ONNX backends need the optional rapidocr_onnxruntime package."""
+
+import numpy as np
+from django.conf import settings
+
+# Model names of the PP-OCRv4 pipeline with lang="en"
+DET_MODEL_NAME = "PP-OCRv4_mobile_det"
+REC_MODEL_NAME = "en_PP-OCRv4_mobile_rec"
+
+
+class PaddleBackend:
+    """
+    PaddleOCR pipeline, optionally with MKL-DNN kernels.
+    """
+
+    def __init__(self, enable_mkldnn=True, cpu_threads=0):
+        # Import inside to avoid top-level dependency issues
+        from paddleocr import PaddleOCR
+
+        # Always passed, PaddleOCR 3.x enables MKL-DNN when it is left unset
+        self.options = {"device": "cpu", "enable_mkldnn": enable_mkldnn}
+        if cpu_threads:
+            self.options["cpu_threads"] = cpu_threads
+
+        model_options = {}
+        if settings.OCR_DET_MODEL_DIR:
+            model_options["text_detection_model_name"] = DET_MODEL_NAME
+            model_options["text_detection_model_dir"] = settings.OCR_DET_MODEL_DIR
+        if settings.OCR_REC_MODEL_DIR:
+            model_options["text_recognition_model_name"] = REC_MODEL_NAME
+            model_options["text_recognition_model_dir"] = settings.OCR_REC_MODEL_DIR
+
+        self.pipeline = PaddleOCR(
+            use_textline_orientation=True,
+            lang="en",
+            ocr_version="PP-OCRv4",  # Explicitly use v4
+            **model_options,
+            **self.options,
+        )
+        self.detector = None
+
+    def predict(self, img: np.ndarray) -> list:
+        return self.pipeline.predict(img)
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        if self.detector is None:
+            from paddleocr import TextDetection
+
+            # Same detection model as the pipeline
+            self.detector = TextDetection(
+                model_name=DET_MODEL_NAME,
+                model_dir=settings.OCR_DET_MODEL_DIR or None,
+                **self.options,
+            )
+
+        results = self.detector.predict(img)
+        if not results or len(results[0].get("dt_polys", [])) == 0:
+            return np.zeros((0, 4, 2), dtype=np.float32)
+        return np.asarray(results[0]["dt_polys"], dtype=np.float32).reshape(-1, 4, 2)
+
+
+class OnnxBackend:
+    """
+    The PP-OCRv4 models exported to ONNX, run by ONNX Runtime through RapidOCR,
+    which implements the same pre and post processing as PaddleOCR.
+    """
+
+    def __init__(self, det_model_path, rec_model_path, cpu_threads=0):
+        if not det_model_path or not rec_model_path:
+            raise RuntimeError(
+                "The ONNX OCR backends need OCR_DET_MODEL_DIR and OCR_REC_MODEL_DIR "
+                "to point at the exported .onnx models."
+            )
+
+        try:
+            from rapidocr_onnxruntime import RapidOCR
+        except ImportError as e:
+            raise RuntimeError(
+                "The ONNX OCR backends need the optional rapidocr_onnxruntime "
+                "package: pip install rapidocr_onnxruntime"
+            ) from e
+
+        self.engine = RapidOCR(
+            det_model_path=det_model_path,
+            rec_model_path=rec_model_path,
+            # -1 is ONNX Runtime's default
+            intra_op_num_threads=cpu_threads or -1,
+            inter_op_num_threads=1,
+        )
+
+    def predict(self, img: np.ndarray) -> list:
+        result, _ = self.engine(img)
+        result = result or []
+        return [
+            {
+                "rec_texts": [text for _, text, _ in result],
+                "rec_scores": [float(score) for _, _, score in result],
+                "rec_polys": [np.asarray(box, dtype=np.int32) for box, _, _ in result],
+            }
+        ]
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        result, _ = self.engine(img, use_det=True, use_cls=False, use_rec=False)
+        if not result:
+            return np.zeros((0, 4, 2), dtype=np.float32)
+        return np.asarray(result, dtype=np.float32).reshape(-1, 4, 2)
+
+
+def create_ocr_backend(name: str):
+    """
+    Creates the OCR backend called name, see the module docstring.
+    """
+    threads = settings.OCR_CPU_THREADS
+    if name == "paddle":
+        return PaddleBackend(enable_mkldnn=False, cpu_threads=threads)
+    if name == "mkldnn":
+        return PaddleBackend(enable_mkldnn=True, cpu_threads=threads)
+    if name in ("onnxruntime", "int8"):
+        suffix = "_int8.onnx" if name == "int8" else ".onnx"
+        return OnnxBackend(
+            _onnx_model_path(settings.OCR_DET_MODEL_DIR, suffix),
+            _onnx_model_path(settings.OCR_REC_MODEL_DIR, suffix),
+            cpu_threads=threads,
+        )
+    raise ValueError(f"Unknown OCR backend: {name}")
+
+
+def _onnx_model_path(model_dir, suffix):
+    # The exported model is inference.onnx, its quantized copy inference_int8.onnx
+    if not model_dir:
+        return None
+    return f"{model_dir.rstrip('/')}/inference{suffix}"
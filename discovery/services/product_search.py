@@ -0,0 +1,57 @@
+"""Full-text search over the product catalog.
+
+Products carry a weighted tsvector of their name (A), manufacturer (B),
+category (C) and ingredients (D), maintained by database triggers and indexed
+with GIN. Queries match every word of the text, the last one as a prefix so
+that results follow the user while they type, and are ranked with ts_rank.
+
+The 'simple' configuration is used because product names are brands and
+words of several languages that a stemmer would only mangle."""
+
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F
+
+from discovery.models import Product
+
+SEARCH_CONFIG = "simple"
+# Words of a query past this are ignored
+MAX_QUERY_TERMS = 8
+# A shorter last word is matched exactly, a one letter prefix matches most of
+# the catalog and makes ranking it slow
+MIN_PREFIX_LENGTH = 2
+
+
+def build_search_query(text: str):
+    """
+    The tsquery matching all the words of text, the last one as a prefix.
+    None if text has no words.
+    """
+    terms = re.findall(r"\w+", str(text).lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+
+    # Words only hold letters, digits and underscores, so they need no quoting
+    # in a raw tsquery
+    raw = terms[:-1]
+    last = terms[-1]
+    raw.append(f"{last}:*" if len(last) >= MIN_PREFIX_LENGTH else last)
+    return SearchQuery(" & ".join(raw), search_type="raw", config=SEARCH_CONFIG)
+
+
+def search_products(text: str):
+    """
+    The products matching text, best ranked first, each annotated with its
+    rank. Empty if text has no words.
+    """
+    query = build_search_query(text)
+    if query is None:
+        return Product.objects.none()
+
+    return (
+        Product.objects.filter(search_vector=query)
+        .defer("search_vector")
+        .annotate(rank=SearchRank(F("search_vector"), query))
+        .order_by("-rank", "id")
+    )
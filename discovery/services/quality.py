@@ -0,0 +1,164 @@
+"""Quality gate that runs before OCR.
+
+Blurry, dark or text-free photos are rejected in milliseconds instead of
+spending seconds of OCR and an LLM call on them. All checks run on a
+grayscale copy decoded at reduced size, so the metrics do not depend on the
+resolution of the upload."""
+
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Long side of the grayscale copy the metrics are computed on
+ANALYSIS_SIZE = 1024
+
+# Marginal images are accepted but flagged when a metric is within this
+# factor of its rejection threshold
+FLAG_MARGIN = 1.5
+
+
+def load_analysis_image(image_path: str):
+    """
+    Decodes the image as grayscale with a long side of ANALYSIS_SIZE pixels.
+    Large JPEGs are decoded at a reduced scale straight away, which is much
+    faster than decoding the full image and resizing it.
+    """
+    try:
+        with Image.open(image_path) as img:
+            long_side = max(img.size)
+    except Exception as e:
+        print(f"Warning: Could not read image at {image_path}: {e}")
+        return None
+
+    flag = cv2.IMREAD_GRAYSCALE
+    if long_side >= ANALYSIS_SIZE * 8:
+        flag = cv2.IMREAD_REDUCED_GRAYSCALE_8
+    elif long_side >= ANALYSIS_SIZE * 4:
+        flag = cv2.IMREAD_REDUCED_GRAYSCALE_4
+    elif long_side >= ANALYSIS_SIZE * 2:
+        flag = cv2.IMREAD_REDUCED_GRAYSCALE_2
+
+    gray = cv2.imread(image_path, flag)
+    if gray is None:
+        return None
+
+    scale = ANALYSIS_SIZE / max(gray.shape[:2])
+    if scale < 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray
+
+
+def count_text_like_regions(gray: np.ndarray) -> int:
+    """
+    Counts regions that look like lines of text: high local contrast that
+    merges into elongated, well filled blobs when closed along the text direction.
+    Both orientations are tried so that rotated photos are not rejected.
+    """
+    gradient = cv2.morphologyEx(
+        gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    )
+    _, binary = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    best = 0
+    for kernel_size in ((9, 1), (1, 9)):
+        closed = cv2.morphologyEx(
+            binary,
+            cv2.MORPH_CLOSE,
+            cv2.getStructuringElement(cv2.MORPH_RECT, kernel_size),
+        )
+        contours, _ = cv2.findContours(
+            closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+        )
+        count = 0
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            long_edge, short_edge = max(w, h), min(w, h)
+            if short_edge < 6 or short_edge > 200 or long_edge < short_edge * 1.5:
+                continue
+            fill = cv2.countNonZero(closed[y : y + h, x : x + w]) / float(w * h)
+            if fill > 0.45:
+                count += 1
+        best = max(best, count)
+    return best
+
+
+def assess_image_quality(image_path: str, thresholds: dict) -> dict:
+    """
+    Measures sharpness, exposure and text presence of an image.
+
+    Args:
+        image_path: The image to check.
+        thresholds: min_sharpness, min_brightness, max_brightness,
+            min_contrast, max_clipped and min_text_regions.
+
+    Returns:
+        A report with whether the image is accepted, the rejection reasons, the
+        flags raised for marginal metrics and the metrics themselves.
+    """
+    start = time.perf_counter()
+    report = {"accepted": False, "reasons": [], "flags": []}
+
+    gray = load_analysis_image(image_path)
+    if gray is None:
+        report["reasons"].append("unreadable")
+        return report
+
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+    brightness = float(gray.mean())
+    contrast = float(gray.std())
+    clipped = float(np.count_nonzero((gray <= 5) | (gray >= 250)) / gray.size)
+    text_regions = count_text_like_regions(gray)
+
+    if sharpness < thresholds["min_sharpness"]:
+        report["reasons"].append("blurry")
+    elif sharpness < thresholds["min_sharpness"] * FLAG_MARGIN:
+        report["flags"].append("slightly_blurry")
+
+    if brightness < thresholds["min_brightness"]:
+        report["reasons"].append("too_dark")
+    elif brightness > thresholds["max_brightness"]:
+        # Black on white labels are mostly white, an overexposed photo has also
+        # washed out the text
+        if contrast < thresholds["min_contrast"]:
+            report["reasons"].append("too_bright")
+        else:
+            report["flags"].append("bright")
+
+    if clipped > thresholds["max_clipped"]:
+        report["flags"].append("poor_exposure")
+
+    if text_regions < thresholds["min_text_regions"]:
+        report["reasons"].append("no_text")
+    elif text_regions < thresholds["min_text_regions"] * FLAG_MARGIN:
+        report["flags"].append("little_text")
+
+    report["accepted"] = not report["reasons"]
+    report["metrics"] = {
+        "sharpness": round(sharpness, 1),
+        "brightness": round(brightness, 1),
+        "contrast": round(contrast, 1),
+        "clipped": round(clipped, 3),
+        "text_regions": text_regions,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+    return report
+
+
+def check_images(image_paths: list, thresholds: dict):
+    """
+    Runs the quality gate over all images of a job.
+
+    Returns:
+        The accepted image paths and the per image reports, which refer to the
+        images by their index.
+    """
+    reports = [
+        {"image": index, **assess_image_quality(path, thresholds)}
+        for index, path in enumerate(image_paths)
+    ]
+    accepted = [
+        path for path, report in zip(image_paths, reports) if report["accepted"]
+    ]
+    return accepted, reports
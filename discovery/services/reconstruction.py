@@ -1,10 +1,22 @@
 # SLN307 a refined version of SLN304 combined with SLN300_A
 # SLN300_A Solution 3, variant of solution 1 in Phase 2
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 import numpy as np
 
+try:
+    import tiktoken
+except ImportError:  # Optional, token counts are estimated without it
+    tiktoken = None
+
+# Defaults for the compact encoding, overridden by the LLM_INPUT_* settings
+DEFAULT_MIN_CONFIDENCE = 0.5
+DEFAULT_TOKEN_BUDGET = 3000
+CHARS_PER_TOKEN = 4
+
+GLOBAL_TOKENIZER = None
+
 
 # --- Using the same simulated raw OCR output ---
 # --- Helper functions ---
@@ -32,6 +44,33 @@ def get_avg_char_width(box: Dict[str, Any]) -> float:
     return width / len(text)
 
 
+def _box_extents(polygons) -> Dict[str, np.ndarray]:
+    """
+    Computes the extents of all boxes at once from their polygons.
+    The polygons are stacked into a single (N, 4, 2) array, boxes with a
+    different number of points fall back to one reduction per box.
+    """
+    try:
+        stacked = np.stack([np.asarray(p) for p in polygons])
+        x_coords = stacked[:, :, 0]
+        y_coords = stacked[:, :, 1]
+        return {
+            "x_start": x_coords.min(axis=1),
+            "x_end": x_coords.max(axis=1),
+            "y_start": y_coords.min(axis=1),
+            "y_end": y_coords.max(axis=1),
+            "y_center": y_coords.mean(axis=1),
+        }
+    except ValueError:
+        return {
+            "x_start": np.array([get_box_x_start(p) for p in polygons]),
+            "x_end": np.array([get_box_x_end(p) for p in polygons]),
+            "y_start": np.array([np.min(p[:, 1]) for p in polygons]),
+            "y_end": np.array([np.max(p[:, 1]) for p in polygons]),
+            "y_center": np.array([get_box_center_y(p) for p in polygons]),
+        }
+
+
 def reconstruct_text_with_columns(single_image_ocr_result: List[Dict[str, Any]]) -> str:
     """
     Reconstructs a text block by grouping text into lines and then detecting columns within each line.
@@ -48,83 +87,61 @@ def reconstruct_text_with_columns(single_image_ocr_result: List[Dict[str, Any]])
     if not ocr_data.get("rec_texts"):
         return ""
 
-    # Step 1: Extract and prepare the data
-    boxes_with_info = []
-    for i in range(len(ocr_data["rec_texts"])):
-        boxes_with_info.append(
-            {
-                "text": ocr_data["rec_texts"][i],
-                "polygon": ocr_data["rec_polys"][i],
-                "y_center": get_box_center_y(ocr_data["rec_polys"][i]),
-            }
-        )
+    # Step 1: Extract and prepare the data for all boxes at once
+    texts = ocr_data["rec_texts"]
+    extents = _box_extents(ocr_data["rec_polys"][: len(texts)])
+    heights = extents["y_end"] - extents["y_start"]
 
     # Step 2: Sort all boxes from top to bottom
-    sorted_boxes = sorted(boxes_with_info, key=lambda b: b["y_center"])
-
-    # Step 3: Group boxes into rough physical lines
-    all_lines = []
-    if not sorted_boxes:
-        return ""
-    current_line = [sorted_boxes[0]]
-    for i in range(1, len(sorted_boxes)):
-        prev_box = current_line[-1]
-        current_box = sorted_boxes[i]
-        vertical_distance = abs(current_box["y_center"] - prev_box["y_center"])
-        tolerance = (
-            (
-                get_box_height(prev_box["polygon"])
-                + get_box_height(current_box["polygon"])
-            )
-            / 2
-            * 0.7
-        )
-        if vertical_distance <= tolerance:
-            current_line.append(current_box)
-        else:
-            all_lines.append(current_line)
-            current_line = [current_box]
-    all_lines.append(current_line)
-
-    # Step 4: Detect columns within each line and assemble the final text
-    reconstructed_text = ""
+    order = np.argsort(extents["y_center"], kind="stable")
+    y_center = extents["y_center"][order]
+    heights = heights[order]
+
+    # Step 3: Group boxes into rough physical lines.
+    # A box starts a new line when it is further from the previous box than
+    # the tolerance derived from both box heights.
+    vertical_distance = np.abs(np.diff(y_center))
+    tolerance = (heights[:-1] + heights[1:]) / 2 * 0.7
+    line_ids = np.concatenate(([0], np.cumsum(vertical_distance > tolerance)))
+
+    # Step 4: Sort the boxes within each line from left to right
+    line_order = np.lexsort((extents["x_start"][order], line_ids))
+    order = order[line_order]
+    line_ids = line_ids[line_order]
+    x_start = extents["x_start"][order]
+    x_end = extents["x_end"][order]
+    ordered_texts = [texts[i] for i in order]
+
+    # Step 5: Detect columns between neighbouring boxes of the same line.
+    # The gap must be larger than a few average character widths.
+    text_lengths = np.array([len(text) for text in ordered_texts])
+    avg_char_w = np.divide(
+        x_end - x_start,
+        text_lengths,
+        out=np.zeros(len(ordered_texts)),
+        where=text_lengths > 0,
+    )
+    gaps = x_start[1:] - x_end[:-1]
+    # This factor is tunable. A lower number means more sensitive column detection.
+    GAP_TOLERANCE_FACTOR = 3.0
+    is_column_break = (avg_char_w[:-1] > 0) & (
+        gaps > avg_char_w[:-1] * GAP_TOLERANCE_FACTOR
+    )
+    is_new_line = line_ids[1:] != line_ids[:-1]
+
+    # Step 6: Assemble the final text
     # A tab is used as a machine-readable column separator.
     COLUMN_SEPARATOR = "\t\t"
+    separators = np.where(
+        is_new_line, "\n", np.where(is_column_break, COLUMN_SEPARATOR, " ")
+    )
 
-    for line in all_lines:
-        # Sort the boxes within each line from left to right
-        line_sorted = sorted(line, key=lambda b: get_box_x_start(b["polygon"]))
+    parts = [ordered_texts[0]]
+    for separator, text in zip(separators.tolist(), ordered_texts[1:]):
+        parts.append(separator)
+        parts.append(text)
 
-        line_text = ""
-        if not line_sorted:
-            continue
-
-        line_text += line_sorted[0]["text"]
-        for i in range(len(line_sorted) - 1):
-            current_box = line_sorted[i]
-            next_box = line_sorted[i + 1]
-
-            # Calculate the horizontal gap between the boxes
-            gap = get_box_x_start(next_box["polygon"]) - get_box_x_end(
-                current_box["polygon"]
-            )
-
-            # Heuristic for detecting a column break:
-            # The gap must be larger than a few average character widths.
-            avg_char_w = get_avg_char_width(current_box)
-            # This factor is tunable. A lower number means more sensitive column detection.
-            GAP_TOLERANCE_FACTOR = 3.0
-
-            if avg_char_w > 0 and gap > avg_char_w * GAP_TOLERANCE_FACTOR:
-                line_text += COLUMN_SEPARATOR
-            else:
-                line_text += " "
-
-            line_text += next_box["text"]
-
-        reconstructed_text += line_text + "\n"
-
-    return reconstructed_text.strip()
+    return "".join(parts).strip()
 
 
 def create_text_block_json(
@@ -148,50 +165,41 @@ def create_text_block_json(
     if not ocr_data.get("rec_texts") or not ocr_data.get("rec_polys"):
         return {"page_dimensions": {"width": 0, "height": 0}, "text_blocks": []}
 
-    text_blocks = []
-    max_x, max_y = 0, 0
-
-    # --- 2. Process Each Text Element Individually ---
-    for i in range(len(ocr_data["rec_texts"])):
-        text = ocr_data["rec_texts"][i]
-        polygon = ocr_data["rec_polys"][i]
-
-        # --- 3. Calculate Bounding Box from Polygon ---
-        x_coords = polygon[:, 0]
-        y_coords = polygon[:, 1]
-
-        x_min = np.min(x_coords)
-        y_min = np.min(y_coords)
-        x_max = np.max(x_coords)
-        y_max = np.max(y_coords)
-
-        width = x_max - x_min
-        height = y_max - y_min
-
-        # Update overall page dimensions
-        max_x = max(max_x, x_max)
-        max_y = max(max_y, y_max)
-
-        # --- 4. Estimate Font Size from Bounding Box Height ---
-        # This is a direct and effective heuristic: font size correlates with height.
-        font_size = int(height)
-
-        # --- 5. Assemble the Text Block Object ---
-        text_block = {
+    texts = ocr_data["rec_texts"]
+
+    # --- 2. Calculate Bounding Boxes from all Polygons at once ---
+    extents = _box_extents(ocr_data["rec_polys"][: len(texts)])
+    x_min = extents["x_start"]
+    y_min = extents["y_start"]
+    x_max = extents["x_end"]
+    y_max = extents["y_end"]
+    width = x_max - x_min
+    height = y_max - y_min
+
+    # --- 3. Estimate Font Size from Bounding Box Height ---
+    # This is a direct and effective heuristic: font size correlates with height.
+    # --- 4. Assemble the Text Block Objects ---
+    text_blocks = [
+        {
             "text": text,
-            "font_size": font_size,
-            "bounding_box": {
-                "x": int(x_min),
-                "y": int(y_min),
-                "width": int(width),
-                "height": int(height),
-            },
+            "font_size": h,
+            "bounding_box": {"x": x, "y": y, "width": w, "height": h},
         }
-        text_blocks.append(text_block)
+        for text, x, y, w, h in zip(
+            texts,
+            x_min.astype(np.int64).tolist(),
+            y_min.astype(np.int64).tolist(),
+            width.astype(np.int64).tolist(),
+            height.astype(np.int64).tolist(),
+        )
+    ]
 
-    # --- 6. Assemble the Final Output JSON ---
+    # --- 5. Assemble the Final Output JSON ---
     output_json = {
-        "page_dimensions": {"width": int(max_x), "height": int(max_y)},
+        "page_dimensions": {
+            "width": int(max(0, x_max.max())),
+            "height": int(max(0, y_max.max())),
+        },
         "text_blocks": text_blocks,
     }
 
@@ -229,3 +237,151 @@ def reconstruct_llm_input(raw_ocr_output: list) -> Dict[str, Any]:
         sln307_result += "\n"
 
     return sln307_result
+
+
+def count_tokens(text: str) -> int:
+    """
+    Counts the prompt tokens of a text with tiktoken when it is installed,
+    otherwise estimates them from the number of characters.
+    """
+    global GLOBAL_TOKENIZER
+
+    if tiktoken is not None and GLOBAL_TOKENIZER is None:
+        try:
+            GLOBAL_TOKENIZER = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"Could not load tokenizer, estimating token counts: {e}")
+            GLOBAL_TOKENIZER = False
+    if GLOBAL_TOKENIZER:
+        return len(GLOBAL_TOKENIZER.encode(text))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _select_ocr_boxes(
+    single_image_ocr_result: List[Dict[str, Any]], indices: List[int]
+) -> List[Dict[str, Any]]:
+    """
+    Returns a copy of a single image OCR result that only holds the given boxes.
+    """
+    ocr_data = single_image_ocr_result[0]
+    return [
+        {
+            "rec_texts": [ocr_data["rec_texts"][i] for i in indices],
+            "rec_polys": [ocr_data["rec_polys"][i] for i in indices],
+        }
+    ]
+
+
+def _compact_blocks(
+    raw_ocr_output: list, min_confidence: float
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, int]]]:
+    """
+    Flattens the text blocks of all images into compact rows, with the
+    coordinates quantized to percent of the page. Low confidence blocks are dropped.
+    """
+    blocks = []
+    pages = []
+    for image_index, result in enumerate(raw_ocr_output):
+        layout_json = create_text_block_json(result)
+        page = layout_json["page_dimensions"]
+        pages.append(page)
+        if not layout_json["text_blocks"]:
+            continue
+
+        scores = result[0].get("rec_scores", [])
+        page_w = max(page["width"], 1)
+        page_h = max(page["height"], 1)
+        for box_index, block in enumerate(layout_json["text_blocks"]):
+            confidence = float(scores[box_index]) if box_index < len(scores) else 1.0
+            if confidence < min_confidence or not block["text"].strip():
+                continue
+            box = block["bounding_box"]
+            blocks.append(
+                {
+                    "image": image_index,
+                    "index": box_index,
+                    "text": block["text"],
+                    "font_size": block["font_size"],
+                    "confidence": confidence,
+                    "x": round(box["x"] * 100 / page_w),
+                    "y": round(box["y"] * 100 / page_h),
+                    "w": round(box["width"] * 100 / page_w),
+                    "h": round(box["height"] * 100 / page_h),
+                }
+            )
+    return blocks, pages
+
+
+def _render_compact(
+    raw_ocr_output: list, blocks: List[Dict[str, Any]], pages: List[Dict[str, int]]
+) -> str:
+    output = ""
+    for image_index, result in enumerate(raw_ocr_output):
+        image_blocks = [b for b in blocks if b["image"] == image_index]
+        page = pages[image_index]
+        output += (
+            f"--- Image {image_index + 1} ({page['width']}x{page['height']}px) ---\n"
+        )
+        output += "fs|x|y|w|h|text\n"
+        for b in image_blocks:
+            output += (
+                f"{b['font_size']}|{b['x']}|{b['y']}|{b['w']}|{b['h']}|{b['text']}\n"
+            )
+
+        # Reconstruct the reading order from the kept boxes only
+        kept = sorted(b["index"] for b in image_blocks)
+        if kept:
+            output += "reconstructed_text:\n"
+            output += reconstruct_text_with_columns(_select_ocr_boxes(result, kept))
+            output += "\n"
+    return output
+
+
+def encode_compact_llm_input(
+    raw_ocr_output: list, token_budget: int = None, min_confidence: float = None
+) -> Tuple[str, int, int]:
+    """
+    Compact alternative to reconstruct_llm_input. Text blocks are written as
+    `fs|x|y|w|h|text` rows instead of indented JSON, and blocks are trimmed,
+    least important first (smallest font size, then lowest confidence),
+    until the output fits the token budget.
+
+    Args:
+        raw_ocr_output: The raw OCR output for all images.
+        token_budget: The maximum number of prompt tokens, 0 disables trimming.
+        min_confidence: Blocks recognised with a lower confidence are dropped.
+
+    Returns:
+        The encoded text, its token count and the number of text blocks it
+        kept, 0 when none was confident enough or fits the budget.
+    """
+    token_budget = DEFAULT_TOKEN_BUDGET if token_budget is None else token_budget
+    min_confidence = (
+        DEFAULT_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    )
+
+    blocks, pages = _compact_blocks(raw_ocr_output, min_confidence)
+    # Most important first, so trimming only ever drops the tail
+    blocks.sort(key=lambda b: (b["font_size"], b["confidence"]), reverse=True)
+
+    encoded = _render_compact(raw_ocr_output, blocks, pages)
+    token_count = count_tokens(encoded)
+    if not token_budget or token_count <= token_budget:
+        return encoded, token_count, len(blocks)
+
+    # Binary search for the largest number of blocks that fits the budget
+    low, high = 0, len(blocks) - 1
+    best = _render_compact(raw_ocr_output, [], pages)
+    best_count = count_tokens(best)
+    best_keep = 0
+    while low <= high:
+        keep = (low + high) // 2
+        candidate = _render_compact(raw_ocr_output, blocks[:keep], pages)
+        candidate_count = count_tokens(candidate)
+        if candidate_count <= token_budget:
+            best, best_count, best_keep = candidate, candidate_count, keep
+            low = keep + 1
+        else:
+            high = keep - 1
+
+    return best, best_count, best_keep
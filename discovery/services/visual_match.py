@@ -0,0 +1,217 @@
+"""Perceptual hash lookup of previously identified products.
+
+Different photos of the same package differ byte for byte but have nearly
+the same perceptual hash. Every identified product keeps the pHash and dHash
+of its images, and new uploads are looked up in a BK-tree over the pHashes
+before any OCR is done. The dHash confirms a candidate.
+
+The BK-tree lives in the memory of each worker process. It is loaded when
+the worker starts and picks up hashes stored since the last load every
+VISUAL_INDEX_REFRESH seconds."""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+from django.utils import timezone
+
+from discovery.models import ProductImageHash
+from discovery.services.quality import load_analysis_image
+
+GLOBAL_VISUAL_INDEX = None
+_INDEX_LOCK = threading.Lock()
+
+
+def to_signed64(value: int) -> int:
+    # Hashes are stored in a signed BigIntegerField
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int("".join("1" if bit else "0" for bit in bits.flatten()), 2)
+
+
+def phash(gray: np.ndarray) -> int:
+    """
+    64 bit DCT hash: the 8x8 lowest frequencies of a 32x32 thumbnail,
+    compared with their median.
+    """
+    thumbnail = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA)
+    low = cv2.dct(np.float32(thumbnail))[:8, :8]
+    return _bits_to_int(low > np.median(low))
+
+
+def dhash(gray: np.ndarray) -> int:
+    """
+    64 bit gradient hash: whether each pixel of a 9x8 thumbnail is brighter
+    than its right neighbour.
+    """
+    thumbnail = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    return _bits_to_int(thumbnail[:, :-1] > thumbnail[:, 1:])
+
+
+def image_hashes(image_path: str):
+    """
+    Returns the (phash, dhash) pair of an image, or None if it cannot be read.
+    """
+    gray = load_analysis_image(image_path)
+    if gray is None:
+        return None
+    return phash(gray), dhash(gray)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64 bit hashes with the Hamming distance.
+    Each node is [phash, entries, children], entries are (dhash, product_id).
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key: int, dhash_value: int, product_id: int):
+        self.size += 1
+        if self.root is None:
+            self.root = [key, [(dhash_value, product_id)], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append((dhash_value, product_id))
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [(dhash_value, product_id)], {}]
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int):
+        """
+        Returns (distance, dhash, product_id) for all hashes within max_distance.
+        """
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= max_distance:
+                found.extend((distance, d, p) for d, p in node[1])
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(
+                child for edge, child in node[2].items() if low <= edge <= high
+            )
+        return found
+
+
+class VisualIndex:
+    def __init__(self):
+        self.tree = BKTree()
+        self.loaded_until = None
+        self.checked_at = 0.0
+
+    def load_new_hashes(self):
+        """
+        Adds the hashes stored since the last load to the tree.
+        """
+        now = timezone.now()
+        rows = ProductImageHash.objects.all()
+        if self.loaded_until is not None:
+            rows = rows.filter(created_at__gte=self.loaded_until)
+        added = 0
+        for product_id, phash_value, dhash_value in rows.values_list(
+            "product_id", "phash", "dhash"
+        ).iterator(chunk_size=5000):
+            self.tree.add(
+                to_unsigned64(phash_value), to_unsigned64(dhash_value), product_id
+            )
+            added += 1
+        # Rows created while loading are picked up again next time, the
+        # duplicates only repeat an identical candidate
+        self.loaded_until = now
+        self.checked_at = time.monotonic()
+        return added
+
+    def add(self, phash_value: int, dhash_value: int, product_id: int):
+        self.tree.add(phash_value, dhash_value, product_id)
+
+
+def get_visual_index(refresh: float) -> VisualIndex:
+    """
+    Singleton accessor for the visual index of this worker process.
+    """
+    global GLOBAL_VISUAL_INDEX
+
+    with _INDEX_LOCK:
+        if GLOBAL_VISUAL_INDEX is None:
+            start = time.perf_counter()
+            GLOBAL_VISUAL_INDEX = VisualIndex()
+            added = GLOBAL_VISUAL_INDEX.load_new_hashes()
+            print(
+                f"Loaded {added} image hashes into the visual index "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
+        elif time.monotonic() - GLOBAL_VISUAL_INDEX.checked_at >= refresh:
+            GLOBAL_VISUAL_INDEX.load_new_hashes()
+    return GLOBAL_VISUAL_INDEX
+
+
+def find_visual_match(
+    hashes: list, max_distance: int, max_dhash_distance: int, refresh
+):
+    """
+    Looks up the closest previously identified product for a set of images.
+
+    Args:
+        hashes: (phash, dhash) pairs of the images.
+        max_distance: Maximum pHash Hamming distance of a match.
+        max_dhash_distance: Maximum dHash Hamming distance confirming a match.
+        refresh: Seconds between loads of newly stored hashes.
+
+    Returns:
+        A (product_id, distance) tuple, product_id is None without a match.
+    """
+    index = get_visual_index(refresh)
+    best = (None, max_distance + 1)
+    for phash_value, dhash_value in hashes:
+        for distance, stored_dhash, product_id in index.tree.search(
+            phash_value, max_distance
+        ):
+            if hamming(dhash_value, stored_dhash) > max_dhash_distance:
+                continue
+            if distance < best[1]:
+                best = (product_id, distance)
+    return best if best[0] is not None else (None, None)
+
+
+def remember_product_hashes(product, hashes: list):
+    """
+    Stores the hashes of an identified product and adds them to this
+    process' index straight away.
+    """
+    if not hashes:
+        return
+    ProductImageHash.objects.bulk_create(
+        [
+            ProductImageHash(
+                product=product, phash=to_signed64(p), dhash=to_signed64(d)
+            )
+            for p, d in hashes
+        ]
+    )
+    if GLOBAL_VISUAL_INDEX is not None:
+        with _INDEX_LOCK:
+            for p, d in hashes:
+                GLOBAL_VISUAL_INDEX.add(p, d, product.id)
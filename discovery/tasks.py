@@ -1,24 +1,91 @@
 import os
 import io
+import tempfile
+import threading
+import time
+import uuid
+from datetime import timedelta
 from PIL import Image, ImageOps
-from celery import shared_task
+from celery import chain, current_app, group, shared_task
+from celery.signals import task_postrun, task_prerun, worker_process_init
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django_celery_results.models import GroupResult, TaskResult
 
 from discovery.serializers import ProductSerializer
-from discovery.services.ocr import process_image_with_ocr
-from discovery.services.reconstruction import reconstruct_llm_input
-from discovery.services.gen_ai import infer_product_details
-from discovery.models import Product, ProductMetadata
+from discovery.services.ocr import (
+    process_image_with_ocr,
+    serialize_ocr_output,
+    deserialize_ocr_output,
+)
+from discovery.services.barcode import (
+    barcode_lookup_values,
+    decode_barcodes,
+    is_retail_barcode,
+)
+from discovery.services.catalog_match import match_catalog_product
+from discovery.services.chunked_upload import expire_uploads
+from discovery.services.fda_import import FdaRunInProgress, refresh_fda_api
+from discovery.services.image_store import (
+    collect_image_garbage,
+    image_digest,
+    sharded_path,
+)
+from discovery.services.job_events import publish_job_update, store_job_status
+from discovery.services.memory import (
+    current_rss_bytes,
+    max_rss_bytes,
+    peak_rss_bytes,
+    reset_peak_rss,
+)
+from discovery.services.metrics import annotate, increment, observe, span
+from discovery.services.quality import check_images
+from discovery.services.visual_match import (
+    find_visual_match,
+    get_visual_index,
+    image_hashes,
+    remember_product_hashes,
+)
+from discovery.services.reconstruction import (
+    create_text_block_json,
+    reconstruct_llm_input,
+    encode_compact_llm_input,
+)
+from discovery.services.gen_ai import (
+    infer_product_details,
+    infer_product_details_batched,
+)
+from discovery.models import (
+    Product,
+    ProductMetadata,
+    ProductIdentificationBatch,
+    ProductIdentificationJob,
+)
 
 
 def resize_image(file_path):
     """
     Resizes an image so that its longest side is at most 4000px,
-    maintaining aspect ratio. Converts to JPEG and saves to /tmp.
+    maintaining aspect ratio. Converts to JPEG and saves it to
+    RESIZED_IMAGE_ROOT, under the digest of the original.
     """
     MAX_DIMENSION = 4000
 
+    out_path = sharded_path(
+        settings.RESIZED_IMAGE_ROOT, image_digest(file_path), ".jpg"
+    )
+    if os.path.exists(out_path):
+        # The same image was resized before
+        os.utime(out_path)
+        print("Reusing resized image", out_path)
+        return out_path
+
     try:
         with Image.open(file_path) as img:
+            # 0. Let JPEGs decode at a reduced scale, never below MAX_DIMENSION
+            img.draft(None, (MAX_DIMENSION, MAX_DIMENSION))
+
             # 1. Fix Orientation (Crucial for OCR on phone photos)
             img = ImageOps.exif_transpose(img)
 
@@ -41,16 +108,14 @@ def resize_image(file_path):
             img.save(output, format="JPEG", quality=85, subsampling=0)
             output.seek(0)
 
-            # 5. Write to absolute /tmp folder
-            filename = os.path.basename(file_path)
-            # Ensure the filename ends in .jpg or .jpeg
-            name, ext = os.path.splitext(filename)
-            new_filename = f"{name}.jpg"
-
-            out_path = os.path.join("/tmp", new_filename)
-
-            with open(out_path, "wb") as f:
+            # 5. Write to the shared resized image folder, renamed into place
+            # so that a concurrent job never reads a partial file
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                dir=os.path.dirname(out_path), delete=False
+            ) as f:
                 f.write(output.read())
+            os.replace(f.name, out_path)
         print("Resized image to", out_path)
         return out_path
 
@@ -59,67 +124,677 @@ def resize_image(file_path):
         raise
 
 
-@shared_task
-def process_product_images(_image_paths: list, resize=False):
+def save_product_data(product_data: dict) -> Product:
+    """
+    Persists the inferred product and its metadata.
+    """
+    product_data = dict(product_data)
+    metadata = product_data.pop("metadata", {}) or {}
+    product = Product.objects.create(**product_data)
+    ProductMetadata.objects.create(product=product, **metadata)
+    product.refresh_from_db()
+    return product
+
+
+def _run_stage(task, job_id, stage, handler):
     """
-    Celery task to perform the full OCR and AI inference pipeline.
+    Runs a single pipeline stage against the persisted job.
+    Stages that already completed (on resume) or jobs that already finished
+    (e.g. short-circuited by an earlier stage) are skipped. A failing stage
+    is retried on its own, the stages before it are not repeated.
     """
-    image_paths = []
+    job = ProductIdentificationJob.objects.get(id=job_id)
+    if job.is_finished() or job.has_completed(stage):
+        return job_id
+    if job.chain_task_ids and task.request.id not in job.chain_task_ids:
+        print(f"Stage {stage} of job {job.task_id} belongs to a replaced chain")
+        return job_id
+
+    if job.stage != stage:
+        job.stage_attempts = 0
+    job.stage = stage
+    job.stage_attempts += 1
+    job.status = ProductIdentificationJob.STATUS_RUNNING
+    job.save(update_fields=["stage", "stage_attempts", "status", "updated_at"])
+    _publish_job_update(job)
+
+    # Starts that are not retries were redelivered after the worker died,
+    # usually killed for running out of memory on this job's images
+    lost = job.stage_attempts - 1 - task.request.retries
+    if lost > settings.STAGE_MAX_WORKER_LOST:
+        _fail_job(job, f"Stage {stage} was interrupted {lost} times, giving up")
+        job.save()
+        _job_finished(job)
+        return job_id
+
+    try:
+        with span(stage) as timing:
+            handler(job)
+            if _PREFORK_CHILD:
+                annotate(peak_rss_mb=round(peak_rss_bytes() / 2**20, 1))
+    except Exception as e:
+        if task.request.retries < task.max_retries:
+            print(f"Stage {stage} failed for job {job.task_id}, retrying: {e}")
+            raise task.retry(exc=e)
+        job.status = ProductIdentificationJob.STATUS_FAILED
+        job.error = str(e)
+        job.timings = [*(job.timings or []), timing]
+        job.save()
+        _job_finished(job)
+        raise
+
+    print(f"Stage {stage} of job {job.task_id} took {timing['duration_ms']}ms")
+    job.timings = [*(job.timings or []), timing]
+    if job.status == ProductIdentificationJob.STATUS_RUNNING:
+        job.last_completed_stage = stage
+        if stage == ProductIdentificationJob.STAGES[-1]:
+            job.status = ProductIdentificationJob.STATUS_SUCCESS
+    job.save()
+    if job.is_finished():
+        _job_finished(job)
+
+    if job.status == ProductIdentificationJob.STATUS_SUCCESS and stage != "visual":
+        _remember_image_hashes(job)
+    return job_id
+
+
+def _job_finished(job):
+    _publish_job_update(job)
+    observe(
+        "job_duration_seconds",
+        (timezone.now() - job.created_at).total_seconds(),
+        status=job.status,
+    )
+    # The stage a job finished at shows how often the shortcuts hit
+    increment("jobs_total", status=job.status, stage=job.stage)
+
+
+def _publish_job_update(job):
+    # Wakes up the clients long-polling or streaming this job, which read the
+    # stored status
+    store_job_status(job)
+    publish_job_update(
+        job.task_id, {"task_id": job.task_id, "stage": job.stage, "status": job.status}
+    )
+
+
+def _remember_image_hashes(job):
+    # New photos of an identified product make the next upload a visual match
+    if not settings.VISUAL_MATCH_ENABLED or not job.product_id:
+        return
+    try:
+        # Jobs finished by the barcode stage have not hashed their images yet
+        hashes = [tuple(h) for h in job.image_hashes or []] or [
+            h for h in map(image_hashes, job.image_paths) if h is not None
+        ]
+        remember_product_hashes(job.product, hashes)
+    except Exception as e:
+        print(f"Could not store image hashes of job {job.task_id}: {e}")
+
+
+def _fail_job(job, error):
+    print(error)
+    job.status = ProductIdentificationJob.STATUS_FAILED
+    job.error = error
+
+
+def _finish_job(job, product):
+    # Short-circuits the pipeline with an existing product
+    print(f"Job {job.task_id} matched product {product.id} at stage {job.stage}")
+    annotate(hit=True)
+    increment("pipeline_cache_hits_total", stage=job.stage)
+    job.product = product
+    job.status = ProductIdentificationJob.STATUS_SUCCESS
+
+
+def _match_barcode(job):
+    # Known retail products are identified from their barcode alone
+    if not settings.BARCODE_FAST_PATH_ENABLED:
+        return
+    barcodes = []
+    for image_path in job.image_paths:
+        barcodes.extend(b for b in decode_barcodes(image_path) if b not in barcodes)
+    print("BARCODES", barcodes)
+    annotate(barcodes=len(barcodes))
+    job.barcodes = barcodes
+
+    for barcode in barcodes:
+        product = Product.objects.filter(
+            barcode__in=barcode_lookup_values(barcode)
+        ).first()
+        if product is not None:
+            return _finish_job(job, product)
+
+
+def _match_visual(job):
+    # Other photos of a product we already identified skip OCR and the LLM
+    if not settings.VISUAL_MATCH_ENABLED:
+        return
+    hashes = [h for h in map(image_hashes, job.image_paths) if h is not None]
+    job.image_hashes = [list(h) for h in hashes]
+    product_id, distance = find_visual_match(
+        hashes,
+        max_distance=settings.VISUAL_MATCH_MAX_DISTANCE,
+        max_dhash_distance=settings.VISUAL_MATCH_MAX_DHASH_DISTANCE,
+        refresh=settings.VISUAL_INDEX_REFRESH,
+    )
+    if product_id is None:
+        return
+    product = Product.objects.filter(id=product_id).first()
+    if product is not None:
+        print(f"Visual match at distance {distance}")
+        annotate(distance=distance)
+        return _finish_job(job, product)
+
+
+def _prepare_images(job):
     # 0. Scale down images
-    if resize:
-        for image_path in _image_paths:
-            result = resize_image(image_path)
-            if result:
-                image_paths.append(result)
+    if job.resize:
+        job.prepared_image_paths = [
+            path for path in map(resize_image, job.image_paths) if path
+        ]
     else:
-        image_paths = _image_paths
+        job.prepared_image_paths = job.image_paths
+    annotate(image_sizes=[_image_size(path) for path in job.prepared_image_paths])
+
+
+def _image_size(path):
+    # Only reads the image header
+    try:
+        with Image.open(path) as img:
+            return list(img.size)
+    except Exception:
+        return None
+
+
+def _check_quality(job):
+    # 0.5 Reject unusable images before spending OCR and LLM time on them
+    if not settings.QUALITY_GATE_ENABLED:
+        return
+    accepted, reports = check_images(
+        job.prepared_image_paths, settings.QUALITY_GATE_THRESHOLDS
+    )
+    print("QUALITY REPORT", reports)
+    annotate(accepted=len(accepted), rejected=len(reports) - len(accepted))
+    job.quality_report = reports
+    if not accepted:
+        reasons = sorted({reason for r in reports for reason in r["reasons"]})
+        return _fail_job(job, f"Image rejected: {', '.join(reasons)}")
+    job.prepared_image_paths = accepted
+
+
+def _ocr_images(job):
     # 1. OCR from images
-    raw_ocr_output = process_image_with_ocr(images=image_paths)
+    raw_ocr_output = process_image_with_ocr(
+        images=job.prepared_image_paths, adaptive=settings.OCR_ADAPTIVE_RESOLUTION
+    )
     print("RAW OCR OUTPUT", raw_ocr_output)
     if not raw_ocr_output:
-        print("RAW OCR ERROR")
-        return None
+        return _fail_job(job, "RAW OCR ERROR")
+    annotate(
+        images=len(raw_ocr_output),
+        boxes=sum(len(result[0]["rec_texts"]) for result in raw_ocr_output),
+    )
+    job.ocr_output = serialize_ocr_output(raw_ocr_output)
+
 
+def _reconstruct_layout(job):
     # 2. Reconstruct text layout
-    reconstructed_text = reconstruct_llm_input(raw_ocr_output)
+    raw_ocr_output = deserialize_ocr_output(job.ocr_output)
+    # The infer stage reads the encoding from the job, the setting may change
+    # in between, e.g. when a job is resumed after a deploy
+    encoding = settings.LLM_INPUT_ENCODING
+    if encoding == "compact":
+        reconstructed_text, token_count, kept = encode_compact_llm_input(
+            raw_ocr_output,
+            token_budget=settings.LLM_INPUT_TOKEN_BUDGET,
+            min_confidence=settings.LLM_INPUT_MIN_CONFIDENCE,
+        )
+        print("LLM INPUT TOKENS", token_count)
+        annotate(llm_input_tokens=token_count, llm_input_blocks=kept)
+        if not kept:
+            # Only the page headers are left, there is nothing to extract from
+            return _fail_job(job, "No text block of the images fits the LLM input")
+    else:
+        reconstructed_text = reconstruct_llm_input(raw_ocr_output)
     print("RECONSTRUCTED TEXT", reconstructed_text)
     if not reconstructed_text:
-        print("RECONSTRUCTED TEXT ERROR")
-        return None
+        return _fail_job(job, "RECONSTRUCTED TEXT ERROR")
+    annotate(llm_input_chars=len(reconstructed_text))
+    job.llm_input = reconstructed_text
+    job.llm_input_encoding = encoding
+
+
+def _match_catalog(job):
+    # 2.5 Skip the LLM when the package names a product we already have
+    if not settings.CATALOG_MATCH_ENABLED:
+        return
+    raw_ocr_output = deserialize_ocr_output(job.ocr_output)
+    product, score = match_catalog_product(
+        [create_text_block_json(result) for result in raw_ocr_output],
+        " ".join(text for result in raw_ocr_output for text in result[0]["rec_texts"]),
+        threshold=settings.CATALOG_MATCH_THRESHOLD,
+        margin=settings.CATALOG_MATCH_MARGIN,
+        ttl=settings.CATALOG_INDEX_TTL,
+    )
+    annotate(score=round(score, 3))
+    if product is not None:
+        return _finish_job(job, product)
+
+
+def _throttled(callback):
+    """
+    Wraps the on_partial callback of a streamed inference so that it only
+    runs for changed fields, at most every LLM_PARTIAL_INTERVAL seconds.
+    """
+    last = {"partial": None, "at": 0.0}
+
+    def on_partial(partial):
+        now = time.monotonic()
+        if (
+            partial == last["partial"]
+            or now - last["at"] < settings.LLM_PARTIAL_INTERVAL
+        ):
+            return
+        last.update(partial=partial, at=now)
+        callback(partial)
+
+    return on_partial
 
+
+def _publish_partial_product(job):
+    def publish(partial):
+        ProductIdentificationJob.objects.filter(id=job.id).update(
+            partial_product_data=partial
+        )
+        job.partial_product_data = partial
+        store_job_status(job)
+        publish_job_update(
+            job.task_id,
+            {
+                "task_id": job.task_id,
+                "stage": job.stage,
+                "status": job.status,
+                "partial": True,
+            },
+        )
+
+    return _throttled(publish)
+
+
+def _infer_details(job):
     # 3. Gen AI inference
-    product_data = infer_product_details(reconstructed_text)
+    if job.partial_product_data is not None:
+        # Fields streamed by a failed attempt are not progress of this one
+        job.partial_product_data = None
+        job.save(update_fields=["partial_product_data", "updated_at"])
+    on_partial = None
+    if settings.LLM_STREAM_PARTIAL:
+        on_partial = _publish_partial_product(job)
+    product_data = infer_product_details(
+        job.llm_input,
+        # Jobs reconstructed before the encoding was stored used the setting
+        encoding=job.llm_input_encoding or settings.LLM_INPUT_ENCODING,
+        on_partial=on_partial,
+    )
     print("PRODUCT DATA", product_data)
     if not product_data:
-        print("Product data is null or empty")
-        return None
+        return _fail_job(job, "Product data is null or empty")
+    job.product_data = product_data
+    job.partial_product_data = None
+
+
+def _save_product(job):
     # 4. Save to database
-    metadata = product_data.pop("metadata", {})
-    product = Product.objects.create(**product_data)
-    ProductMetadata.objects.create(product=product, **metadata)
-    product.refresh_from_db()
+    product_data = dict(job.product_data)
+    retail_barcodes = [b for b in job.barcodes or [] if is_retail_barcode(b)]
+    if not product_data.get("barcode") and retail_barcodes:
+        # Index the decoded barcode so that the next scan takes the fast path,
+        # QR payloads stay on the job only
+        product_data["barcode"] = retail_barcodes[0]
+    job.product = save_product_data(product_data)
+
+
+# Stages on the OCR queue are acknowledged after they ran, so that the message of
+# a worker killed mid-task (e.g. out of memory) goes back to the queue
+OCR_STAGE_OPTIONS = {
+    "ignore_result": True,
+    "max_retries": 3,
+    "default_retry_delay": 5,
+    "acks_late": True,
+    "reject_on_worker_lost": True,
+}
+
+
+@shared_task(bind=True, **OCR_STAGE_OPTIONS)
+def barcode_stage(self, job_id):
+    return _run_stage(self, job_id, "barcode", _match_barcode)
+
+
+@shared_task(bind=True, **OCR_STAGE_OPTIONS)
+def visual_stage(self, job_id):
+    return _run_stage(self, job_id, "visual", _match_visual)
+
+
+@shared_task(bind=True, **OCR_STAGE_OPTIONS)
+def prepare_images_stage(self, job_id):
+    return _run_stage(self, job_id, "prepare", _prepare_images)
+
 
-    return ProductSerializer(product).data
+@shared_task(bind=True, **OCR_STAGE_OPTIONS)
+def quality_stage(self, job_id):
+    return _run_stage(self, job_id, "quality", _check_quality)
 
 
-@shared_task
-def process_structured_text(structured_text: str):
+@shared_task(bind=True, **dict(OCR_STAGE_OPTIONS, max_retries=2))
+def ocr_stage(self, job_id):
+    return _run_stage(self, job_id, "ocr", _ocr_images)
+
+
+@shared_task(bind=True, **OCR_STAGE_OPTIONS)
+def reconstruct_stage(self, job_id):
+    return _run_stage(self, job_id, "reconstruct", _reconstruct_layout)
+
+
+@shared_task(bind=True, **OCR_STAGE_OPTIONS)
+def match_stage(self, job_id):
+    return _run_stage(self, job_id, "match", _match_catalog)
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=3, default_retry_delay=10)
+def infer_stage(self, job_id):
+    return _run_stage(self, job_id, "infer", _infer_details)
+
+
+@shared_task(bind=True, ignore_result=True, max_retries=3, default_retry_delay=5)
+def save_stage(self, job_id):
+    return _run_stage(self, job_id, "save", _save_product)
+
+
+STAGE_TASKS = {
+    "barcode": barcode_stage,
+    "visual": visual_stage,
+    "prepare": prepare_images_stage,
+    "quality": quality_stage,
+    "ocr": ocr_stage,
+    "reconstruct": reconstruct_stage,
+    "match": match_stage,
+    "infer": infer_stage,
+    "save": save_stage,
+}
+
+
+# Set in prefork children, which run one task at a time. The peak memory of a
+# process is only the peak of its task there, on the threads pool concurrent
+# tasks share the process and reset each other's peak.
+_PREFORK_CHILD = False
+
+
+@worker_process_init.connect
+def mark_prefork_child(**kwargs):
+    global _PREFORK_CHILD
+
+    _PREFORK_CHILD = True
+
+
+@worker_process_init.connect
+def load_visual_index(**kwargs):
+    # Every worker process loads the visual index in the background, Celery
+    # kills children whose init takes longer than worker_proc_alive_timeout.
+    # A job that needs the index first waits for the load to finish.
+    if settings.VISUAL_MATCH_ENABLED:
+        threading.Thread(
+            target=_load_visual_index, name="visual-index", daemon=True
+        ).start()
+
+
+def _load_visual_index():
+    try:
+        get_visual_index(settings.VISUAL_INDEX_REFRESH)
+    except Exception as e:
+        print(f"Could not load the visual index: {e}")
+    finally:
+        # The connection of this thread is not used again
+        connection.close()
+
+
+@task_prerun.connect
+def reset_task_memory(**kwargs):
+    if _PREFORK_CHILD:
+        reset_peak_rss()
+
+
+@task_postrun.connect
+def report_task_memory(task=None, **kwargs):
+    # Celery recycles the child after this task once it is over the limit
+    if not _PREFORK_CHILD:
+        return
+    peak = peak_rss_bytes()
+    current = current_rss_bytes()
+    print(
+        f"Task {task.name} peak memory {peak / 2**20:.0f}MB, "
+        f"now {current / 2**20:.0f}MB"
+    )
+    observe("task_peak_memory_bytes", peak, task=task.name.rsplit(".", 1)[-1])
+    limit = (settings.CELERY_WORKER_MAX_MEMORY_PER_CHILD or 0) * 1024
+    if limit and max_rss_bytes() > limit:
+        print(f"Worker process over {limit / 2**20:.0f}MB, it will be recycled")
+        increment("worker_recycles_total")
+
+
+def identification_chain(job: ProductIdentificationJob):
+    """
+    Returns the Celery chain of the stages the job has not completed yet.
+    Its task ids are set on job.chain_task_ids, which must be saved before
+    the chain is dispatched.
+    """
+    stages = job.remaining_stages()
+    if not stages:
+        return None
+    job.chain_task_ids = [str(uuid.uuid4()) for _ in stages]
+    return chain(
+        *(
+            STAGE_TASKS[stage].si(job.id).set(task_id=task_id)
+            for stage, task_id in zip(stages, job.chain_task_ids)
+        )
+    )
+
+
+def run_identification_job(job: ProductIdentificationJob):
+    """
+    Dispatches the stages the job has not completed yet as a Celery chain.
+    """
+    signature = identification_chain(job)
+    if signature is None:
+        return None
+    ProductIdentificationJob.objects.filter(id=job.id).update(
+        chain_task_ids=job.chain_task_ids
+    )
+    # Clients poll the job from now on
+    store_job_status(job)
+    return signature.apply_async()
+
+
+def resume_identification_job(job: ProductIdentificationJob) -> bool:
+    """
+    Restarts a failed or stalled job from its last completed stage. A pending
+    or running job is stalled when it was last updated, e.g. by the start of
+    its current stage, more than JOB_STALL_TIMEOUT seconds ago, otherwise its
+    chain may still be running. A stalled job may also still be waiting in
+    the queue, so the stages of its previous chain are revoked, and skip
+    themselves if they run anyway.
+
+    Returns:
+        Whether the job was resumed.
+    """
+    stalled_before = timezone.now() - timedelta(seconds=settings.JOB_STALL_TIMEOUT)
+    with transaction.atomic():
+        # Concurrent resumes wait here, the later ones see the job running
+        job = ProductIdentificationJob.objects.select_for_update().get(id=job.id)
+        stalled = not job.is_finished() and job.updated_at < stalled_before
+        if job.status != ProductIdentificationJob.STATUS_FAILED and not stalled:
+            return False
+
+        job.status = ProductIdentificationJob.STATUS_RUNNING
+        job.error = None
+        job.stage_attempts = 0
+        job.save(update_fields=["status", "error", "stage_attempts", "updated_at"])
+        replaced = job.chain_task_ids
+    run_identification_job(job)
+
+    if replaced:
+        try:
+            current_app.control.revoke(replaced)
+        except Exception as e:
+            # Workers still skip them, they are no longer the job's chain
+            print(f"Could not revoke the stages of job {job.task_id}: {e}")
+    return True
+
+
+def process_product_images(image_paths: list, resize=False) -> ProductIdentificationJob:
+    """
+    Starts the full OCR and AI inference pipeline for the uploaded images.
+    The returned job's task_id is what clients poll for the result.
+    """
+    job = ProductIdentificationJob.objects.create(
+        task_id=str(uuid.uuid4()), image_paths=image_paths, resize=resize
+    )
+    run_identification_job(job)
+    return job
+
+
+def process_product_image_batch(items: list, resize=False):
+    """
+    Starts the pipeline for many products at once.
+
+    Args:
+        items: (reference, image_paths) pairs, one per product.
+
+    Returns:
+        The batch, its jobs are polled together by batch_id.
+    """
+    with transaction.atomic():
+        batch = ProductIdentificationBatch.objects.create(
+            batch_id=str(uuid.uuid4()), item_count=len(items)
+        )
+        jobs = ProductIdentificationJob.objects.bulk_create(
+            [
+                ProductIdentificationJob(
+                    task_id=str(uuid.uuid4()),
+                    image_paths=image_paths,
+                    resize=resize,
+                    batch=batch,
+                    batch_index=index,
+                    batch_reference=reference,
+                )
+                for index, (reference, image_paths) in enumerate(items)
+            ]
+        )
+
+    # The chains are published together, so the OCR workers find the stages of
+    # all items on their queue at once instead of one request at a time. Items
+    # finish independently, a failing item does not hold back the others.
+    chains = [identification_chain(job) for job in jobs]
+    ProductIdentificationJob.objects.bulk_update(jobs, ["chain_task_ids"])
+    group(chains).apply_async()
+    return batch
+
+
+def delete_expired_task_results(expires: float, chunk_size=5000) -> int:
+    """
+    Deletes the task and group results of the django-db result backend that
+    are older than expires seconds. Rows are deleted in chunks, each in its own
+    transaction, so that a large backlog does not hold long locks.
+    """
+    cutoff = timezone.now() - timedelta(seconds=expires)
+    deleted = 0
+    for model in (TaskResult, GroupResult):
+        while True:
+            ids = list(
+                model.objects.filter(date_done__lt=cutoff).values_list("id", flat=True)[
+                    :chunk_size
+                ]
+            )
+            if not ids:
+                break
+            deleted += model.objects.filter(id__in=ids).delete()[0]
+    return deleted
+
+
+@shared_task(ignore_result=True)
+def purge_task_results():
+    """
+    Periodic cleanup of the django-db result backend.
+    """
+    deleted = delete_expired_task_results(settings.CELERY_RESULT_EXPIRES)
+    print(f"Purged {deleted} task results")
+
+
+@shared_task(ignore_result=True)
+def collect_stored_images():
+    """
+    Periodic deletion of uploaded and resized images that no pending job or
+    identified product references, and of abandoned resumable uploads.
+    """
+    expired = expire_uploads(settings.IMAGE_GC_MIN_AGE)
+    if expired:
+        print(f"Expired {expired} unfinished uploads")
+    deleted, freed = collect_image_garbage(settings.IMAGE_GC_MIN_AGE)
+    print(f"Deleted {deleted} unreferenced images, {freed / 2**20:.1f}MB")
+
+
+@shared_task(ignore_result=True)
+def refresh_fda_catalog():
+    """
+    Periodic incremental refresh of the FDA catalog from the search API,
+    continuing the previous refresh if it was interrupted.
+    """
+    try:
+        counts = refresh_fda_api(
+            settings.FDA_SEARCH_URL, resume=True, page_size=settings.FDA_PAGE_SIZE
+        )
+    except FdaRunInProgress as e:
+        # The previous tick is still refreshing
+        print(f"Skipped the FDA catalog refresh: {e}")
+        return
+    print(f"Refreshed the FDA catalog: {counts}")
+
+
+@shared_task(bind=True)
+def process_structured_text(self, structured_text: str):
     """
     Celery task for when OCR data is already provided.
+
+    Returns:
+        The saved product as "result", None when nothing was extracted, and
+        the spans of the stages that ran as "timings".
     """
+    timings = []
     # 1. Gen AI inference
-    product_data = infer_product_details(structured_text)
+    with span("infer") as timing:
+        timings.append(timing)
+        if settings.LLM_BATCH_ENABLED:
+            product_data = infer_product_details_batched(structured_text)
+        elif settings.LLM_STREAM_PARTIAL:
+            product_data = infer_product_details(
+                structured_text,
+                on_partial=_throttled(
+                    lambda partial: self.update_state(
+                        state="PROGRESS", meta={"partial": partial}
+                    )
+                ),
+            )
+        else:
+            product_data = infer_product_details(structured_text)
     if not product_data:
         print("Product data is null or empty text")
-        return None
+        return {"result": None, "timings": timings}
     # 2. Save to database
-    metadata = product_data.pop("metadata", {})
-    product = Product.objects.create(**product_data)
-    ProductMetadata.objects.create(product=product, **metadata)
-
-    product.refresh_from_db()
+    with span("save") as timing:
+        timings.append(timing)
+        product = save_product_data(product_data)
 
-    return ProductSerializer(product).data
+    return {"result": ProductSerializer(product).data, "timings": timings}
 
 
 """curl 'https://verifypermit.fdaghana.gov.gh/publicsearch?draw=1&columns%5B0%5D%5Bdata%5D=DT_RowIndex&columns%5B0%5D%5Bsearchable%5D=false&columns%5B1%5D%5Bdata%5D=client_name&columns%5B1%5D%5Bname%5D=tbl_client_details.client_name&columns%5B2%5D%5Bdata%5D=product_name&columns%5B3%5D%5Bdata%5D=product_category&columns%5B4%5D%5Bdata%5D=expiry_date&columns%5B5%5D%5Bdata%5D=status&columns%5B5%5D%5Bname%5D=tbl_products_details.status&columns%5B6%5D%5Bdata%5D=action&columns%5B6%5D%5Bsearchable%5D=false&columns%5B6%5D%5Borderable%5D=false&order%5B0%5D%5Bcolumn%5D=1&order%5B0%5D%5Bdir%5D=desc&start=0&length=25&search%5Bvalue%5D=&_=1763133604095' \
@@ -1,3 +1,418 @@
-from django.test import TestCase
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import openai
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from discovery.llm_response_models import ProductInfoBatch
+from discovery.management.commands.run_fda_stub import StubSearchHandler
+from discovery.models import FdaImportRun, FdaRegistration, Product
+from discovery.services import fda_import, gen_ai, llm_client
+from discovery.services.micro_batch import MicroBatcher
+
+
+class StubCompletions:
+    """
+    Stands in for client.chat.completions, the n-th request runs the n-th
+    behaviour: a value to return, an exception to raise, a function to call, or
+    an Event to wait for (up to the request timeout) before returning.
+    """
+
+    def __init__(self, *behaviours):
+        self.behaviours = list(behaviours)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def create(self, timeout=None, **kwargs):
+        with self.lock:
+            self.calls.append(timeout)
+            behaviour = self.behaviours[len(self.calls) - 1]
+
+        if isinstance(behaviour, threading.Event):
+            if not behaviour.wait(timeout):
+                raise openai.APITimeoutError(
+                    request=httpx.Request("POST", "http://llm.test")
+                )
+            return "released"
+        if isinstance(behaviour, BaseException):
+            raise behaviour
+        if callable(behaviour):
+            return behaviour()
+        return behaviour
+
+
+@override_settings(
+    LLM_API_KEY="test",
+    LLM_BASE_URL="http://llm.test/v1",
+    LLM_TIMEOUT=5,
+    LLM_HEDGE_AFTER=0,
+    LLM_MAX_CONCURRENT_REQUESTS=2,
+    LLM_MAX_HEDGED_REQUESTS=1,
+)
+class CreateCompletionTests(SimpleTestCase):
+    def setUp(self):
+        # Builds the slots and the hedging pool from the settings above
+        llm_client.GLOBAL_LLM_CLIENT = None
+        llm_client.get_llm_client()
+        self.addCleanup(setattr, llm_client, "GLOBAL_LLM_CLIENT", None)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def complete(self, completions, **kwargs):
+        client = mock.Mock()
+        client.chat.completions = completions
+        with mock.patch.object(llm_client, "GLOBAL_LLM_CLIENT", client):
+            return llm_client.create_completion([], response_model=None, **kwargs)
+
+    def assertSlotsFree(self):
+        # Every slot was released, even by requests that lost or failed
+        deadline = time.monotonic() + 1
+        for slots, count in (
+            (llm_client._REQUEST_SLOTS, 2),
+            (llm_client._HEDGE_SLOTS, 1),
+        ):
+            acquired = 0
+            while acquired < count and time.monotonic() < deadline:
+                if slots.acquire(timeout=0.05):
+                    acquired += 1
+            for _ in range(acquired):
+                slots.release()
+            self.assertEqual(acquired, count)
+
+    def test_fast_request_is_not_hedged(self):
+        completions = StubCompletions("first")
+        self.assertEqual(self.complete(completions, hedge_after=1), "first")
+        self.assertEqual(completions.calls, [5])
+        self.assertSlotsFree()
+
+    def test_slow_request_is_hedged(self):
+        completions = StubCompletions(self.release, "hedged")
+        self.assertEqual(self.complete(completions, hedge_after=0.05), "hedged")
+        self.assertEqual(len(completions.calls), 2)
+
+        # The slower request keeps its slot until it returns
+        self.release.set()
+        self.assertSlotsFree()
+
+    def test_no_hedge_when_the_budget_is_used_up(self):
+        llm_client._HEDGE_SLOTS.acquire()
+        self.addCleanup(llm_client._HEDGE_SLOTS.release)
+        threading.Timer(0.2, self.release.set).start()
+
+        completions = StubCompletions(self.release, "hedged")
+        self.assertEqual(self.complete(completions, hedge_after=0.05), "released")
+        self.assertEqual(len(completions.calls), 1)
+
+    def test_error_is_raised(self):
+        completions = StubCompletions(ValueError("invalid output"))
+        with self.assertRaisesMessage(ValueError, "invalid output"):
+            self.complete(completions)
+        self.assertSlotsFree()
+
+    def test_error_of_the_hedged_request_waits_for_the_first(self):
+        threading.Timer(0.2, self.release.set).start()
+        completions = StubCompletions(self.release, ValueError("hedge failed"))
+        self.assertEqual(self.complete(completions, hedge_after=0.05), "released")
+        self.assertSlotsFree()
+
+    def test_error_is_raised_when_both_requests_fail(self):
+        def slow_failure():
+            time.sleep(0.2)
+            raise ValueError("first failed")
+
+        completions = StubCompletions(slow_failure, ValueError("hedge failed"))
+        with self.assertRaises(ValueError):
+            self.complete(completions, hedge_after=0.05)
+        self.assertEqual(len(completions.calls), 2)
+        self.assertSlotsFree()
+
+    def test_timeout(self):
+        completions = StubCompletions(self.release)
+        started = time.monotonic()
+        with self.assertRaises(openai.APITimeoutError):
+            self.complete(completions, timeout=0.1)
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertEqual(completions.calls, [0.1])
+        self.assertSlotsFree()
+
+
+def fda_record(index):
+    return {
+        "product_id": index,
+        "product_name": f"Product {index} (500ml)",
+        "product_category": "Beverages",
+        "registration_number": f"FDA/{index}",
+        "status": "Active",
+    }
+
+
+class FdaStubMixin:
+    """
+    Serves records with run_fda_stub's handler on a free port.
+    """
+
+    def start_stub(self, records, fail_after=0, failures=0):
+        handler = type(
+            "StubHandler",
+            (FlakyStubHandler,),
+            {
+                "records": records,
+                "fail_after": fail_after,
+                "failures": failures,
+                "served": 0,
+                "requests": [],
+                "log_message": lambda *args: None,
+            },
+        )
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        # No backoff between retries
+        patcher = mock.patch.object(fda_import.time, "sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.url = f"http://127.0.0.1:{server.server_address[1]}/publicsearch"
+        return handler
+
+
+class FlakyStubHandler(StubSearchHandler):
+    # Answers the first failures requests with a 502
+    failures = 0
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(self.path)
+        if type(self).failures:
+            type(self).failures -= 1
+            self.send_error(502)
+            return
+        super().do_GET()
+
+
+class FetchFdaRecordsTests(FdaStubMixin, SimpleTestCase):
+    def test_pages(self):
+        records = [fda_record(index) for index in range(1, 6)]
+        stub = self.start_stub(records)
+
+        fetched = list(fda_import.fetch_fda_records(self.url, page_size=2))
+        self.assertEqual([item["product_id"] for item in fetched], [1, 2, 3, 4, 5])
+        self.assertEqual([item["DT_RowIndex"] for item in fetched], [1, 2, 3, 4, 5])
+        self.assertEqual(len(stub.requests), 3)
+
+    def test_start(self):
+        self.start_stub([fda_record(index) for index in range(1, 6)])
+        fetched = fda_import.fetch_fda_records(self.url, start=3, page_size=2)
+        self.assertEqual([item["product_id"] for item in fetched], [4, 5])
+
+    def test_empty(self):
+        self.start_stub([])
+        self.assertEqual(list(fda_import.fetch_fda_records(self.url)), [])
+
+    def test_failed_page_is_retried(self):
+        stub = self.start_stub([fda_record(1), fda_record(2)], failures=2)
+        fetched = list(fda_import.fetch_fda_records(self.url, retries=3))
+        self.assertEqual([item["product_id"] for item in fetched], [1, 2])
+        self.assertEqual(len(stub.requests), 3)
+        self.assertEqual([c.args for c in self.sleep.call_args_list], [(1,), (2,)])
+
+    def test_error_after_the_last_retry(self):
+        records = [fda_record(index) for index in range(1, 6)]
+        stub = self.start_stub(records, fail_after=1)
+
+        fetched = []
+        with self.assertRaises(httpx.HTTPStatusError):
+            for item in fda_import.fetch_fda_records(self.url, page_size=2, retries=2):
+                fetched.append(item)
+        # The first page was yielded before the second one failed 3 times
+        self.assertEqual([item["product_id"] for item in fetched], [1, 2])
+        self.assertEqual(len(stub.requests), 4)
+
+
+class RefreshFdaApiTests(FdaStubMixin, TestCase):
+    def test_resume_from_checkpoint(self):
+        records = [fda_record(index) for index in range(1, 6)]
+        stub = self.start_stub(records, fail_after=2)
+
+        with self.assertRaises(httpx.HTTPStatusError):
+            fda_import.refresh_fda_api(self.url, page_size=2, chunk_size=2)
+        run = FdaImportRun.objects.get()
+        self.assertEqual(run.status, FdaImportRun.STATUS_FAILED)
+        self.assertEqual(run.checkpoint, 4)
+        self.assertEqual(Product.objects.count(), 4)
+
+        stub.fail_after = 0
+        stub.requests.clear()
+        counts = fda_import.refresh_fda_api(self.url, page_size=2, chunk_size=2)
+
+        run.refresh_from_db()
+        self.assertEqual(FdaImportRun.objects.get().pk, run.pk)
+        self.assertEqual(run.status, FdaImportRun.STATUS_COMPLETED)
+        self.assertEqual(run.checkpoint, 5)
+        self.assertEqual(counts["read"], 5)
+        self.assertEqual(counts["created"], 5)
+        self.assertEqual(Product.objects.count(), 5)
+        # Only the page after the checkpoint was fetched again
+        self.assertEqual(len(stub.requests), 1)
+        self.assertIn("start=4", stub.requests[0])
+
+    def test_running_run_is_not_started_again(self):
+        FdaImportRun.objects.create(source="http://fda.test/publicsearch")
+        with self.assertRaises(fda_import.FdaRunInProgress):
+            fda_import.start_fda_run("http://fda.test/publicsearch", resume=True)
+
+    def test_removed_only_among_the_same_source(self):
+        records = [fda_record(index) for index in range(1, 4)]
+        self.start_stub(records)
+        fda_import.refresh_fda_api(self.url, resume=False)
+
+        other = FdaImportRun.objects.create(
+            source="export.json", status=FdaImportRun.STATUS_COMPLETED
+        )
+        fda_import.refresh_fda_chunk([fda_record(10)], other)
+
+        del records[0]
+        counts = fda_import.refresh_fda_api(self.url, resume=False)
+        self.assertEqual(counts["removed"], 1)
+        self.assertEqual(
+            set(
+                FdaRegistration.objects.filter(removed_at__isnull=False).values_list(
+                    "fda_product_id", flat=True
+                )
+            ),
+            {"1"},
+        )
+
+
+def submit_all(submit_item, items):
+    """
+    Calls submit_item with every item from its own thread, returns the results
+    or the exceptions in the order of the items.
+    """
+    results = [None] * len(items)
+
+    def submit(index):
+        try:
+            results[index] = submit_item(items[index])
+        except BaseException as e:
+            results[index] = e
+
+    threads = [
+        threading.Thread(target=submit, args=(index,)) for index in range(len(items))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+        if thread.is_alive():
+            raise AssertionError("A submitted item never got its result")
+    return results
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.batches = []
+
+    def double(self, items):
+        self.batches.append(list(items))
+        return [item * 2 for item in items]
+
+    def test_items_of_the_window_share_a_batch(self):
+        batcher = MicroBatcher(self.double, window=0.3, max_items=10)
+        self.assertEqual(submit_all(batcher.submit, [1, 2, 3]), [2, 4, 6])
+        self.assertEqual(len(self.batches), 1)
+        self.assertEqual(sorted(self.batches[0]), [1, 2, 3])
+
+    def test_window_flushes_a_batch_that_is_not_full(self):
+        batcher = MicroBatcher(self.double, window=0.1, max_items=10)
+        started = time.monotonic()
+        self.assertEqual(batcher.submit(1), 2)
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+
+        # The next item opens a new batch
+        self.assertEqual(batcher.submit(2), 4)
+        self.assertEqual(self.batches, [[1], [2]])
+
+    def test_full_batch_is_sent_before_the_window(self):
+        batcher = MicroBatcher(self.double, window=10, max_items=2)
+        started = time.monotonic()
+        self.assertEqual(submit_all(batcher.submit, [1, 2]), [2, 4])
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_error_is_raised_in_every_thread(self):
+        def fail(items):
+            time.sleep(0.1)
+            raise ValueError("batch failed")
+
+        batcher = MicroBatcher(fail, window=0.2, max_items=3)
+        results = submit_all(batcher.submit, [1, 2, 3])
+        self.assertEqual([type(result) for result in results], [ValueError] * 3)
+
+    def test_base_exception_resolves_every_future(self):
+        def stop(items):
+            raise SystemExit
+
+        batcher = MicroBatcher(stop, window=0.2, max_items=3)
+        results = submit_all(batcher.submit, [1, 2, 3])
+        self.assertEqual([type(result) for result in results], [SystemExit] * 3)
+
+    def test_missing_results(self):
+        batcher = MicroBatcher(lambda items: [0], window=0.2, max_items=2)
+        results = sorted(submit_all(batcher.submit, [1, 2]), key=str)
+        self.assertEqual(results[0], 0)
+        self.assertIsInstance(results[1], RuntimeError)
+
+
+@override_settings(LLM_BATCH_WINDOW=0.3, LLM_BATCH_MAX_ITEMS=3)
+class BatchedInferenceTests(SimpleTestCase):
+    def setUp(self):
+        gen_ai.GLOBAL_MICRO_BATCHER = None
+        self.addCleanup(setattr, gen_ai, "GLOBAL_MICRO_BATCHER", None)
+        for name in ("_record_usage", "annotate", "increment"):
+            patcher = mock.patch.object(gen_ai, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def product(self, index):
+        return {
+            "index": index,
+            "name": f"Product {index}",
+            "description": "",
+            "category": "Beverages",
+            "metadata": {},
+        }
+
+    def test_products_are_split_back_onto_the_items(self):
+        # Out of order, with a repeated index and one out of range
+        batch = ProductInfoBatch.model_validate(
+            {"items": [self.product(index) for index in (2, 0, 0, 7)]}
+        )
+        response = mock.Mock(items=batch.items)
+        with mock.patch.object(gen_ai, "create_completion", return_value=response):
+            products = gen_ai.infer_product_details_batch(["a", "b", "c"])
+        self.assertEqual(
+            [product and product["name"] for product in products],
+            ["Product 0", None, "Product 2"],
+        )
+        self.assertNotIn("index", products[0])
+
+    def test_items_missing_from_the_batch_are_inferred_alone(self):
+        def extract(texts):
+            return [None if text == "b" else {"name": text} for text in texts]
+
+        with mock.patch.object(
+            gen_ai, "infer_product_details_batch", side_effect=extract
+        ) as batch, mock.patch.object(
+            gen_ai, "infer_product_details", return_value={"name": "alone"}
+        ) as alone:
+            results = submit_all(gen_ai.infer_product_details_batched, ["a", "b", "c"])
+
+        self.assertEqual([result["name"] for result in results], ["a", "alone", "c"])
+        batch.assert_called_once()
+        self.assertEqual(sorted(batch.call_args.args[0]), ["a", "b", "c"])
+        alone.assert_called_once_with("b")
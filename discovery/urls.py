@@ -1,14 +1,25 @@
 from django.urls import path
 from discovery.views import (
     ProcessImagesView,
+    ProcessImageBatchView,
+    ImageUploadView,
+    ImageUploadRangeView,
+    FinalizeImageUploadView,
+    ImageDerivativeView,
     ProcessTextView,
     CheckResultView,
+    CheckBatchResultView,
+    WaitForResultView,
+    ResultEventsView,
+    MetricsView,
+    ResumeJobView,
     RegistrationView,
     LoginView,
     ActivateAccountView,
     ResetPasswordView,
     ForgotPasswordView,
     ProductViewSet,
+    ProductSearchView,
     SyncPushView,
     SyncPullView,
     DownloadDatabaseView,
@@ -34,14 +45,53 @@ urlpatterns = [
     ),
     path("forgot-password/", ForgotPasswordView.as_view(), name="forgot-password"),
     path("products/", product_list, name="product-list"),
+    path("products/search/", ProductSearchView.as_view(), name="product-search"),
     path("products/<int:pk>/", product_detail, name="product-detail"),
     path("process-images/", ProcessImagesView.as_view(), name="process-images"),
+    path(
+        "process-images/batch/",
+        ProcessImageBatchView.as_view(),
+        name="process-images-batch",
+    ),
+    path("uploads/", ImageUploadView.as_view(), name="uploads"),
+    path(
+        "uploads/finalize/",
+        FinalizeImageUploadView.as_view(),
+        name="uploads-finalize",
+    ),
+    path(
+        "uploads/<str:upload_id>",
+        ImageUploadRangeView.as_view(),
+        name="upload-range",
+    ),
+    path("images/<path:name>", ImageDerivativeView.as_view(), name="image-derivative"),
     path("process-text/", ProcessTextView.as_view(), name="process-text"),
+    path(
+        "inference-response/batch/<str:batch_id>",
+        CheckBatchResultView.as_view(),
+        name="inference-batch-response",
+    ),
     path(
         "inference-response/<str:task_id>",
         CheckResultView.as_view(),
         name="inference-response",
     ),
+    path(
+        "inference-response/<str:task_id>/wait",
+        WaitForResultView.as_view(),
+        name="inference-wait",
+    ),
+    path(
+        "inference-response/<str:task_id>/events",
+        ResultEventsView.as_view(),
+        name="inference-events",
+    ),
+    path(
+        "inference-response/<str:task_id>/resume",
+        ResumeJobView.as_view(),
+        name="inference-resume",
+    ),
+    path("metrics", MetricsView.as_view(), name="metrics"),
     # Sync Endpoints
     path("sync/push/", SyncPushView.as_view(), name="sync-push"),
     path("sync/pull/", SyncPullView.as_view(), name="sync-pull"),
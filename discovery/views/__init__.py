@@ -1,3 +1,5 @@
 from discovery.views.auth import *
 from discovery.views.product_identification import *
+from discovery.views.image_upload import *
+from discovery.views.image_derivatives import *
 from discovery.views.tenant_database_sync import *
@@ -0,0 +1,71 @@
+from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from discovery.services.image_derivatives import (
+    FORMATS,
+    DerivativeError,
+    open_derivative,
+    resolve_media_path,
+)
+
+
+class IgnoreAcceptNegotiation(BaseContentNegotiation):
+    """
+    The Accept header selects the image format, errors are always JSON.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class ImageDerivativeView(APIView):
+    content_negotiation_class = IgnoreAcceptNegotiation
+
+    def get(self, request, name, *args, **kwargs):
+        """
+        Returns a variant of an image in MEDIA_ROOT, e.g.
+        /api/images/images/3f/a2/3fa2...c9.jpg?width=320&format=webp. Without a
+        format, WebP is returned to clients that accept it and JPEG otherwise.
+        """
+        source = resolve_media_path(name)
+        if source is None:
+            return Response(
+                {"error": "Image not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        image_format = request.query_params.get("format")
+        negotiated = image_format is None
+        if negotiated:
+            accepts_webp = "image/webp" in request.headers.get("Accept", "")
+            image_format = "webp" if accepts_webp else "jpeg"
+
+        try:
+            width = int(
+                request.query_params.get("width", settings.IMAGE_DERIVATIVE_WIDTHS[0])
+            )
+            variant, key = open_derivative(source, width, image_format)
+        except (ValueError, DerivativeError) as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        etag = f'"{key}"'
+        if etag in request.headers.get("If-None-Match", ""):
+            variant.close()
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(variant, content_type=FORMATS[image_format][2])
+        response["ETag"] = etag
+        # The variants of a URL only change when the source image is replaced
+        response["Cache-Control"] = (
+            f"private, max-age={settings.IMAGE_DERIVATIVE_MAX_AGE}, immutable"
+        )
+        if negotiated:
+            patch_vary_headers(response, ["Accept"])
+        return response
@@ -0,0 +1,124 @@
+from rest_framework import permissions, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from discovery.models import ImageUpload
+from discovery.parsers import OctetStreamParser
+from discovery.services.chunked_upload import (
+    UploadConflict,
+    UploadError,
+    create_upload,
+    finalize_uploads,
+    missing_ranges,
+    parse_content_range,
+    write_range,
+)
+from discovery.tasks import run_identification_job
+
+
+def upload_data(upload):
+    return {
+        "upload_id": upload.upload_id,
+        "status": upload.status,
+        "size": upload.size,
+        "received": upload.received_ranges,
+        "missing": missing_ranges(upload),
+        "task_id": upload.task_id,
+    }
+
+
+def upload_error_response(error):
+    status_code = (
+        status.HTTP_409_CONFLICT
+        if isinstance(error, UploadConflict)
+        else status.HTTP_400_BAD_REQUEST
+    )
+    return Response({"error": str(error)}, status=status_code)
+
+
+class ImageUploadView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Creates a resumable upload of one image from its size in bytes and its
+        hex SHA-256.
+        """
+        try:
+            upload = create_upload(
+                request.data.get("size"),
+                request.data.get("sha256"),
+                request.data.get("filename"),
+            )
+        except UploadError as e:
+            return upload_error_response(e)
+
+        return Response(upload_data(upload), status=status.HTTP_201_CREATED)
+
+
+class ImageUploadRangeView(APIView):
+    permission_classes = [permissions.AllowAny]
+    parser_classes = [OctetStreamParser]
+
+    def get(self, request, upload_id, *args, **kwargs):
+        """
+        Returns the byte ranges received so far, to resume an upload.
+        """
+        try:
+            upload = ImageUpload.objects.get(upload_id=upload_id)
+        except ImageUpload.DoesNotExist:
+            return Response(
+                {"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(upload_data(upload))
+
+    def put(self, request, upload_id, *args, **kwargs):
+        """
+        Writes the raw request body at the byte range of its Content-Range
+        header, e.g. "bytes 0-1048575/5242880".
+        """
+        try:
+            upload = ImageUpload.objects.get(upload_id=upload_id)
+            start, end = parse_content_range(
+                request.headers.get("Content-Range"), upload.size
+            )
+            # The parser returns the request stream unread, an empty body is
+            # parsed as an empty dict
+            if not hasattr(request.data, "read"):
+                raise UploadError("The request has no body.")
+            upload = write_range(upload_id, start, end, request.data)
+        except ImageUpload.DoesNotExist:
+            return Response(
+                {"error": "Upload not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+        except UploadError as e:
+            return upload_error_response(e)
+
+        return Response(upload_data(upload))
+
+
+class FinalizeImageUploadView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Verifies complete uploads, the images of one product, and starts the
+        identification pipeline for them.
+        """
+        upload_ids = request.data.get("uploads")
+        if not isinstance(upload_ids, list):
+            return Response(
+                {"error": "uploads must be a list of upload ids."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            job, start = finalize_uploads([str(upload_id) for upload_id in upload_ids])
+        except ImageUpload.DoesNotExist as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except UploadError as e:
+            return upload_error_response(e)
+
+        if start:
+            run_identification_job(job)
+        return Response({"task_id": job.task_id}, status=status.HTTP_202_ACCEPTED)
@@ -1,11 +1,19 @@
-import os
-import os
-import uuid
+import asyncio
+import base64
+import io
+import json
 from pathlib import Path
 
+from asgiref.sync import sync_to_async
 from celery.result import AsyncResult
 from django.conf import settings
-from rest_framework import permissions, viewsets, status
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
+from PIL import Image
+from rest_framework import generics, permissions, viewsets, status
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.status import (
     HTTP_400_BAD_REQUEST,
@@ -13,12 +21,30 @@ from rest_framework.status import (
 )
 from rest_framework.views import APIView
 
-from discovery.models import Product
+from discovery.models import (
+    Product,
+    ProductIdentificationBatch,
+    ProductIdentificationJob,
+)
+from discovery.parsers import NDJSONStreamParser
 from discovery.permissions import IsOwnerOrStaff
 from discovery.serializers import (
     ProductSerializer,
 )
-from discovery.tasks import process_product_images, process_structured_text
+from discovery.services.image_store import store_image_bytes, store_image_chunks
+from discovery.services.job_events import (
+    JobSubscription,
+    job_status_data,
+    load_job_status,
+)
+from discovery.services.metrics import export_metrics
+from discovery.services.product_search import search_products
+from discovery.tasks import (
+    process_product_image_batch,
+    process_product_images,
+    process_structured_text,
+    resume_identification_job,
+)
 from service.celery import app
 
 
@@ -36,6 +62,54 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
+class ProductSearchPagination(LimitOffsetPagination):
+    default_limit = settings.PRODUCT_SEARCH_PAGE_SIZE
+    max_limit = settings.PRODUCT_SEARCH_MAX_PAGE_SIZE
+
+
+class ProductSearchView(generics.ListAPIView):
+    """
+    Full-text search of the catalog by name, manufacturer, category and
+    ingredients, e.g. /api/products/search/?q=milo choc&limit=20&offset=0.
+    The last word matches as a prefix, results are ordered by rank.
+    """
+
+    serializer_class = ProductSerializer
+    pagination_class = ProductSearchPagination
+
+    def get_queryset(self):
+        return search_products(self.request.query_params.get("q", ""))
+
+
+class BatchError(Exception):
+    pass
+
+
+def save_uploaded_image(uploaded_file):
+    """
+    Streams an uploaded file into the shared image store and returns the
+    container-absolute path for the Celery worker to use.
+    """
+    # Reads the file in chunks to efficiently handle large files
+    # without consuming too much memory.
+    return store_image_chunks(uploaded_file.chunks(), Path(uploaded_file.name).suffix)
+
+
+def save_encoded_image(data):
+    """
+    Saves a base64 encoded image to the shared image store. The extension
+    comes from the image header, so anything that is not an image is rejected.
+    """
+    try:
+        content = base64.b64decode(data, validate=True)
+        with Image.open(io.BytesIO(content)) as img:
+            extension = img.format.lower()
+    except (TypeError, ValueError, OSError):
+        raise BatchError("Invalid image data.")
+
+    return store_image_bytes(content, f".{extension}")
+
+
 class ProcessImagesView(APIView):
     permission_classes = [permissions.AllowAny]
 
@@ -53,45 +127,21 @@ class ProcessImagesView(APIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        image_paths = []
-
-        # 2. Ensure the media directory exists inside the container.
-        # This is a crucial step that prevents errors on the first upload.
-        os.makedirs(settings.MEDIA_ROOT, exist_ok=True)
-
-        for uploaded_file in images:
-            # 3. Generate a unique filename to prevent collisions.
-            # We use a UUID and preserve the original file extension.
-            original_extension = Path(uploaded_file.name).suffix
-            unique_filename = f"{uuid.uuid4()}{original_extension}"
-
-            # 4. Define the full, absolute path for saving the file inside the container.
-            save_path = os.path.join(settings.MEDIA_ROOT, unique_filename)
-
-            # 5. Save the uploaded file to the designated path.
-            # This logic reads the file in chunks to efficiently handle large files
-            # without consuming too much memory.
-            try:
-                with open(save_path, "wb+") as destination:
-                    for chunk in uploaded_file.chunks():
-                        destination.write(chunk)
-
-                # Append the container-absolute path for the Celery worker to use.
-                image_paths.append(save_path)
-
-            except IOError as e:
-                # Handle potential file system errors (e.g., disk full, permissions)
-                return Response(
-                    {"error": f"Failed to save file: {e}"},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                )
+        try:
+            image_paths = [save_uploaded_image(image) for image in images]
+        except IOError as e:
+            # Handle potential file system errors (e.g., disk full, permissions)
+            return Response(
+                {"error": f"Failed to save file: {e}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
 
-        # 6. If all files are saved successfully, dispatch the Celery task.
-        # The worker will receive a list of paths like: ['/code/media/uuid.jpg', ...]
-        task = process_product_images.delay(image_paths)
+        # 2. If all files are saved successfully, start the pipeline.
+        # The worker will receive a list of paths like: ['/code/media/images/3f/a2/3fa2...c9.jpg', ...]
+        job = process_product_images(image_paths)
         print(image_paths)
 
-        return Response({"task_id": task.id}, status=status.HTTP_202_ACCEPTED)
+        return Response({"task_id": job.task_id}, status=status.HTTP_202_ACCEPTED)
 
 
 class ProcessTextView(APIView):
@@ -108,19 +158,373 @@ class ProcessTextView(APIView):
         return Response({"task_id": task.id}, status=HTTP_202_ACCEPTED)
 
 
+def job_status_response(job):
+    """
+    Builds the polling response for an image identification job.
+    """
+    return Response(job_status_data(job), status=status.HTTP_200_OK)
+
+
+def task_result_data(task_id):
+    """
+    The status of a Celery task without a job, e.g. process_structured_text.
+    Unknown task ids are pending.
+    """
+    res = AsyncResult(task_id, app=app)
+
+    if res.state == "SUCCESS":
+        data = {"status": "success", "result": res.result}
+        if isinstance(res.result, dict) and "timings" in res.result:
+            # process_structured_text returns its spans next to the product
+            data.update(res.result)
+        return data
+    elif res.state == "FAILURE":
+        return {"status": "error", "error": str(res.result)}
+    elif res.state == "PROGRESS":
+        # Fields of a streamed extraction, see LLM_STREAM_PARTIAL
+        return {"status": "pending", "partial": res.info.get("partial")}
+    else:
+        return {"status": "pending"}
+
+
+def load_result_status(task_id):
+    """
+    The status of an image identification job, or else of the task.
+
+    Returns:
+        The status and whether it is the one of a job, whose updates are
+        published, task results are only polled.
+    """
+    # Jobs updated by the workers are read from Valkey, not the database
+    data = load_job_status(task_id)
+    if data is not None:
+        return data, True
+    return task_result_data(task_id), False
+
+
 class CheckResultView(APIView):
     permission_classes = [permissions.AllowAny]
 
     def get(self, request, task_id, *args, **kwargs):
-        res = AsyncResult(task_id, app=app)
+        data, _ = load_result_status(task_id)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+_load_result_status = sync_to_async(load_result_status)
+
+
+def _has_news(data, known_stage):
+    # Finished jobs, and jobs that moved past the stage the client knows about
+    return data["status"] != "pending" or (
+        known_stage is not None and data.get("stage") != known_stage
+    )
+
+
+def _wait_time(is_job, remaining):
+    # Nothing is published for task results, they are re-read instead
+    if is_job:
+        return remaining
+    return min(settings.JOB_EVENTS_POLL_INTERVAL, remaining)
+
+
+class WaitForResultView(View):
+    async def get(self, request, task_id, *args, **kwargs):
+        """
+        Long-poll variant of CheckResultView. Answers as soon as the job
+        finishes, or moves past ?stage= when given, and otherwise after
+        ?timeout= seconds with the pending status. Tasks without a job, like
+        process_structured_text, are re-read every JOB_EVENTS_POLL_INTERVAL
+        seconds until they finish.
+        """
+        try:
+            timeout = float(
+                request.GET.get("timeout", settings.RESULT_LONG_POLL_MAX_WAIT)
+            )
+        except ValueError:
+            return JsonResponse({"error": "timeout must be a number."}, status=400)
+        timeout = max(0.0, min(timeout, settings.RESULT_LONG_POLL_MAX_WAIT))
+        known_stage = request.GET.get("stage")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        async with JobSubscription(task_id) as subscription:
+            data, is_job = await _load_result_status(task_id)
+            while not _has_news(data, known_stage):
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                update = await subscription.get(_wait_time(is_job, remaining))
+                if update is None and is_job:
+                    break
+                data, is_job = await _load_result_status(task_id)
+        return JsonResponse(data)
 
-        if res.state == "SUCCESS":
+
+def _event_fingerprint(data):
+    return data.get("stage"), data["status"], data.get("partial")
+
+
+def _sse_event(data):
+    return f"event: update\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+class ResultEventsView(View):
+    async def get(self, request, task_id, *args, **kwargs):
+        """
+        Server-sent events stream of a job. An update event is sent with the
+        current state, on every stage change, partial product update and when
+        the job finishes, after which the stream ends. Tasks without a job are
+        re-read every JOB_EVENTS_POLL_INTERVAL seconds instead.
+        """
+        return StreamingHttpResponse(
+            self.events(task_id),
+            content_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async def events(self, task_id):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.RESULT_EVENTS_MAX_DURATION
+        async with JobSubscription(task_id) as subscription:
+            data, is_job = await _load_result_status(task_id)
+            yield _sse_event(data)
+            last_sent = loop.time()
+            while data["status"] == "pending":
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    # Clients reconnect, which also gets them the current state
+                    break
+                timeout = min(settings.RESULT_EVENTS_KEEPALIVE, remaining)
+                update = await subscription.get(_wait_time(is_job, timeout))
+                if update is not None or not is_job:
+                    previous = _event_fingerprint(data)
+                    data, is_job = await _load_result_status(task_id)
+                    if _event_fingerprint(data) != previous:
+                        yield _sse_event(data)
+                        last_sent = loop.time()
+                        continue
+                if loop.time() - last_sent >= settings.RESULT_EVENTS_KEEPALIVE:
+                    yield ": keepalive\n\n"
+                    last_sent = loop.time()
+
+
+class ResumeJobView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def post(self, request, task_id, *args, **kwargs):
+        """
+        Restarts a failed or stalled image identification job from its last
+        completed stage. A job that is still running is not resumed twice.
+        """
+        job = ProductIdentificationJob.objects.filter(task_id=task_id).first()
+        if job is None:
             return Response(
-                {"status": "success", "result": res.result}, status=status.HTTP_200_OK
+                {"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND
             )
-        elif res.state == "FAILURE":
+        if job.status == ProductIdentificationJob.STATUS_SUCCESS:
+            return job_status_response(job)
+
+        if not resume_identification_job(job):
             return Response(
-                {"status": "error", "error": str(res.result)}, status=status.HTTP_200_OK
+                {"error": "The job is still running.", "stage": job.stage},
+                status=status.HTTP_409_CONFLICT,
             )
-        else:
-            return Response({"status": "pending"}, status=status.HTTP_200_OK)
+        return Response(
+            {"task_id": job.task_id, "stage": job.last_completed_stage},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+def _read_multipart_batch(request):
+    # Every file field is one product, all files sent under the same
+    # field name are the images of that product.
+    return [
+        (reference, request.FILES.getlist(reference))
+        for reference in request.FILES.keys()
+    ]
+
+
+class BatchTooLarge(BatchError):
+    pass
+
+
+def _check_batch_item(index, images):
+    if not images or len(images) > settings.BATCH_MAX_IMAGES_PER_ITEM:
+        raise BatchError(
+            f"Item {index} must have between 1 and "
+            f"{settings.BATCH_MAX_IMAGES_PER_ITEM} images."
+        )
+
+
+def _save_batch_item(index, images, save_image):
+    image_paths = []
+    for image in images:
+        try:
+            image_paths.append(save_image(image))
+        except BatchError as e:
+            raise BatchError(f"Item {index}: {e}")
+    return image_paths
+
+
+def _save_multipart_batch(request):
+    items = _read_multipart_batch(request)
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise BatchError(f"A batch holds at most {settings.BATCH_MAX_ITEMS} items.")
+    for index, (_reference, images) in enumerate(items):
+        _check_batch_item(index, images)
+    return [
+        (reference, _save_batch_item(index, images, save_uploaded_image))
+        for index, (reference, images) in enumerate(items)
+    ]
+
+
+def _save_ndjson_batch(request):
+    # One product per line: {"reference": "...", "images": ["<base64>", ...]}.
+    # Every line is saved before the next one is read, only the paths of the
+    # stored images are kept.
+    items = []
+    stream = request.data
+    remaining = settings.BATCH_MAX_BODY_SIZE
+    number = 0
+    while stream is not None:
+        line = stream.readline(remaining + 1)
+        if not line:
+            break
+        remaining -= len(line)
+        if remaining < 0:
+            raise BatchTooLarge(
+                f"A batch holds at most {settings.BATCH_MAX_BODY_SIZE} bytes."
+            )
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            raise BatchError(f"Line {number} is not valid JSON.")
+        if not isinstance(item, dict) or not isinstance(item.get("images"), list):
+            raise BatchError(f"Line {number} has no images list.")
+        if len(items) == settings.BATCH_MAX_ITEMS:
+            raise BatchError(f"A batch holds at most {settings.BATCH_MAX_ITEMS} items.")
+        _check_batch_item(len(items), item["images"])
+        reference = item.get("reference")
+        image_paths = _save_batch_item(len(items), item["images"], save_encoded_image)
+        items.append((str(reference) if reference is not None else None, image_paths))
+    return items
+
+
+class ProcessImageBatchView(APIView):
+    permission_classes = [permissions.AllowAny]
+    parser_classes = [MultiPartParser, NDJSONStreamParser]
+
+    def post(self, request, *args, **kwargs):
+        """
+        Accepts the images of many products in one multipart or NDJSON
+        (application/x-ndjson) request and starts one job per product.
+        """
+        ndjson = request.content_type.startswith(NDJSONStreamParser.media_type)
+        try:
+            content_length = int(request.META.get("CONTENT_LENGTH") or 0)
+        except ValueError:
+            content_length = 0
+        if content_length > settings.BATCH_MAX_BODY_SIZE:
+            return Response(
+                {
+                    "error": f"A batch holds at most {settings.BATCH_MAX_BODY_SIZE} bytes."
+                },
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        try:
+            batch_items = (
+                _save_ndjson_batch(request)
+                if ndjson
+                else _save_multipart_batch(request)
+            )
+            if not batch_items:
+                raise BatchError("No items were provided.")
+        except (BatchError, IOError) as e:
+            # Nothing is started unless the whole batch could be saved. The
+            # images that were stored are shared with identical uploads, they are
+            # left to collect_stored_images.
+            if isinstance(e, BatchTooLarge):
+                return Response(
+                    {"error": str(e)},
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                )
+            if isinstance(e, BatchError):
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(
+                {"error": f"Failed to save file: {e}"},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+
+        batch = process_product_image_batch(batch_items)
+        return Response(
+            {
+                "batch_id": batch.batch_id,
+                "items": [
+                    {
+                        "index": job.batch_index,
+                        "reference": job.batch_reference,
+                        "task_id": job.task_id,
+                    }
+                    for job in batch.jobs.order_by("batch_index")
+                ],
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class CheckBatchResultView(APIView):
+    permission_classes = [permissions.AllowAny]
+
+    def get(self, request, batch_id, *args, **kwargs):
+        """
+        Returns the status of every item of a batch. Finished items carry
+        their result while the others are still running, ?status=pending,
+        success or error only returns the items in that state.
+        """
+        batch = ProductIdentificationBatch.objects.filter(batch_id=batch_id).first()
+        if batch is None:
+            return Response(
+                {"error": "Batch not found."}, status=status.HTTP_404_NOT_FOUND
+            )
+
+        wanted = request.query_params.get("status")
+        counts = {"pending": 0, "success": 0, "error": 0}
+        items = []
+        for job in batch.jobs.select_related("product").order_by("batch_index"):
+            item = job_status_data(job)
+            counts[item["status"]] += 1
+            if wanted and item["status"] != wanted:
+                continue
+            item.update(
+                index=job.batch_index,
+                reference=job.batch_reference,
+                task_id=job.task_id,
+            )
+            items.append(item)
+
+        return Response(
+            {
+                "batch_id": batch.batch_id,
+                "status": "pending" if counts["pending"] else "complete",
+                "counts": counts,
+                "items": items,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class MetricsView(View):
+    def get(self, request, *args, **kwargs):
+        """
+        Exports the pipeline histograms and counters in the Prometheus text format.
+        """
+        token = settings.METRICS_TOKEN
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            return HttpResponse(status=401)
+        return HttpResponse(
+            export_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+        )
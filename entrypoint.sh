@@ -9,7 +9,34 @@ if [ "$SERVICE_TYPE" = "web" ]; then
 
     exec daphne service.asgi:application --port 8000 --bind 0.0.0.0 -v 1
 elif [ "$SERVICE_TYPE" = "celery-worker" ]; then
-    exec celery -A service worker -l INFO --concurrency=2
+    # Single worker consuming every queue, for small deployments
+    exec celery -A service worker -l INFO --concurrency=2 \
+        -Q ocr,llm,housekeeping
+elif [ "$SERVICE_TYPE" = "celery-worker-ocr" ]; then
+    # CPU bound: one process per core, never prefetch more than one image job
+    exec celery -A service worker -l INFO -n ocr@%h -Q ocr \
+        --pool=prefork \
+        --concurrency="${OCR_WORKER_CONCURRENCY:-2}" \
+        --prefetch-multiplier="${OCR_WORKER_PREFETCH:-1}" \
+        --soft-time-limit="${OCR_WORKER_SOFT_TIME_LIMIT:-240}" \
+        --time-limit="${OCR_WORKER_TIME_LIMIT:-300}" \
+        -O fair
+elif [ "$SERVICE_TYPE" = "celery-worker-llm" ]; then
+    # Network bound: threads spend most of their time waiting on the LLM API
+    exec celery -A service worker -l INFO -n llm@%h -Q llm \
+        --pool=threads \
+        --concurrency="${LLM_WORKER_CONCURRENCY:-32}" \
+        --prefetch-multiplier="${LLM_WORKER_PREFETCH:-4}" \
+        --soft-time-limit="${LLM_WORKER_SOFT_TIME_LIMIT:-120}" \
+        --time-limit="${LLM_WORKER_TIME_LIMIT:-150}"
+elif [ "$SERVICE_TYPE" = "celery-worker-housekeeping" ]; then
+    # Low priority: emails and periodic cleanups
+    exec celery -A service worker -l INFO -n housekeeping@%h -Q housekeeping \
+        --pool=prefork \
+        --concurrency="${HOUSEKEEPING_WORKER_CONCURRENCY:-1}" \
+        --prefetch-multiplier="${HOUSEKEEPING_WORKER_PREFETCH:-1}" \
+        --soft-time-limit="${HOUSEKEEPING_WORKER_SOFT_TIME_LIMIT:-540}" \
+        --time-limit="${HOUSEKEEPING_WORKER_TIME_LIMIT:-600}"
 elif [ "$SERVICE_TYPE" = "celery-beat" ]; then
     exec celery -A service beat -l INFO  --scheduler django_celery_beat.schedulers:DatabaseScheduler --max-interval=5
 else
@@ -1,12 +1,46 @@
 import os
+import zlib
 
 from celery import Celery
+from celery.backends.base import KeyValueStoreBackend
 from celery.schedules import crontab
+from celery.signals import task_postrun
+from kombu.serialization import register
+from kombu.utils import json
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "service.settings")
+
+
+def _zjson_dumps(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":")).encode())
+
+
+def _zjson_loads(value):
+    return json.loads(zlib.decompress(value))
+
+
+# zlib compressed JSON keeps serialized products small in the result store
+register(
+    "zjson",
+    _zjson_dumps,
+    _zjson_loads,
+    content_type="application/x-zjson",
+    content_encoding="binary",
+)
+
 app = Celery("discovery")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
+
+
+@task_postrun.connect
+def apply_result_ttl(task_id=None, task=None, **kwargs):
+    # The result is stored before task_postrun, so its lifetime can be cut
+    # short here for tasks with a shorter TTL than CELERY_RESULT_EXPIRES
+    ttl = app.conf.get("result_ttls", {}).get(task.name)
+    backend = task.backend
+    if ttl and isinstance(backend, KeyValueStoreBackend) and not task.ignore_result:
+        backend.expire(backend.get_key_for_task(task_id), int(ttl))
@@ -49,10 +49,97 @@ DB_USER = os.environ.get("DB_USER")
 DB_PASSWORD = os.environ.get("DB_PASSWORD")
 DB_PORT = os.environ.get("DB_PORT")
 CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL")
-CELERY_RESULT_BACKEND = "django-db"
 CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
-CELERY_RESULT_SERIALIZER = "json"
+
+# Task results. With the default django-db backend they are stored in Postgres
+# and purged by the purge_task_results beat task, with a redis:// URL of the
+# Valkey instance they expire on their own. Results in Valkey are stored as
+# zlib compressed JSON (registered in service/celery.py).
+CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND", "django-db")
+CELERY_RESULT_EXPIRES = int(os.environ.get("CELERY_RESULT_EXPIRES", 86400))
+CELERY_RESULT_SERIALIZER = (
+    "json" if CELERY_RESULT_BACKEND.startswith("django-db") else "zjson"
+)
+CELERY_RESULT_ACCEPT_CONTENT = ["json", "zjson"]
+# Shorter lifetimes in seconds for the results of single tasks, applied by key
+# value result stores
+CELERY_RESULT_TTLS = {
+    "discovery.tasks.process_structured_text": int(
+        os.environ.get("STRUCTURED_TEXT_RESULT_TTL", 3600)
+    ),
+}
+CELERY_BEAT_SCHEDULE = {
+    "collect-stored-images": {
+        "task": "discovery.tasks.collect_stored_images",
+        "schedule": float(os.environ.get("IMAGE_GC_INTERVAL", 3600)),
+    },
+}
+if CELERY_RESULT_BACKEND == "django-db":
+    CELERY_BEAT_SCHEDULE["purge-task-results"] = {
+        "task": "discovery.tasks.purge_task_results",
+        "schedule": float(os.environ.get("RESULT_PURGE_INTERVAL", 3600)),
+    }
+
+# Incremental refresh of the FDA catalog from the FDA Ghana search API, every
+# FDA_REFRESH_INTERVAL seconds when it is set (e.g. 86400 for nightly). A refresh
+# that was interrupted continues from its last checkpoint. A run whose last chunk
+# committed less than FDA_RUN_STALL_TIMEOUT seconds ago is still in progress and
+# another run of the same source does not start.
+FDA_SEARCH_URL = os.environ.get(
+    "FDA_SEARCH_URL", "https://verifypermit.fdaghana.gov.gh/publicsearch"
+)
+FDA_PAGE_SIZE = int(os.environ.get("FDA_PAGE_SIZE", 500))
+FDA_REFRESH_INTERVAL = float(os.environ.get("FDA_REFRESH_INTERVAL", 0))
+FDA_RUN_STALL_TIMEOUT = float(os.environ.get("FDA_RUN_STALL_TIMEOUT", 900))
+if FDA_REFRESH_INTERVAL:
+    CELERY_BEAT_SCHEDULE["refresh-fda-catalog"] = {
+        "task": "discovery.tasks.refresh_fda_catalog",
+        "schedule": FDA_REFRESH_INTERVAL,
+    }
+
+# Job updates for the long-poll and SSE result endpoints are published on a
+# Valkey channel, the broker by default. Without a redis:// or valkey:// URL (e.g.
+# an amqp:// broker) the waiting clients re-read the job from the database every
+# JOB_EVENTS_POLL_INTERVAL seconds instead. With Valkey the status of a job is kept
+# there for JOB_STATUS_TTL seconds after its last update, and polled from there.
+# Structured text tasks have no job, their results are always re-read at the poll
+# interval.
+JOB_EVENTS_URL = os.environ.get("JOB_EVENTS_URL", CELERY_BROKER_URL)
+JOB_EVENTS_POLL_INTERVAL = float(os.environ.get("JOB_EVENTS_POLL_INTERVAL", 1))
+JOB_STATUS_TTL = int(os.environ.get("JOB_STATUS_TTL", 86400))
+RESULT_LONG_POLL_MAX_WAIT = float(os.environ.get("RESULT_LONG_POLL_MAX_WAIT", 30))
+RESULT_EVENTS_MAX_DURATION = float(os.environ.get("RESULT_EVENTS_MAX_DURATION", 300))
+RESULT_EVENTS_KEEPALIVE = float(os.environ.get("RESULT_EVENTS_KEEPALIVE", 15))
+
+# Stage duration histograms and token / cache hit counters, shared by all
+# processes through Valkey (the broker by default) and exported at /api/metrics.
+# When METRICS_TOKEN is set the endpoint requires "Authorization: Bearer <token>".
+METRICS_URL = os.environ.get("METRICS_URL", CELERY_BROKER_URL)
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Task routing
+# OCR is CPU bound and runs on a prefork pool, LLM calls are network bound and
+# run on a thread pool with a much higher concurrency. Anything that is not
+# routed explicitly (emails, beat housekeeping) lands on the low priority queue.
+# Worker concurrency, prefetch and time limits are set per queue in entrypoint.sh
+OCR_QUEUE = "ocr"
+LLM_QUEUE = "llm"
+HOUSEKEEPING_QUEUE = "housekeeping"
+CELERY_TASK_DEFAULT_QUEUE = HOUSEKEEPING_QUEUE
+CELERY_TASK_ROUTES = {
+    "discovery.tasks.barcode_stage": {"queue": OCR_QUEUE},
+    "discovery.tasks.visual_stage": {"queue": OCR_QUEUE},
+    "discovery.tasks.prepare_images_stage": {"queue": OCR_QUEUE},
+    "discovery.tasks.quality_stage": {"queue": OCR_QUEUE},
+    "discovery.tasks.ocr_stage": {"queue": OCR_QUEUE},
+    "discovery.tasks.reconstruct_stage": {"queue": OCR_QUEUE},
+    # The catalog index needs memory the LLM containers do not have
+    "discovery.tasks.match_stage": {"queue": OCR_QUEUE},
+    "discovery.tasks.infer_stage": {"queue": LLM_QUEUE},
+    "discovery.tasks.save_stage": {"queue": LLM_QUEUE},
+    "discovery.tasks.process_structured_text": {"queue": LLM_QUEUE},
+}
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -69,6 +156,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "django.contrib.sites",
+    "django.contrib.postgres",
     "oauth2_provider",
     "rest_framework",
     "discovery",
@@ -128,6 +216,130 @@ DATABASES = {
     }
 }
 
+# Barcode fast path, a decoded EAN/UPC/QR code of a known product skips OCR and the LLM
+BARCODE_FAST_PATH_ENABLED = (
+    os.environ.get("BARCODE_FAST_PATH_ENABLED", "true") == "true"
+)
+
+# Visual match, a new photo whose perceptual hash is within VISUAL_MATCH_MAX_DISTANCE
+# bits (out of 64) of a previously identified product skips OCR and the LLM.
+# The dHash of the candidate must also be within VISUAL_MATCH_MAX_DHASH_DISTANCE.
+VISUAL_MATCH_ENABLED = os.environ.get("VISUAL_MATCH_ENABLED", "true") == "true"
+VISUAL_MATCH_MAX_DISTANCE = int(os.environ.get("VISUAL_MATCH_MAX_DISTANCE", 6))
+VISUAL_MATCH_MAX_DHASH_DISTANCE = int(
+    os.environ.get("VISUAL_MATCH_MAX_DHASH_DISTANCE", 10)
+)
+VISUAL_INDEX_REFRESH = float(os.environ.get("VISUAL_INDEX_REFRESH", 60))
+
+# Batch identification, one request carries the images of many products
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 200))
+BATCH_MAX_IMAGES_PER_ITEM = int(os.environ.get("BATCH_MAX_IMAGES_PER_ITEM", 6))
+# Bytes of a batch request body, multipart or NDJSON
+BATCH_MAX_BODY_SIZE = int(os.environ.get("BATCH_MAX_BODY_SIZE", 512 * 2**20))
+# Multipart batches carry far more files than Django's default limit of 100
+DATA_UPLOAD_MAX_NUMBER_FILES = BATCH_MAX_ITEMS * BATCH_MAX_IMAGES_PER_ITEM
+
+# Catalog match, the prominent OCR lines of a known product skip the LLM.
+# Scores are trigram similarities between 0 and 1, the best match must lead the
+# runner up by CATALOG_MATCH_MARGIN so that product variants are not confused.
+# Every OCR worker process keeps a trigram index of the catalog, it picks up new
+# products after CATALOG_INDEX_TTL seconds and is rebuilt after edits.
+CATALOG_MATCH_ENABLED = os.environ.get("CATALOG_MATCH_ENABLED", "true") == "true"
+CATALOG_MATCH_THRESHOLD = float(os.environ.get("CATALOG_MATCH_THRESHOLD", 0.85))
+CATALOG_MATCH_MARGIN = float(os.environ.get("CATALOG_MATCH_MARGIN", 0.05))
+CATALOG_INDEX_TTL = float(os.environ.get("CATALOG_INDEX_TTL", 600))
+
+# Product search, pages of ranked results for the REST and GraphQL APIs
+PRODUCT_SEARCH_PAGE_SIZE = int(os.environ.get("PRODUCT_SEARCH_PAGE_SIZE", 20))
+PRODUCT_SEARCH_MAX_PAGE_SIZE = int(os.environ.get("PRODUCT_SEARCH_MAX_PAGE_SIZE", 100))
+
+# Image quality gate, runs before OCR.
+# Sharpness is the variance of the Laplacian, brightness the mean gray level and
+# contrast its standard deviation, all measured on a 1024px grayscale copy. Images
+# brighter than QUALITY_MAX_BRIGHTNESS are only rejected when they lack contrast.
+QUALITY_GATE_ENABLED = os.environ.get("QUALITY_GATE_ENABLED", "true") == "true"
+QUALITY_GATE_THRESHOLDS = {
+    "min_sharpness": float(os.environ.get("QUALITY_MIN_SHARPNESS", 40)),
+    "min_brightness": float(os.environ.get("QUALITY_MIN_BRIGHTNESS", 35)),
+    "max_brightness": float(os.environ.get("QUALITY_MAX_BRIGHTNESS", 235)),
+    "min_contrast": float(os.environ.get("QUALITY_MIN_CONTRAST", 15)),
+    "max_clipped": float(os.environ.get("QUALITY_MAX_CLIPPED", 0.4)),
+    "min_text_regions": int(os.environ.get("QUALITY_MIN_TEXT_REGIONS", 2)),
+}
+
+# Adaptive resolution OCR
+# A detection pass on a copy at most OCR_PROBE_MAX_SIDE pixels wide estimates the
+# text size, the image is then scaled down so that small text stays at least
+# OCR_TARGET_TEXT_HEIGHT pixels tall.
+OCR_ADAPTIVE_RESOLUTION = os.environ.get("OCR_ADAPTIVE_RESOLUTION", "true") == "true"
+OCR_PROBE_MAX_SIDE = int(os.environ.get("OCR_PROBE_MAX_SIDE", 1280))
+OCR_TARGET_TEXT_HEIGHT = int(os.environ.get("OCR_TARGET_TEXT_HEIGHT", 24))
+OCR_ADAPTIVE_MIN_SIDE = int(os.environ.get("OCR_ADAPTIVE_MIN_SIDE", 1280))
+OCR_DENSE_REGION_MIN_BOXES = int(os.environ.get("OCR_DENSE_REGION_MIN_BOXES", 8))
+
+# OCR inference backend: mkldnn, paddle, onnxruntime or int8 (see
+# discovery/services/ocr_backends.py). OCR_CPU_THREADS is per worker process, keep
+# OCR_CPU_THREADS * OCR_WORKER_CONCURRENCY at the number of cores of the container,
+# 0 leaves it to the runtime. The model directories hold custom or exported models,
+# the ONNX backends need them and the optional rapidocr_onnxruntime package.
+OCR_BACKEND = os.environ.get("OCR_BACKEND", "mkldnn")
+OCR_CPU_THREADS = int(os.environ.get("OCR_CPU_THREADS", 0))
+OCR_DET_MODEL_DIR = os.environ.get("OCR_DET_MODEL_DIR")
+OCR_REC_MODEL_DIR = os.environ.get("OCR_REC_MODEL_DIR")
+
+# Worker memory
+# A prefork child is replaced after the task during which its memory crossed
+# WORKER_MAX_MEMORY_MB (0 disables it), e.g. 1500 for two OCR processes in a 4GB
+# container. Images are never decoded at more than IMAGE_MAX_DECODE_PIXELS pixels.
+# A stage redelivered after its worker died more than STAGE_MAX_WORKER_LOST times
+# fails the job instead of killing the next worker. A pending or running job can
+# only be resumed once it was last updated JOB_STALL_TIMEOUT seconds ago, the
+# stages still queued for it are then revoked.
+CELERY_WORKER_MAX_MEMORY_PER_CHILD = (
+    int(os.environ.get("WORKER_MAX_MEMORY_MB", 0)) * 1024 or None
+)
+IMAGE_MAX_DECODE_PIXELS = int(os.environ.get("IMAGE_MAX_DECODE_PIXELS", 24_000_000))
+STAGE_MAX_WORKER_LOST = int(os.environ.get("STAGE_MAX_WORKER_LOST", 1))
+JOB_STALL_TIMEOUT = float(os.environ.get("JOB_STALL_TIMEOUT", 900))
+
+# LLM client
+# LLM_BASE_URL can point at a local stub server (manage.py run_llm_stub).
+# LLM_HEDGE_AFTER is the latency in seconds after which a duplicate request is
+# sent, 0 disables hedging. At most LLM_MAX_HEDGED_REQUESTS duplicates are in
+# flight on top of LLM_MAX_CONCURRENT_REQUESTS. The SDK does not retry requests,
+# the Celery tasks do.
+LLM_API_KEY = os.environ.get("LLM_API_KEY")
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL") or None
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-5-nano")
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 90))
+LLM_MAX_CONCURRENT_REQUESTS = int(os.environ.get("LLM_MAX_CONCURRENT_REQUESTS", 16))
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 32))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 60))
+LLM_HEDGE_AFTER = float(os.environ.get("LLM_HEDGE_AFTER", 0))
+LLM_MAX_HEDGED_REQUESTS = int(os.environ.get("LLM_MAX_HEDGED_REQUESTS", 2))
+
+# Streaming of the product extraction. The fields generated so far are stored on
+# the job (or the task state of process_structured_text) at most every
+# LLM_PARTIAL_INTERVAL seconds and returned as "partial" by the result endpoints.
+LLM_STREAM_PARTIAL = os.environ.get("LLM_STREAM_PARTIAL", "false") == "true"
+LLM_PARTIAL_INTERVAL = float(os.environ.get("LLM_PARTIAL_INTERVAL", 0.5))
+
+# Micro-batching of text-only identification (process_structured_text).
+# The texts that the threads of an LLM worker receive within LLM_BATCH_WINDOW
+# seconds are extracted with one completion of up to LLM_BATCH_MAX_ITEMS products.
+LLM_BATCH_ENABLED = os.environ.get("LLM_BATCH_ENABLED", "false") == "true"
+LLM_BATCH_WINDOW = float(os.environ.get("LLM_BATCH_WINDOW", 0.5))
+LLM_BATCH_MAX_ITEMS = int(os.environ.get("LLM_BATCH_MAX_ITEMS", 8))
+
+# LLM input encoding for reconstructed layouts, "json" or "compact".
+# The compact encoding drops blocks below LLM_INPUT_MIN_CONFIDENCE and trims the
+# least prominent blocks until the input fits LLM_INPUT_TOKEN_BUDGET (0 = no limit),
+# a job none of whose blocks is kept fails. Jobs keep the encoding they were
+# reconstructed with when the setting changes.
+LLM_INPUT_ENCODING = os.environ.get("LLM_INPUT_ENCODING", "json")
+LLM_INPUT_TOKEN_BUDGET = int(os.environ.get("LLM_INPUT_TOKEN_BUDGET", 3000))
+LLM_INPUT_MIN_CONFIDENCE = float(os.environ.get("LLM_INPUT_MIN_CONFIDENCE", 0.5))
+
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 EMAIL_HOST = "smtp.gmail.com"
 EMAIL_USE_TLS = True
@@ -189,6 +401,36 @@ USE_TZ = True
 STATIC_ROOT = BASE_DIR / "staticfiles"
 STATIC_URL = "discovery/static/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# Uploads and resized copies are stored under their content digest. Files that
+# no pending job or identified product references are deleted once they are
+# older than IMAGE_GC_MIN_AGE seconds, so that failed jobs can still be resumed
+# for a while.
+IMAGE_STORE_ROOT = os.path.join(MEDIA_ROOT, "images")
+RESIZED_IMAGE_ROOT = os.path.join(MEDIA_ROOT, "resized")
+IMAGE_GC_MIN_AGE = float(os.environ.get("IMAGE_GC_MIN_AGE", 86400))
+# Resumable uploads (/api/uploads/) are sent in chunks of at most
+# IMAGE_UPLOAD_MAX_CHUNK_SIZE bytes. They expire, with the bytes received so far,
+# when nothing was sent for IMAGE_GC_MIN_AGE seconds.
+IMAGE_UPLOAD_MAX_SIZE = int(os.environ.get("IMAGE_UPLOAD_MAX_SIZE", 100 * 2**20))
+IMAGE_UPLOAD_MAX_CHUNK_SIZE = int(
+    os.environ.get("IMAGE_UPLOAD_MAX_CHUNK_SIZE", 8 * 2**20)
+)
+# Resized WebP/JPEG variants of the images in MEDIA_ROOT (/api/images/), cached
+# up to IMAGE_DERIVATIVE_CACHE_SIZE bytes and encoded by IMAGE_DERIVATIVE_WORKERS
+# threads per web process.
+IMAGE_DERIVATIVE_ROOT = os.path.join(MEDIA_ROOT, "derivatives")
+IMAGE_DERIVATIVE_WIDTHS = [
+    int(width)
+    for width in os.environ.get("IMAGE_DERIVATIVE_WIDTHS", "160,320,640,1280").split(
+        ","
+    )
+]
+IMAGE_DERIVATIVE_QUALITY = int(os.environ.get("IMAGE_DERIVATIVE_QUALITY", 80))
+IMAGE_DERIVATIVE_CACHE_SIZE = int(
+    os.environ.get("IMAGE_DERIVATIVE_CACHE_SIZE", 2 * 2**30)
+)
+IMAGE_DERIVATIVE_WORKERS = int(os.environ.get("IMAGE_DERIVATIVE_WORKERS", 2))
+IMAGE_DERIVATIVE_MAX_AGE = int(os.environ.get("IMAGE_DERIVATIVE_MAX_AGE", 31536000))
 
 # Sync Settings
 TENANT_DB_ROOT = os.path.join(BASE_DIR, "tenant_databases")